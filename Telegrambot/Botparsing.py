@@ -7,36 +7,20 @@ print(f"[BOOT] Running on host IP: {ip}")
 import os  # <‑‑ needed before using os.getenv below
 VERBOSE_DEBUG = os.getenv("BOT_DEBUG") == "1"
 
-# helper for Istanbul time
-from datetime import datetime, timedelta, timezone
-
-def now_istanbul():
-    return datetime.now(timezone.utc) + timedelta(hours=3)
 # Confidence threshold: below this value leads are flagged for review
 CONF_THRESHOLD = 0.7
 import json
 import asyncio
 import logging
-from collections import Counter, deque
+from collections import Counter
 import atexit
 from functools import lru_cache
 import re
-# Regex to extract Russian/English words for stemming
-WORD_RE = re.compile(r"[а-яa-zё]+", re.IGNORECASE | re.UNICODE)
-
-import snowballstemmer
-_ru_stemmer = snowballstemmer.stemmer('russian')
-
-def _stem(word: str) -> str:
-    """Return lowercase snowball stem for Russian word."""
-    return _ru_stemmer.stemWord(word.lower())
-
-def _stem_in_text(needle: str, stems_set: set[str]) -> bool:
-    """True if stem(needle) присутствует в тексте (по стемам)."""
-    return _stem(needle) in stems_set
 
-import keep_alive  # стартует Flask-сервер для keep-alive
-from ai_utils import classify_text_with_ai, _classify_cache, apply_overrides
+import signal
+import sys
+import keep_alive  # health-check и /metrics (keep_alive.start() в main)
+from ai_utils import get_async_openai_client, _classify_cache, apply_overrides, override_rules
 
 import openai
 from openai import OpenAI
@@ -45,33 +29,96 @@ from openai import OpenAI
 from dotenv import load_dotenv
 from telethon import TelegramClient, events
 from telethon import Button
-from filters import extract_stems, is_similar, contains_negative
+from filters import contains_negative
+import speech_acts
+from stemmer import stemmer
 
-from config import ADMIN_ID, categories, metrics, logger, bot_client, subscriptions, save_subscriptions
+from config import ADMIN_ID, categories, keyword_matcher, routing_index, expiry_scheduler, category_reloader, tracer, metrics, logger, bot_client, subscriptions, save_subscriptions
+from metrics import histogram, gauge, collector
 
 # Persist metrics to JSON on shutdown
 def dump_metrics():
+    snapshot = dict(metrics)
+    snapshot["near_dup_suppressed_by_chat"] = dict(near_dups.suppressed_by_chat.most_common(100))
+    snapshot["stage_latency"] = tracer.summary()
+    snapshot["slow_samples"] = list(tracer.slow_samples)
+    snapshot["override_rules"] = {"version": override_rules.version, "rules": override_rules.stats()}
+    snapshot["stemmer"] = stemmer.stats()
+    snapshot["shards"] = shard_manager.health()
+    snapshot["audit_queue_depth"] = {log.name: log.queue_depth() for log in (rejected_log, low_confidence_log, preclassified_log)}
     with open("metrics.json", "w", encoding="utf-8") as mf:
-        json.dump(metrics, mf, ensure_ascii=False, indent=2)
+        json.dump(snapshot, mf, ensure_ascii=False, indent=2)
 
 atexit.register(dump_metrics)
+atexit.register(_classify_cache.close)
 
  # --- Deduplication with TTL ---
-MAX_SEEN_IDS = 50000
-# Keep track of recent message IDs for deduplication with TTL
-seen_queue = deque()
-seen_set = set()
+from dedup import MessageDeduper
+# (chat_id, msg_id) pairs seen within DEDUP_TTL, time-bucketed and checkpointed to disk
+deduper = MessageDeduper(
+    ttl=float(os.getenv("DEDUP_TTL", 48 * 3600)),
+    path=os.getenv("DEDUP_CHECKPOINT", "dedup.bin"),
+)
+DEDUP_CHECKPOINT_INTERVAL = int(os.getenv("DEDUP_CHECKPOINT_INTERVAL", 60))
+atexit.register(deduper.checkpoint)
+
+# --- Audit logs (rejected / low-confidence verdicts) ---
+from audit_log import AuditLog
+# Bounded queue + batched background writes; the handler never touches the file itself
+_audit_kwargs = dict(
+    max_queue=int(os.getenv("AUDIT_QUEUE_SIZE", 10000)),
+    batch_size=int(os.getenv("AUDIT_BATCH_SIZE", 500)),
+    flush_interval=float(os.getenv("AUDIT_FLUSH_INTERVAL", 1.0)),
+    max_bytes=int(os.getenv("AUDIT_MAX_BYTES", 5 * 1024 * 1024)),
+    backup_count=int(os.getenv("AUDIT_BACKUP_COUNT", 3)),
+    rotate_interval=float(os.getenv("AUDIT_ROTATE_INTERVAL", 7 * 24 * 3600)),
+    metrics=metrics,
+)
+rejected_log = AuditLog("ai_rejected.log", **_audit_kwargs)
+low_confidence_log = AuditLog("ai_low_confidence.log", **_audit_kwargs)
+atexit.register(rejected_log.flush_sync)
+atexit.register(low_confidence_log.flush_sync)
+
+# --- Local pre-classifier (python preclassifier.py train) ---
+from preclassifier import PreClassifier
+preclassifier = PreClassifier.load(os.getenv("PRECLASSIFIER_MODEL", "preclassifier.bin"))
+if preclassifier is not None:
+    if os.getenv("PRECLASSIFIER_THRESHOLD"):
+        preclassifier.threshold = float(os.getenv("PRECLASSIFIER_THRESHOLD"))
+    logger.info(f"Pre-classifier loaded: threshold {preclassifier.threshold:.3f}, meta {preclassifier.meta}")
+# Messages dropped locally, for periodic review and retraining
+preclassified_log = AuditLog("ai_preclassified.log", **_audit_kwargs)
+atexit.register(preclassified_log.flush_sync)
 
 # --- Periodic cleaner --------------------------------------------------------
 async def cleaner_task():
-    """Раз в сутки очищает seen_* и _classify_cache, чтобы не росла память."""
+    """Раз в сутки прореживает кэш классификации и почти-дубликаты (TTL/LRU, без полной очистки)."""
     while True:
         await asyncio.sleep(24 * 60 * 60)  # 24h
-        seen_queue.clear()
-        seen_set.clear()
-        _classify_cache.clear()
-        logger.info("🧹 Caches cleared (seen_queue, seen_set, classify_cache)")
+        removed = await asyncio.to_thread(_classify_cache.prune)
+        removed_dups = await asyncio.to_thread(near_dups.prune)
+        logger.info(f"🧹 Caches cleaned (classify_cache pruned {removed}, near_dups {removed_dups})")
+        top = ", ".join(f"{c}:{n}" for c, n in near_dups.suppressed_by_chat.most_common(5))
+        logger.info(f"Near-duplicate suppressions by chat (top): {top or '-'}")
+
+
+async def dedup_checkpoint_task():
+    """Периодически сохраняет снимок дедупликации: после рестарта повторы узнаются."""
+    while True:
+        await asyncio.sleep(DEDUP_CHECKPOINT_INTERVAL)
+        try:
+            deduper.checkpoint()
+        except Exception as e:
+            logger.error(f"Dedup checkpoint failed: {e}")
+
 
+OVERRIDES_RELOAD_INTERVAL = float(os.getenv("OVERRIDES_RELOAD_INTERVAL", 30))
+
+async def overrides_reload_task():
+    """Подхватывает правку overrides.json без рестарта (по mtime)."""
+    while True:
+        await asyncio.sleep(OVERRIDES_RELOAD_INTERVAL)
+        override_rules.reload_if_changed()
 
 
 # Load environment variables
@@ -88,263 +135,183 @@ if not bot_token:
 # Telegram user ID to receive manual payment proofs (replace with your ID)
 # ADMIN_ID moved to config.py
 
-# Initialize OpenAI client after API key is loaded
-client_ai = OpenAI(api_key=openai.api_key)
+# Initialize OpenAI client after API key is loaded (shared async client / connection pool)
+client_ai = get_async_openai_client()
+from ai_batch import ClassificationBatcher
+# Optional micro-batching: AI_BATCH_MAX_ITEMS > 1 groups messages arriving within AI_BATCH_WAIT_MS
+ai_batcher = ClassificationBatcher(
+    max_items=int(os.getenv("AI_BATCH_MAX_ITEMS", 1)),
+    max_wait_ms=float(os.getenv("AI_BATCH_WAIT_MS", 250)),
+    client_ai=client_ai,
+)
 
 from config import LOCATION_ALIAS
+from regions import RegionDetector
 # List of canonical display names
 CANONICAL_LOCATIONS = sorted(set(LOCATION_ALIAS.values()))
+# Token-level alias automaton with bounded-edit fallback, compiled once
+region_detector = RegionDetector(LOCATION_ALIAS)
 
 
 
 # Импортируем функцию отправки лидов из delivery.py
-from delivery import send_lead_to_users
-
-session_name = "bot_parser"
-client = TelegramClient(session_name, api_id, api_hash, connection_retries=1)
+from delivery import send_lead_to_users, notify_expired
+
+# Parser (user) sessions: PARSER_SESSIONS="bot_parser,parser2,..." – chats are split between
+# accounts through a persisted shard map, every session feeds the same pipeline (shards.py)
+from shards import ShardManager, ShardMap
+PARSER_SESSIONS = [s.strip() for s in os.getenv("PARSER_SESSIONS", "bot_parser").split(",") if s.strip()]
+parser_clients = {name: TelegramClient(name, api_id, api_hash, connection_retries=1) for name in PARSER_SESSIONS}
+shard_manager = ShardManager(PARSER_SESSIONS, ShardMap(os.getenv("SHARD_MAP_PATH", "shard_map.json")),
+                             metrics=metrics, logger=logger)
+collector(shard_manager.prometheus_lines)
+atexit.register(shard_manager.map.save)
+SHARD_REPORT_INTERVAL = float(os.getenv("SHARD_REPORT_INTERVAL", 300))
 
 # Bot client for UI and commands
 # bot_client moved to config.py
 import ui
 
+from entity_cache import EntityCache
+# Chat titles and sender names, resolved without a round-trip for repeat ids
+chat_cache = EntityCache("chat", maxsize=5000, ttl=int(os.getenv("CHAT_CACHE_TTL", 6 * 3600)), metrics=metrics)
+sender_cache = EntityCache("sender", maxsize=20000, ttl=int(os.getenv("SENDER_CACHE_TTL", 3600)), metrics=metrics)
+
+from near_dup import NearDupStore
+# Cross-posted ads: verdict per near-duplicate cluster, reused across chats for NEAR_DUP_WINDOW seconds
+near_dups = NearDupStore(
+    path=os.getenv("NEAR_DUP_DB", "near_dup.sqlite3"),
+    window=float(os.getenv("NEAR_DUP_WINDOW", 24 * 3600)),
+    max_clusters=int(os.getenv("NEAR_DUP_MAX_CLUSTERS", 20000)),
+    max_distance=int(os.getenv("NEAR_DUP_MAX_DISTANCE", 6)),
+    metrics=metrics,
+)
+atexit.register(near_dups.flush)
+
+
+# Scrape-time gauges: sizes and queue depths are read only when /metrics is requested
+gauge("subscribers", lambda: len(subscriptions), help="Users with saved preferences")
+gauge("subscribers_entitled", expiry_scheduler.entitled_count, help="Users with an active trial or subscription")
+gauge("dedup_keys", lambda: len(deduper))
+gauge("near_dup_clusters", lambda: len(near_dups))
+gauge("classify_cache_rows", lambda: len(_classify_cache))
+gauge("chat_cache_size", lambda: len(chat_cache))
+gauge("sender_cache_size", lambda: len(sender_cache))
+gauge("audit_rejected_queue_depth", rejected_log.queue_depth)
+gauge("audit_low_confidence_queue_depth", low_confidence_log.queue_depth)
+gauge("audit_preclassified_queue_depth", preclassified_log.queue_depth)
+
+_HANDLER_SECONDS = histogram("handler_seconds", help="NewMessage handler time, including AI and fan-out queueing")
+
+from pipeline import Pipeline
+# Message → lead logic; Telethon and OpenAI are only plugged in here (bench.py replays it offline)
+pipeline = Pipeline(
+    deduper=deduper,
+    near_dups=near_dups,
+    chat_cache=chat_cache,
+    sender_cache=sender_cache,
+    region_detector=region_detector,
+    location_alias=LOCATION_ALIAS,
+    canonical_locations=CANONICAL_LOCATIONS,
+    keyword_matcher=keyword_matcher,
+    routing_index=routing_index,
+    subscriptions=subscriptions,
+    categories=categories,
+    classify=ai_batcher.classify,
+    apply_overrides=apply_overrides,
+    deliver=send_lead_to_users,
+    rejected_log=rejected_log,
+    low_confidence_log=low_confidence_log,
+    metrics=metrics,
+    logger=logger,
+    conf_threshold=CONF_THRESHOLD,
+    verbose_debug=VERBOSE_DEBUG,
+    speech_acts=speech_acts.detect,
+    preclassifier=preclassifier,
+    preclassified_log=preclassified_log,
+)
+# categories.json reload swaps the keyword matcher the pipeline uses
+category_reloader.on_swap(lambda matcher: setattr(pipeline, "keyword_matcher", matcher))
+CATEGORIES_RELOAD_INTERVAL = float(os.getenv("CATEGORIES_RELOAD_INTERVAL", 30))
 
-@client.on(events.NewMessage)
-async def handler(event):
-    metrics['received'] += 1
-    # Deduplication with TTL: skip if already seen
-    if event.id in seen_set:
-        metrics['deduplicated'] += 1
-        return
-    # Add new ID and enforce max size
-    seen_queue.append(event.id)
-    seen_set.add(event.id)
-    if len(seen_queue) > MAX_SEEN_IDS:
-        old_id = seen_queue.popleft()
-        seen_set.remove(old_id)
-    # Only groups and channels
-    if not (event.is_group or event.is_channel):
-        return
-    chat_id = event.chat_id
-    # Ignore own messages
-    global SELF_ID
-    if event.sender_id == SELF_ID:
-        return
-    text = event.raw_text or ""
-    # Remove hashtags to avoid false matches
-    clean_text = re.sub(r'#\w+', '', text)
-    # Lowercase text for matching
-    lower_text = clean_text.lower()
-    # Pre‑compute set of stems in the message for fast membership test
-    stems_in_text = {_stem(tok) for tok in WORD_RE.findall(lower_text)}
-
-    dialog = await event.get_chat()
-    group_name = getattr(dialog, 'title', 'Без названия')
-
-    sender_entity = await event.get_sender()
-    if sender_entity:
-        sender_id = sender_entity.id
-        sender_name = getattr(sender_entity, 'first_name', None) or getattr(sender_entity, 'username', 'Неизвестный отправитель')
-        sender_username = getattr(sender_entity, 'username', None)
-    else:
-        # Fallback for channels without a user sender
-        sender_id = event.chat_id
-        sender_name = group_name
-        sender_username = None
-
-
-
-    # Determine region by group title first, then by message text
-    found_alias = None
-    title_lower = group_name.lower()
-    for alias in LOCATION_ALIAS:
-        if alias in title_lower or is_similar(alias, title_lower, threshold=60):
-            found_alias = alias
-            break
-    if not found_alias:
-        for alias in LOCATION_ALIAS:
-            if alias in lower_text or is_similar(alias, lower_text, threshold=60):
-                found_alias = alias
-                break
-    if not found_alias:
-        metrics['no_region'] += 1
-        return
-    region = LOCATION_ALIAS[found_alias]
-    metrics['region_detected'] += 1
-
-    # Heuristic category detection: match any category stem in text (support nested)
-    category_heuristic = None
-    for cat, stems in categories.items():
-        for stem in extract_stems(stems):
-            if _stem_in_text(stem.lower(), stems_in_text):
-                category_heuristic = cat
-                break
-        if category_heuristic:
-            break
-    if category_heuristic:
-        metrics['category_heuristic_detected'] += 1
-    else:
-        metrics['category_not_detected'] += 1
-    if found_alias and category_heuristic:
-        metrics['coverage_ok'] += 1
-
-    # User-specific pre-filter: check if any subscriber needs this region and category
-    # Find subscribers for this region
-    subscribers_for_region = [
-        prefs for prefs in subscriptions.values()
-        if region in prefs.get("locations", [])
-    ]
-    if not subscribers_for_region:
-        metrics['no_subscribers_for_region'] += 1
-        return
-    # Build stems set from all these subscribers' categories и их подкатегорий
-    stems_for_users = set()
-    stem_to_category = {}  # new: map stem → category we added it from
-    for prefs in subscribers_for_region:
-        # категории
-        for cat in prefs.get("categories", []):
-            for stem in extract_stems(categories.get(cat, {})):
-                stem_key = _stem(stem)
-                stems_for_users.add(stem_key)
-                stem_to_category.setdefault(stem_key, cat)
-        # подкатегории
-        for cat, sub_list in prefs.get("subcats", {}).items():
-            for sub in sub_list:
-                sub_entry = categories.get(cat, {}).get("subcategories", {}).get(sub, {})
-                for stem in extract_stems(sub_entry):
-                    stem_key = _stem(stem)
-                    stems_for_users.add(stem_key)
-                    stem_to_category.setdefault(stem_key, f"{cat}/{sub}")
-
-    user_stems = {s.lower() for s in stems_for_users}
-    # Detect and log first matched stem
-    matched_stem = next((s for s in user_stems if s in stems_in_text), None)
-    if not matched_stem:
-        metrics['no_category_match'] += 1
-        return
-    matched_cat = stem_to_category.get(matched_stem, "?")
-    logger.info(f"Keyword match: '{matched_stem}' → category '{matched_cat}'")
-    # AI classification with caching
-    try:
-        # Only use [category_heuristic] if present, else full list
-        cats_to_use = [category_heuristic] if category_heuristic else list(categories.keys())
-        cla = await asyncio.to_thread(
-            classify_text_with_ai,
-            text,
-            cats_to_use,
-            CANONICAL_LOCATIONS,
-            client_ai
-        )
-    except Exception as e:
-        logger.error(f"[AI ERROR] {e}")
-        return
-
-    # Override AI classification with heuristics and post-hoc rules
-    if isinstance(cla, dict):
-        cla["region"] = region
-        cla = apply_overrides(cla, lower_text, category_heuristic)
-
-    # Drop if no response or not relevant, with debug explanation
-    if not cla or not cla.get("relevant", False):
-        metrics['ai_dropped'] += 1
-        if VERBOSE_DEBUG:
-            logger.debug(f"AI dropped message: relevant={cla.get('relevant') if cla else None}")
-            relevant = cla.get("relevant") if isinstance(cla, dict) else None
-            explanation = cla.get("explanation") if isinstance(cla, dict) else None
-            logger.debug(f"AI dropped message. relevant={relevant}, explanation={explanation}, full={cla}")
-        # Append to ai_rejected.log with classification details and concise timestamp
-        try:
-            ts = now_istanbul().strftime("%m-%d %H:%M")
-            with open("ai_rejected.log", "a", encoding="utf-8") as rf:
-                rf.write(
-                    f"{ts} | {chat_id} ({group_name}) | {text} | "
-                    f"relevant:{cla.get('relevant')}, "
-                    f"category:{cla.get('category')}, "
-                    f"region:{cla.get('region')}, "
-                    f"explanation:{cla.get('explanation')}, "
-                    f"confidence:{cla.get('confidence')}\n"
-                )
-        except Exception as e:
-            logger.error(f"Failed to write to ai_rejected.log: {e}")
-        return
-
-    # Handle low-confidence yet relevant cases
-    confidence = cla.get("confidence", 0.0)
-    if confidence < CONF_THRESHOLD:
-        metrics['low_confidence'] += 1
-        logger.info(f"Low confidence ({confidence}) for message, flagging for review")
-        # Append to ai_low_confidence.log for later analysis
+
+def _make_handler(shard):
+    async def handler(event):
+        # A chat is read by one session; copies of its messages from other sessions stop here
+        if (event.is_group or event.is_channel) and not shard_manager.accept(shard, event.chat_id):
+            return
+        trace = tracer.start(f"{event.chat_id}/{event.id}", origin=event.date.timestamp() if event.date else None)
         try:
-            ts = now_istanbul().strftime("%m-%d %H:%M")
-            with open("ai_low_confidence.log", "a", encoding="utf-8") as lf:
-                lf.write(
-                    f"{ts} | {chat_id} ({group_name}) | {text} | "
-                    f"relevant:{cla.get('relevant')}, "
-                    f"category:{cla.get('category')}, "
-                    f"region:{cla.get('region')}, "
-                    f"explanation:{cla.get('explanation')}, "
-                    f"confidence:{confidence}\n"
-                )
-        except Exception as e:
-            logger.error(f"Failed to write to ai_low_confidence.log: {e}")
-        return
-
-    # Skip messages where the AI could not assign a category
-    detected_cat = cla.get("category") if isinstance(cla, dict) else None
-    if not detected_cat:
-        metrics['ai_no_category'] += 1
-        return
-
-    # Log relevant classification
-    logger.info(
-    f"{chat_id} ({group_name}) | {text} | "
-    f"relevant:{cla.get('relevant')}, "
-    f"category:{cla.get('category')}, "
-    f"region:{cla.get('region')}, "
-    f"explanation:{cla.get('explanation')}, "
-    f"confidence:{cla.get('confidence')}"
-)
-    # Optionally validate region/category but keep region from heuristics
-
-    # Build message link for supergroups
-    if str(chat_id).startswith("-100"):
-        short = str(chat_id)[4:]
-        link = f"https://t.me/c/{short}/{event.id}"
-    else:
-        link = ""
-    await send_lead_to_users(
-        chat_id,
-        group_name,
-        getattr(dialog, 'username', None),
-        sender_name,
-        sender_id,
-        sender_username,
-        text,
-        link,
-        region,
-        detected_category=detected_cat
-    )
+            await pipeline.process(event, trace)
+        finally:
+            tracer.finish(trace)
+            _HANDLER_SECONDS.observe(trace.total)
+    return handler
+
+
+for _shard, _client in parser_clients.items():
+    _client.add_event_handler(_make_handler(_shard), events.NewMessage)
+
 
 SELF_ID = None
 
 async def main():
     global SELF_ID
-    # Start parser (user) session
-    await client.start()
+    # Health-check and /metrics on PORT
+    keep_alive.start()
+    # Load dedup state before updates start flowing
+    loaded = deduper.load()
+    logger.info(f"Dedup checkpoint loaded: {loaded} recent message ids")
+    # Start parser (user) sessions; the dialog lists give chat membership per session
+    logger.info(f"Shard map loaded: {shard_manager.map.load()} chats")
+    for shard, client in parser_clients.items():
+        await client.start()
+        members = []
+        # Pre-warm chat titles from the dialog list
+        async for d in client.iter_dialogs():
+            if d.is_group or d.is_channel:
+                chat_cache.put(d.id, d.entity)
+                members.append(d.id)
+        shard_manager.set_members(shard, members)
+        shard_manager.connected(shard)
+    logger.info(f"Chat cache pre-warmed with {len(chat_cache)} dialogs")
+    logger.info(f"Chats per parser session: {shard_manager.balance()}, orphaned: {len(shard_manager.orphaned)}")
     # Start bot session
     await bot_client.start(bot_token=bot_token)
     me = await bot_client.get_me()
     SELF_ID = me.id
+    pipeline.self_id = SELF_ID
     logger.info(f"✅ Bot logged in as @{me.username} (id={me.id})")
-    logger.info("🚀 Both clients running")
+    logger.info(f"🚀 Bot and {len(parser_clients)} parser session(s) running")
+    # Users whose trial/subscription ended while the bot was down are notified first
+    backlog = expiry_scheduler.pending_expired(subscriptions)
+    logger.info(f"Entitled users: {expiry_scheduler.entitled_count()}, expired while offline: {len(backlog)}")
     if VERBOSE_DEBUG:
         logger.debug("Handler invoked, deduplication in place")
     await asyncio.gather(
-        client.run_until_disconnected(),
+        *(shard_manager.supervise(shard, client) for shard, client in parser_clients.items()),
+        shard_manager.run_reporter(SHARD_REPORT_INTERVAL),
         bot_client.run_until_disconnected(),
         cleaner_task(),
+        dedup_checkpoint_task(),
+        overrides_reload_task(),
+        category_reloader.run(CATEGORIES_RELOAD_INTERVAL),
+        expiry_scheduler.run(notify_expired, backlog=backlog),
+        rejected_log.run(),
+        low_confidence_log.run(),
+        preclassified_log.run(),
     )
 
+def _on_sigterm(signum, frame):
+    # Cloud Run stops the container with SIGTERM: exit through SystemExit so atexit hooks
+    # (metrics.json, dedup checkpoint, audit logs, subscriptions) still run
+    logger.info("📴 SIGTERM received, shutting down")
+    dump_metrics()
+    sys.exit(0)
+
+
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, _on_sigterm)
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
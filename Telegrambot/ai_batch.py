@@ -0,0 +1,164 @@
+r"""
+ai_batch.py
+Микро-батчинг классификации: несколько сообщений – один chat completion.
+
+ClassificationBatcher.classify() ставит сообщение в очередь и ждёт вердикт.
+Очередь сбрасывается, когда набралось max_items сообщений или прошло
+max_wait_ms от первого. Модели уходит пронумерованный список, ответ – JSON-массив
+вердиктов, который раздаётся ожидающим handler'ам. Если ответ не разобрался,
+каждое сообщение классифицируется отдельным запросом.
+
+max_items <= 1 выключает батчинг (прямой вызов classify_text_with_ai_async).
+
+Метрики: ai_batches, ai_batched_messages, ai_batch_size_max, ai_batch_wait_ms
+(добавленная задержка, сумма по сообщениям), ai_batch_tokens_saved (локальный
+подсчёт prompts.count_tokens), ai_batch_fallbacks.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import re
+import time
+from typing import List, Optional
+
+import ai_utils
+from ai_utils import (
+    _CLASSIFY_MODEL, _build_prompt, _cached_result, _classify_prepared_async,
+    _chat_completion_with_retry_async, _error_result, _postprocess_result,
+    _record_prompt_tokens, _select_subset, classify_text_with_ai_async,
+)
+from metrics import metrics
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class _Item:
+    __slots__ = ("text", "categories", "locations", "key", "messages", "raw_prompt", "future", "enqueued")
+
+    def __init__(self, text, categories, locations, key, messages, raw_prompt, future):
+        self.text = text
+        self.categories = categories
+        self.locations = locations
+        self.key = key
+        self.messages = messages
+        self.raw_prompt = raw_prompt
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class ClassificationBatcher:
+    def __init__(self, max_items: int = 1, max_wait_ms: float = 250, client_ai=None):
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000
+        self.client_ai = client_ai
+        self._pending: List[_Item] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    async def classify(self, text: str, categories: list, locations: list) -> dict:
+        if self.max_items <= 1:
+            return await classify_text_with_ai_async(text, categories, locations, self.client_ai)
+        key, messages, raw_prompt = _build_prompt(text, categories, locations)
+        cached = _cached_result(text, key)
+        if cached is not None:
+            return cached
+        loop = asyncio.get_running_loop()
+        item = _Item(text, categories, locations, key, messages, raw_prompt, loop.create_future())
+        self._pending.append(item)
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await item.future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _client(self):
+        if self.client_ai is None:
+            self.client_ai = ai_utils.get_async_openai_client()
+        return self.client_ai
+
+    def _batch_prompt(self, batch: List[_Item]):
+        joined = "\n".join(it.text for it in batch)
+        categories = list(dict.fromkeys(c for it in batch for c in it.categories))
+        locations = list(dict.fromkeys(l for it in batch for l in it.locations))
+        return ai_utils._prompt_builder.batch(
+            [it.text for it in batch],
+            _select_subset(categories, joined, limit=12),
+            _select_subset(locations, joined, limit=12),
+        )
+
+    @staticmethod
+    def _parse(content: str, size: int) -> Optional[List[dict]]:
+        try:
+            data = json.loads(_FENCE_RE.sub("", content.strip()))
+        except Exception:
+            return None
+        if not isinstance(data, list) or len(data) != size or not all(isinstance(d, dict) for d in data):
+            return None
+        if all("id" in d for d in data):
+            by_id = {}
+            for d in data:
+                try:
+                    by_id[int(d.pop("id"))] = d
+                except (TypeError, ValueError):
+                    return None
+            if sorted(by_id) != list(range(1, size + 1)):
+                return None
+            data = [by_id[i] for i in range(1, size + 1)]
+        return data
+
+    async def _run(self, batch: List[_Item]) -> None:
+        started = time.monotonic()
+        metrics['ai_batches'] += 1
+        metrics['ai_batched_messages'] += len(batch)
+        metrics['ai_batch_size_max'] = max(metrics['ai_batch_size_max'], len(batch))
+        metrics['ai_batch_wait_ms'] += sum(int((started - it.enqueued) * 1000) for it in batch)
+        client = self._client()
+        try:
+            if len(batch) == 1:
+                it = batch[0]
+                results = [await _classify_prepared_async(it.text, it.key, it.messages, it.raw_prompt, client)]
+            else:
+                prompt = self._batch_prompt(batch)
+                messages = prompt.messages
+                results = None
+                _record_prompt_tokens(prompt.tokens)
+                try:
+                    resp = await _chat_completion_with_retry_async(client, messages, model=_CLASSIFY_MODEL, temperature=0)
+                    content = resp.choices[0].message.content or ""
+                    verdicts = self._parse(content, len(batch))
+                except Exception as e:
+                    verdicts = None
+                    results = [_error_result(e) for _ in batch]
+                if verdicts is not None:
+                    single_tokens = sum(it.raw_prompt["tokens"] for it in batch)
+                    metrics['ai_batch_tokens_saved'] += max(0, single_tokens - prompt.tokens)
+                    raw_prompt = {"system": messages[0]["content"], "user": messages[1]["content"],
+                                  "tokens": prompt.tokens}
+                    results = [
+                        _postprocess_result(it.text, verdict, raw_prompt, content, it.key)
+                        for it, verdict in zip(batch, verdicts)
+                    ]
+                elif results is None:
+                    # Ответ не разобрался: по одному сообщению на запрос
+                    metrics['ai_batch_fallbacks'] += 1
+                    results = await asyncio.gather(*(
+                        _classify_prepared_async(it.text, it.key, it.messages, it.raw_prompt, client)
+                        for it in batch
+                    ))
+        except Exception as e:
+            results = [_error_result(e) for _ in batch]
+        for it, result in zip(batch, results):
+            if not it.future.done():
+                it.future.set_result(result)
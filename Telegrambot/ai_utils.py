@@ -6,35 +6,49 @@ import time
 import threading
 from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
 try:
-    from openai import OpenAI, RateLimitError, APIError, Timeout
+    # openai.Timeout – это конфиг таймаута httpx, а не исключение
+    from openai import OpenAI, AsyncOpenAI, RateLimitError, APIError, APITimeoutError as Timeout
 except ImportError:
     import openai
-    from openai import OpenAI  # клиент есть
+    from openai import OpenAI, AsyncOpenAI  # клиенты есть
     # shim: если в версии openai нет конкретных классов, подменяем Exception
     RateLimitError = getattr(openai, "RateLimitError", Exception)
     APIError = getattr(openai, "APIError", Exception)
-    Timeout = getattr(openai, "Timeout", Exception)
+    Timeout = getattr(openai, "APITimeoutError", Exception)
+
+from ratelimit import AsyncTokenBucket
+from classify_cache import ClassificationCache, category_versions
+from metrics import metrics, histogram, gauge, collector
+from prompts import PromptBuilder, TOKEN_COUNTER
+from overrides import OverrideRules
+import speech_acts
 
 DEBUG_PROMPT_TRACE = False
 
-import snowballstemmer
-_ru_stemmer = snowballstemmer.stemmer('russian')
+# Общий мемоизирующий стеммер (тот же кэш, что у keywords/regions)
+from stemmer import stem as _stem
 
-def _stem(word: str) -> str:
-    """Return lowercase snowball stem for Russian word."""
-    return _ru_stemmer.stemWord(word.lower())
+_CLASSIFY_MODEL = "gpt-4.1-nano"
 
 CONF_THRESHOLD = 0.7  # confidence threshold for auto-accepting leads
 
-# Простой ручной кэш, потому что списки (list) не хешируемы для lru_cache
-_classify_cache = {}
-_CLASSIFY_CACHE_MAXSIZE = 5000
+# Кэш вердиктов: горячий LRU + SQLite, ключ – отпечаток нормализованного текста.
+# Версия (промпт + модель) выставляется ниже, версии категорий – из config.
+_classify_cache = ClassificationCache(
+    path=os.getenv("CLASSIFY_CACHE_DB", "classify_cache.sqlite3"),
+    hot_size=int(os.getenv("CLASSIFY_CACHE_HOT_SIZE", "2000")),
+    ttl=float(os.getenv("CLASSIFY_CACHE_TTL", str(7 * 24 * 3600))),
+    max_rows=int(os.getenv("CLASSIFY_CACHE_MAX_ROWS", "200000")),
+    metrics=metrics,
+)
 
 # --- Rate‑limit settings ---
 _RATE_LIMIT_RPS = float(os.getenv("OPENAI_RPS", "3"))  # макс. запросов в секунду
 _MIN_INTERVAL = 1.0 / _RATE_LIMIT_RPS
 _last_call_ts = 0.0
 _rate_lock = threading.Lock()
+# Async path: token bucket honouring OPENAI_RPS with bursts up to OPENAI_BURST
+_async_limiter = AsyncTokenBucket(_RATE_LIMIT_RPS, burst=float(os.getenv("OPENAI_BURST", "5")))
 
 
 # Helper for rate-limit
@@ -49,45 +63,106 @@ def _apply_rate_limit():
         _last_call_ts = time.time()
 
 
+# Время одного запроса к OpenAI (каждая попытка отдельно, включая батчи)
+_AI_LATENCY = histogram("ai_latency_seconds", help="OpenAI chat.completions request latency")
+# Входные токены одного запроса (локальный подсчёт по собранному промпту)
+_AI_INPUT_TOKENS = histogram("ai_input_tokens", buckets=(250, 500, 750, 1000, 1250, 1500, 2000, 3000, 5000, 8000),
+                             help="Prompt tokens per chat.completions request, counted locally")
+
+
+def _record_prompt_tokens(tokens: int) -> None:
+    _AI_INPUT_TOKENS.observe(tokens)
+
+
+def _record_usage(resp) -> None:
+    """usage из ответа провайдера: сколько токенов оплачено и сколько взято из кэша префикса."""
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return
+    metrics['ai_usage_prompt_tokens'] += getattr(usage, "prompt_tokens", 0) or 0
+    metrics['ai_usage_completion_tokens'] += getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is not None:
+        metrics['ai_usage_cached_tokens'] += getattr(details, "cached_tokens", 0) or 0
+
+
 # Обёртка с retry
 @retry(
     wait=wait_exponential(min=1, max=60, multiplier=2),
     stop=stop_after_attempt(6),
     retry=retry_if_exception_type((RateLimitError, APIError, Timeout))
 )
-def _chat_completion_with_retry(client: OpenAI, messages: list, model: str = "gpt-4.1-nano", temperature: float = 0):
+def _chat_completion_with_retry(client: OpenAI, messages: list, model: str = _CLASSIFY_MODEL, temperature: float = 0):
     """Вызов chat.completions с rate‑limit и автоматическим back‑off."""
     _apply_rate_limit()
-    return client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-    )
+    started = time.perf_counter()
+    try:
+        resp = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+        )
+        _record_usage(resp)
+        return resp
+    finally:
+        _AI_LATENCY.observe(time.perf_counter() - started)
+
+@retry(
+    wait=wait_exponential(min=1, max=60, multiplier=2),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type((RateLimitError, APIError, Timeout))
+)
+async def _chat_completion_with_retry_async(client: AsyncOpenAI, messages: list, model: str = _CLASSIFY_MODEL, temperature: float = 0):
+    """Async-вызов chat.completions: ждёт token bucket без блокировки потоков."""
+    await _async_limiter.acquire()
+    started = time.perf_counter()
+    try:
+        resp = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+        )
+        _record_usage(resp)
+        return resp
+    finally:
+        _AI_LATENCY.observe(time.perf_counter() - started)
+
+def _client_options() -> dict:
+    """OPENAI_BASE_URL – другой endpoint (например, локальный fake_openai.py);
+    OPENAI_MAX_RETRIES – встроенные повторы SDK поверх tenacity (по умолчанию 2, как в SDK)."""
+    return {
+        "base_url": os.getenv("OPENAI_BASE_URL") or None,
+        "max_retries": int(os.getenv("OPENAI_MAX_RETRIES", "2")),
+    }
+
 
 # Инициализация клиента OpenAI (лениво, если не передан)
 def get_openai_client():
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY is not set in .env")
-    return OpenAI(api_key=api_key)
-
-# Вспомогательные детекторы
-_contact_regex = re.compile(r"(@[\w_]+|t\.me/[\w_\-]+|https?://t\.me/[\w_\-]+|\+?[\d\-\s\(\)]{7,}|whatsapp)", flags=re.IGNORECASE)
-_seller_patterns = [
-    r"\bпредлагаем\b", r"\bзабронируйте\b", r"\bузнайте стоимость\b", r"\bнаши услуги\b",
-    r"\bVIP\b", r"\bпревратите\b", r"\bскидк\b", r"\bдешевле\b", r"\bпродаем\b",
-    r"\bзабронируйте сейчас\b", r"\bзарезервируйте\b", r"\bспецпредложение\b", r"\bкупить сейчас\b", r"\bскидка на страховку\b"
-]
-
+    return OpenAI(api_key=api_key, **_client_options())
+
+_async_client = None
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """Один AsyncOpenAI на процесс: общий пул keep-alive соединений."""
+    global _async_client
+    if _async_client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY is not set in .env")
+        _async_client = AsyncOpenAI(api_key=api_key, timeout=float(os.getenv("OPENAI_TIMEOUT", "30")),
+                                    **_client_options())
+    return _async_client
+
+# Вспомогательные детекторы: один проход speech_acts вместо отдельных regex
 def contains_contact(s: str) -> bool:
-    return bool(_contact_regex.search(s))
+    return speech_acts.detect(s).contact
 
 
 def contains_seller_speech_act(s: str) -> bool:
-    for pat in _seller_patterns:
-        if re.search(pat, s, flags=re.IGNORECASE):
-            return True
-    return False
+    return speech_acts.detect(s).seller
 
 def _sanitize_result(result: dict) -> dict:
     # Ensure keys exist with defaults
@@ -160,78 +235,50 @@ def _select_subset(options: list[str], text: str, limit: int = 12) -> list[str]:
             break
     return unique_hits
 
-def classify_text_with_ai(text: str,
-                          categories: list,
-                          locations: list,
-                          client_ai=None) -> dict:
-    """
-    Возвращает dict с keys: relevant, category, region, explanation, confidence.
-    Может добавлять override_reason.
-    """
-    if client_ai is None:
-        client_ai = get_openai_client()
+# Промпт: неизменный system-префикс (инструкции + примеры), списки и текст – в конце
+_prompt_builder = PromptBuilder(metrics=metrics)
+gauge("prompt_prefix_tokens", lambda: _prompt_builder.prefix_tokens,
+      help=f"Tokens in the shared system prefix ({TOKEN_COUNTER})")
+gauge("prompt_blocks_cached", _prompt_builder.cache_size, help="Memoized category/location prompt blocks")
+
+# Любая правка промпта или смена модели делает старые записи кэша недействительными
+_classify_cache.version = f"{_CLASSIFY_MODEL}:{_prompt_builder.version}"
+
 
-    # Сформировать списки для промпта
+def _build_prompt(text: str, categories: list, locations: list):
+    """Возвращает (ключ кэша, messages, raw_prompt) для одного сообщения."""
     # Сокращаем списки — максимум 12 шт., сначала совпадения по тексту
     cat_subset = _select_subset(categories, text, limit=12)
     loc_subset = _select_subset(locations, text, limit=12)
-    category_list = ', '.join(f'"{cat}"' for cat in cat_subset)
-    location_list = ', '.join(f'"{loc}"' for loc in loc_subset)
-
-    # Ключ для кэша (преобразуем списки в кортежи)
-    key = (text, tuple(cat_subset), tuple(loc_subset))
-    if key in _classify_cache:
-        return _classify_cache[key].copy()
-
-    system_prompt = (
-        """
-Ты — профессиональный классификатор запросов и лидов для Telegram. Цель: максимально точно определить, является ли входящее сообщение запросом услуги (лидом) или рекламным/продающим. Приоритетное правило: если сообщение содержит контактные данные (телефон, @username, ссылки вида t.me/...) и одновременно написано от лица продавца/организатора (например: предлагаем, забронируйте, узнайте стоимость, наши услуги, VIP, скидка, дешевле, продаем, забронируйте сейчас), то это реклама: relevant=false. Речь заинтересованного пользователя (вопрос, просьба): нужен, хочу, сколько стоит, подскажите и пр. — это лид. Отвечай только одним валидным JSON-объектом с ключами: relevant (boolean), category (одно из: """ + category_list + """ или null), region (одно из: """ + location_list + """ или null), explanation (короткая строка до 70 символов), confidence (число от 0.0 до 1.0). Модель должна варьировать confidence в зависимости от неоднозначности (напр., сомнительные сигналов: 0.4-0.7; явные лиды/реклама: около 0.9). Никаких списков или лишних ключей.
-"""
-    )
-
-    user_prompt = (
-        f"""
-Примеры:
-Сообщение: 'Нужен трансфер из Анталии в Кемер завтра' Ответ: {{"relevant": true, "category": "трансфер", "region": "Анталия", "explanation": "Запрос трансфера"}}
-Сообщение: 'Сколько стоит экскурсия в Памуккале?' Ответ: {{"relevant": true, "category": "экскурсии", "region": "Памуккале", "explanation": "Уточнение цены"}}
-Сообщение: 'Не интересует аренда скутеров' Ответ: {{"relevant": false, "category": "аренда", "region": null, "explanation": "Отказ от услуги"}}
-Сообщение: 'Экскурсия ТУРЕЦКИЙ ДИСНЕЙЛЕНД, дешевле чем в кассе. Узнать стоимость и забронировать билеты. По вопросам: @vip' Ответ: {{"relevant": false, "category": null, "region": null, "explanation": "Реклама/продажа"}}
-Сообщение: 'Может возьмём экскурсию и трансфер вместе позже' Ответ: {{"relevant": true, "category": "экскурсии", "region": null, "explanation": "Неоднозначный интерес"}}
-Сообщение: 'Хочу узнать, но ещё не уверен' Ответ: {{"relevant": true, "category": null, "region": null, "explanation": "Запрос с неуверенностью"}}
-Сообщение: 'Трансфер из аэропорта Анталии, звоните +7 999 1234567, забронируйте сейчас!' Ответ: {{"relevant": false, "category": null, "region": null, "explanation": "Реклама/продажа"}}
-Сообщение: 'Может возьму экскурсию позже, пока присматриваюсь' Ответ: {{"relevant": false, "category": null, "region": null, "explanation": "Неуверенный интерес"}}
-Анализируй это сообщение:
-\"\"\"{text}\"\"\"
-"""
-    )
-
-    # Store raw prompt for debug/tracing
+
+    # Ключ для кэша: отпечаток текста без контактов/эмодзи/пробелов
+    key = _classify_cache.key(text)
+
+    prompt = _prompt_builder.single(text, cat_subset, loc_subset)
+    # Store raw prompt for debug/tracing (+ локальный подсчёт входных токенов)
     raw_prompt = {
-        "system": system_prompt,
-        "user": user_prompt
+        "system": prompt.messages[0]["content"],
+        "user": prompt.messages[1]["content"],
+        "tokens": prompt.tokens,
+    }
+    return key, prompt.messages, raw_prompt
+
+
+def _error_result(e: Exception) -> dict:
+    return {
+        "relevant": False,
+        "category": None,
+        "region": None,
+        "explanation": f"OpenAI error: {e}",
+        "confidence": 0.0,
+        "accepted": False,
+        "error": True,
     }
 
-    try:
-        resp = _chat_completion_with_retry(
-            client_ai,
-            [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            model="gpt-4.1-nano",
-            temperature=0,
-        )
-    except (RateLimitError, APIError, Timeout, Exception) as e:
-        return {
-            "relevant": False,
-            "category": None,
-            "region": None,
-            "explanation": f"OpenAI error: {e}",
-            "confidence": 0.0,
-            "accepted": False,
-        }
-    content = resp.choices[0].message.content.strip()
-    raw_model_output = content
+
+def _finalize_result(text: str, content: str, raw_prompt: dict, key=None) -> dict:
+    """Разбор ответа модели → итоговый dict (+ кэширование по key)."""
+    content = content.strip()
     try:
         result = json.loads(content)
     except Exception as e:
@@ -243,69 +290,125 @@ def classify_text_with_ai(text: str,
             "confidence": 0.0,
             "raw": content,
             "accepted": False,
+            "error": True,
             "raw_prompt": raw_prompt,
-            "raw_model_output": raw_model_output,
+            "raw_model_output": content,
         }
-    # Sanitize, calibrate, and sanitize again (single clear flow)
-    result = _sanitize_result(result)
-    raw_conf = result.get("confidence", 0.0)
-    result["confidence"] = calibrate_confidence(raw_conf)
-    result = _sanitize_result(result)
+    return _postprocess_result(text, result, raw_prompt, content, key)
+
 
-    # Post-override: self-promo detection only
-    text_lower = text.lower()
-    if result.get("relevant") and contains_contact(text_lower) and contains_seller_speech_act(text_lower):
+def _self_promo_override(text: str, result: dict) -> dict:
+    """Post-override: self-promo detection only."""
+    if not result.get("relevant"):
+        return result
+    acts = speech_acts.detect(text.lower())
+    if acts.contact and acts.seller:
         result["relevant"] = False
         result["explanation"] = "Self-promo с контактами"
         result["confidence"] = min(result.get("confidence", 1.0), 0.4)
         result["override_reason"] = "self_promo"
         result["category"] = None
         result = _sanitize_result(result)
+    return result
+
+
+def _cached_result(text: str, key):
+    """Вердикт из кэша (с self-promo override по исходному тексту) или None."""
+    cached = _classify_cache.get(key)
+    if cached is None:
+        return None
+    return _self_promo_override(text, cached)
+
+
+def _postprocess_result(text: str, result: dict, raw_prompt: dict, raw_model_output: str, key=None) -> dict:
+    """Санитизация, калибровка, self-promo override и кэширование одного вердикта."""
+    # Sanitize, calibrate, and sanitize again (single clear flow)
+    result = _sanitize_result(result)
+    raw_conf = result.get("confidence", 0.0)
+    result["confidence"] = calibrate_confidence(raw_conf)
+    result = _sanitize_result(result)
+
+    # Кешируем вердикт до override: ключ не учитывает контакты, а override от них зависит
+    if key is not None:
+        _classify_cache.put(key, result)
+
+    result = _self_promo_override(text, result)
 
     # Attach prompt and model output for trace/debug only if DEBUG_PROMPT_TRACE
     if DEBUG_PROMPT_TRACE:
         result["raw_prompt"] = raw_prompt
         result["raw_model_output"] = raw_model_output
 
-    # Кешируем результат (копию) и ограничиваем размер
-    if len(_classify_cache) >= _CLASSIFY_CACHE_MAXSIZE:
-        _classify_cache.pop(next(iter(_classify_cache)))
-    _classify_cache[key] = result.copy()
-
     return result
 
-# --- apply_overrides and helpers moved from Botparsing.py ---
-def apply_overrides(cla, lower_text, category_heuristic):
+def classify_text_with_ai(text: str,
+                          categories: list,
+                          locations: list,
+                          client_ai=None) -> dict:
     """
-    Post‑hoc override logic for classification adjustment (heuristics only).
+    Синхронная обёртка (для test_classification.py и скриптов).
+    Возвращает dict с keys: relevant, category, region, explanation, confidence.
+    Может добавлять override_reason.
     """
-    if category_heuristic:
-        cla["category"] = category_heuristic
+    if client_ai is None:
+        client_ai = get_openai_client()
+    key, messages, raw_prompt = _build_prompt(text, categories, locations)
+    cached = _cached_result(text, key)
+    if cached is not None:
+        return cached
+    _record_prompt_tokens(raw_prompt["tokens"])
+    try:
+        resp = _chat_completion_with_retry(client_ai, messages, model=_CLASSIFY_MODEL, temperature=0)
+    except (RateLimitError, APIError, Timeout, Exception) as e:
+        return _error_result(e)
+    return _finalize_result(text, resp.choices[0].message.content, raw_prompt, key)
+
+
+async def classify_text_with_ai_async(text: str,
+                                      categories: list,
+                                      locations: list,
+                                      client_ai: AsyncOpenAI = None) -> dict:
+    """
+    То же, что classify_text_with_ai, но на AsyncOpenAI: не занимает потоки
+    executor'а, rate-limit – через asyncio token bucket.
+    """
+    if client_ai is None:
+        client_ai = get_async_openai_client()
+    key, messages, raw_prompt = _build_prompt(text, categories, locations)
+    cached = _cached_result(text, key)
+    if cached is not None:
+        return cached
+    return await _classify_prepared_async(text, key, messages, raw_prompt, client_ai)
 
-    lower = lower_text
 
-    sale_words = ["продается", "продаю", "продам", "продажа", "куплю", "инвестировать", "вложение", "вложиться"]
-    rent_supply = ["сдам", "сдаю", "сдаётся", "сдается", "арендодатель"]
-    rent_demand = ["сниму", "нужна квартира", "ищу аренду", "арендатор", "хочу снять"]
-    transfer_indicators = [
-        "из аэропорта", "в аэропорт", "встреча", "шаттл", "такси", "подвоз", "трансфер", "поездка", "водитель", "подвезти"
-    ]
+async def _classify_prepared_async(text: str, key, messages: list, raw_prompt: dict, client_ai: AsyncOpenAI) -> dict:
+    """Один запрос к модели по уже собранному промпту (используется и батчером)."""
+    _record_prompt_tokens(raw_prompt["tokens"])
+    try:
+        resp = await _chat_completion_with_retry_async(client_ai, messages, model=_CLASSIFY_MODEL, temperature=0)
+    except (RateLimitError, APIError, Timeout, Exception) as e:
+        return _error_result(e)
+    return _finalize_result(text, resp.choices[0].message.content, raw_prompt, key)
 
-    # Продажа/инвестиции (недвижимость)
+# --- apply_overrides and helpers moved from Botparsing.py ---
+# Override rules from overrides.json; Botparsing re-reads the file when it changes
+# (default path is next to this module, not relative to the working directory)
+override_rules = OverrideRules(
+    os.getenv("OVERRIDES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "overrides.json")),
+    metrics=metrics,
+)
+collector(override_rules.prometheus_lines)
 
-    # Аренда: supply vs demand
 
-    # Трансферные индикаторы
-    if any(ind in lower for ind in transfer_indicators):
-        cla["category"] = "трансфер"
+def apply_overrides(cla, lower_text, category_heuristic):
+    """
+    Post‑hoc override logic for classification adjustment (heuristics only).
+    """
+    if category_heuristic:
+        cla["category"] = category_heuristic
 
-    # Реклама страховки: salesy без вопроса
-    if "страховка" in lower:
-        question_indicators = ["сколько стоит", "нужна", "хочу", "подскажите", "как получить", "какая", "можно ли"]
-        salesy = any(w in lower for w in ["купить", "оформить", "предлагаем", "продаем", "продаю", "выгодно"])
-        if salesy and not any(q in lower for q in question_indicators):
-            cla["relevant"] = False
-            cla["explanation"] = "Реклама страховки"
+    # Текстовые правила (трансфер, реклама страховки, …) – overrides.json
+    override_rules.apply(cla, lower_text)
 
     # Калибровка confidence: если эвристика совпадает и низкая уверенность, чуть поднимаем
     conf = cla.get("confidence", 0.0)
@@ -322,6 +425,10 @@ def _stem_in_text(needle: str, stems_set: set[str]) -> bool:
 # --- Exports ---------------------------------------------------------------
 __all__ = [
     "classify_text_with_ai",
+    "classify_text_with_ai_async",
+    "get_async_openai_client",
     "apply_overrides",
+    "override_rules",
     "_classify_cache",
+    "category_versions",
 ]
\ No newline at end of file
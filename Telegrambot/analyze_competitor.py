@@ -15,15 +15,10 @@ try:
 except Exception:
     morph = None  # lemmatization unavailable
 
-# Speech-act markers (compiled for performance)
-REQUEST_MARKERS = [re.compile(p, re.IGNORECASE) for p in [
-    r"\bхочу\b", r"\bищу\b", r"\bнужн[аоы]?\b", r"\bсколько стоит\b", r"\bподскажите\b", r"\bсниму\b",
-    r"\bнужна\b", r"\bпомогите\b", r"\bкак добраться\b", r"\bгде взять\b"
-]]
-OFFER_MARKERS = [re.compile(p, re.IGNORECASE) for p in [
-    r"\bсдам\b", r"\bпрода(?:ёт|ётся|ется)\b", r"\bпредлага(?:ем|ется)\b", r"\bузнать стоимость\b", r"\bбез комиссии\b",
-    r"\bдепозит\b", r"\bот собственника\b", r"\bаренда недвижимость\b"
-]]
+# Speech-act markers (compiled for performance); the lists are shared with speech_acts
+from speech_acts import OFFER_WORDS, REQUEST_WORDS, marker_patterns
+REQUEST_MARKERS = [re.compile(p, re.IGNORECASE) for p in marker_patterns(REQUEST_WORDS)]
+OFFER_MARKERS = [re.compile(p, re.IGNORECASE) for p in marker_patterns(OFFER_WORDS)]
 
 # stopwords to drop completely from analysis
 BASE_STOPWORDS = {
@@ -0,0 +1,151 @@
+r"""
+audit_log.py
+Асинхронный журнал аудита (ai_rejected.log, ai_low_confidence.log).
+
+• write(line) вызывается из handler и никогда не блокирует event loop:
+  строка кладётся в ограниченную очередь; если очередь полна, запись
+  отбрасывается и считается в метриках (audit_<name>_dropped);
+• фоновая задача run() забирает строки пачками (до batch_size или раз в
+  flush_interval) и пишет их одним вызовом через aiofiles;
+• ротация по размеру (max_bytes, backup_count файлов .1 … .N, как у
+  RotatingFileHandler) и по времени (rotate_interval секунд);
+• flush_sync() дописывает остаток очереди синхронно (atexit).
+"""
+
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from typing import List, Optional
+
+try:
+    import aiofiles
+except ImportError:  # aiofiles не установлен: запись в пуле потоков
+    aiofiles = None
+
+_log = logging.getLogger(__name__)
+
+
+class AuditLog:
+    def __init__(self, path: str, name: Optional[str] = None, max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 1.0, max_bytes: int = 5 * 1024 * 1024, backup_count: int = 3,
+                 rotate_interval: Optional[float] = None, metrics: Optional[Counter] = None):
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_interval = rotate_interval
+        self.metrics = metrics if metrics is not None else Counter()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._size = os.path.getsize(path) if os.path.exists(path) else 0
+        self._opened = time.time()
+        # строки, уже вынутые из очереди, но ещё не записанные (на случай отмены задачи)
+        self._carry: List[str] = []
+
+    # --- путь записи (handler) -------------------------------------------------
+    def write(self, line: str) -> bool:
+        """Поставить строку в очередь; False – очередь полна, строка отброшена."""
+        if not line.endswith("\n"):
+            line += "\n"
+        try:
+            self._queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.metrics[f"audit_{self.name}_dropped"] += 1
+            return False
+        depth = self._queue.qsize()
+        key = f"audit_{self.name}_queue_max"
+        if depth > self.metrics[key]:
+            self.metrics[key] = depth
+        return True
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    # --- фоновая запись ----------------------------------------------------------
+    def _drain(self, first: Optional[str] = None) -> List[str]:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    def _needs_rollover(self, incoming: int) -> bool:
+        if self.max_bytes and self._size and self._size + incoming > self.max_bytes:
+            return True
+        return bool(self.rotate_interval and self._size and time.time() - self._opened >= self.rotate_interval)
+
+    def _rollover(self) -> None:
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            if os.path.exists(self.path):
+                os.replace(self.path, f"{self.path}.1")
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        self._size = 0
+        self._opened = time.time()
+        self.metrics[f"audit_{self.name}_rotations"] += 1
+
+    def _write_blocking(self, data: str) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+    async def _write_batch(self, batch: List[str]) -> None:
+        data = "".join(batch)
+        encoded = len(data.encode("utf-8"))
+        if self._needs_rollover(encoded):
+            await asyncio.to_thread(self._rollover)
+        if aiofiles is not None:
+            async with aiofiles.open(self.path, "a", encoding="utf-8") as f:
+                await f.write(data)
+        else:
+            await asyncio.to_thread(self._write_blocking, data)
+        self._size += encoded
+        self.metrics[f"audit_{self.name}_written"] += len(batch)
+        self.metrics[f"audit_{self.name}_batches"] += 1
+
+    async def run(self) -> None:
+        """Фоновая задача: пачка копится до batch_size строк или flush_interval секунд."""
+        while True:
+            self._carry = [await self._queue.get()]
+            # Первая строка уже взята; неполную пачку добираем не дольше flush_interval
+            if self._queue.qsize() + 1 < self.batch_size:
+                await asyncio.sleep(self.flush_interval)
+            batch = self._drain(self._carry[0])
+            self._carry = batch
+            try:
+                await self._write_batch(batch)
+            except Exception as e:
+                _log.error(f"Failed to write {len(batch)} lines to {self.path}: {e}")
+                self.metrics[f"audit_{self.name}_dropped"] += len(batch)
+                self.metrics[f"audit_{self.name}_write_errors"] += 1
+            self._carry = []
+
+    async def flush(self) -> None:
+        while not self._queue.empty():
+            await self._write_batch(self._drain())
+
+    def flush_sync(self) -> None:
+        """Синхронно дописать остаток очереди (при остановке, вне event loop)."""
+        lines, self._carry = self._carry, []
+        while True:
+            try:
+                lines.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        if not lines:
+            return
+        data = "".join(lines)
+        if self._needs_rollover(len(data.encode("utf-8"))):
+            self._rollover()
+        self._write_blocking(data)
+        self._size += len(data.encode("utf-8"))
+        self.metrics[f"audit_{self.name}_written"] += len(lines)
@@ -0,0 +1,353 @@
+# bench.py
+"""
+Офлайн-прогон полного конвейера (pipeline.Pipeline) на корпусах
+summary/competitor_leads*.jsonl – без Telegram и (по умолчанию) без OpenAI.
+
+• источник событий: каждая строка корпуса → фейковый NewMessage (чат по
+  source_group, уникальный msg_id, event.date = момент подачи);
+• подписки синтетические (--users), все с действующим доступом;
+• --ai fake: классификатор-заглушка с задержкой --ai-latency-ms
+  (relevant, если нет маркеров продавца filters.contains_negative; категория –
+  эвристика keywords); --ai openai: настоящий ai_batcher (OPENAI_* из .env);
+  --ai fake-http: настоящий ai_batcher против fake_openai.py в этом же процессе
+  (--api-latency, --api-error-rate, --api-burst – ретраи и rate-limit ai_utils
+  работают как в бою);
+• локальный предклассификатор – как в бою: модель --preclassifier (по
+  умолчанию PRECLASSIFIER_MODEL / preclassifier.bin) подключается, если файл
+  есть; --no-preclassifier – прогон без него;
+• приёмник рассылки записывает получателей (routing.select_recipients) вместо
+  отправки.
+
+    python bench.py summary/competitor_leads*.jsonl --users 500 --rate 0
+    python bench.py --repeat 5 --rate 50 --ai-latency-ms 400 --json bench.json
+
+Отчёт: msgs/sec, p50/p95/p99 по этапам, воронка по ключам metrics, число
+вызовов AI, пиковая память (ru_maxrss).
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timezone
+
+# Кэш вердиктов не должен попадать в рабочую базу
+os.environ.setdefault("CLASSIFY_CACHE_DB", ":memory:")
+
+from ai_utils import apply_overrides
+from audit_log import AuditLog
+from dedup import MessageDeduper
+from entity_cache import EntityCache
+from filters import contains_negative
+from keywords import KeywordMatcher
+from locations import LOCATION_ALIAS
+from metrics import metrics
+from near_dup import NearDupStore
+from pipeline import Pipeline
+from preclassifier import PreClassifier
+from regions import RegionDetector
+from routing import RoutingIndex, select_recipients
+import speech_acts
+from tracing import Tracer
+
+# Ключи metrics в порядке воронки handler → delivery
+FUNNEL = [
+    "received", "deduplicated", "near_dup_dropped", "no_region", "region_detected",
+    "no_subscribers_for_region", "no_category_match", "speech_act_rejected",
+    "preclassifier_dropped", "preclassifier_passed", "near_dup_reused", "ai_dropped",
+    "low_confidence", "ai_no_category", "pref_category_skipped", "pref_ai_category_skipped",
+    "leads_queued",
+]
+
+
+class FakeChat:
+    def __init__(self, chat_id, title, username=None):
+        self.id = chat_id
+        self.title = title
+        self.username = username
+
+
+class FakeSender:
+    def __init__(self, sender_id):
+        self.id = sender_id
+        self.first_name = f"user{sender_id}"
+        self.username = None
+
+
+class FakeEvent:
+    """Поля и корутины NewMessage, которые использует Pipeline."""
+
+    is_group = True
+    is_channel = False
+
+    def __init__(self, chat, msg_id, text, sender_id, latency=0.0):
+        self.chat_id = chat.id
+        self.id = msg_id
+        self.raw_text = text
+        self.sender_id = sender_id
+        self.date = datetime.now(timezone.utc)
+        self._chat = chat
+        self._latency = latency
+
+    async def get_chat(self):
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        return self._chat
+
+    async def get_sender(self):
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        return FakeSender(self.sender_id)
+
+
+class FakeClassifier:
+    """Заглушка ai_batcher.classify: фиксированная задержка, детерминированный вердикт."""
+
+    def __init__(self, latency=0.3):
+        self.latency = latency
+        self.calls = 0
+
+    async def classify(self, text, categories, locations):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        seller = contains_negative(text.lower())
+        return {
+            "relevant": not seller,
+            "category": categories[0] if len(categories) == 1 else None,
+            "region": None,
+            "explanation": "bench",
+            "confidence": 0.9,
+        }
+
+
+class RecordingSink:
+    """Вместо delivery.send_lead_to_users: только выбор получателей и запись."""
+
+    def __init__(self, routing_index):
+        self.routing_index = routing_index
+        self.leads = 0
+        self.deliveries = 0
+
+    async def __call__(self, chat_id, group_name, group_username, sender_name, sender_id, sender_username,
+                       text, link, region, detected_category=None, kw_match=None, trace=None, **kwargs):
+        recipients = select_recipients(self.routing_index.snapshot, region, kw_match, detected_category,
+                                       metrics=metrics)
+        if trace is not None:
+            trace.lap("delivery_route")
+        self.leads += 1
+        self.deliveries += len(recipients)
+        metrics['leads_queued'] += len(recipients)
+
+
+def load_records(paths):
+    records = []
+    for path in paths:
+        for line in open(path, encoding="utf-8"):
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if rec.get("text"):
+                records.append(rec)
+    return records
+
+
+def synthetic_subscriptions(categories, regions, n, seed=7):
+    rnd = random.Random(seed)
+    names = list(categories)
+    now = datetime.now(timezone.utc).isoformat()
+    subs = {}
+    for i in range(n):
+        cats = rnd.sample(names, rnd.randint(1, 3))
+        subcats = {}
+        for cat in cats:
+            sub_names = list(categories[cat].get("subcategories", {}))
+            if sub_names:
+                subcats[cat] = rnd.sample(sub_names, rnd.randint(1, len(sub_names)))
+        subs[str(100000 + i)] = {
+            "locations": rnd.sample(regions, rnd.randint(1, 3)),
+            "categories": cats,
+            "subcats": subcats,
+            "trial_start": now,
+        }
+    return subs
+
+
+def chat_for(source, cache={}):
+    chat = cache.get(source)
+    if chat is None:
+        chat_id = -(1000000000000 + zlib.crc32(source.encode("utf-8")))
+        chat = cache[source] = FakeChat(chat_id, source.lstrip("@"))
+    return chat
+
+
+async def run(args):
+    with open("categories.json", encoding="utf-8") as f:
+        categories = json.load(f)
+    records = load_records(args.paths)
+    if not records:
+        print("No messages loaded")
+        return None
+    records = (records * args.repeat)[:args.limit] if args.limit else records * args.repeat
+    regions = sorted(set(LOCATION_ALIAS.values()))
+
+    log = logging.getLogger("bench")
+    log.setLevel(logging.WARNING)
+    tracer = Tracer(slow_threshold=float("inf"), metrics=metrics)
+    matcher = KeywordMatcher(categories)
+    subscriptions = synthetic_subscriptions(categories, regions, args.users)
+    routing_index = RoutingIndex(subscriptions, matcher=matcher)
+    sink = RecordingSink(routing_index)
+    preclassifier = None if args.no_preclassifier else PreClassifier.load(args.preclassifier)
+    if preclassifier is not None and args.preclassifier_threshold is not None:
+        preclassifier.threshold = args.preclassifier_threshold
+    if preclassifier is None and not args.no_preclassifier:
+        print(f"Pre-classifier model {args.preclassifier} not found: replaying without it", file=sys.stderr)
+
+    fake_ai = fake_api = None
+    if args.ai == "fake":
+        fake_ai = FakeClassifier(args.ai_latency_ms / 1000)
+        classify = fake_ai.classify
+    else:
+        if args.ai == "fake-http":
+            from fake_openai import FakeOpenAIServer, FaultPlan, parse_burst
+            fake_api = FakeOpenAIServer(faults=FaultPlan(
+                args.api_latency, error_rate=args.api_error_rate,
+                bursts=[parse_burst(b) for b in args.api_burst], seed=1,
+            ))
+            os.environ["OPENAI_BASE_URL"] = fake_api.start()
+            os.environ.setdefault("OPENAI_API_KEY", "fake")
+        from ai_batch import ClassificationBatcher
+        from ai_utils import get_async_openai_client
+        batcher = ClassificationBatcher(max_items=args.batch, max_wait_ms=args.batch_wait_ms,
+                                        client_ai=get_async_openai_client())
+        classify = batcher.classify
+
+    tmp = tempfile.TemporaryDirectory()
+    rejected_log = AuditLog(os.path.join(tmp.name, "ai_rejected.log"), metrics=metrics)
+    low_confidence_log = AuditLog(os.path.join(tmp.name, "ai_low_confidence.log"), metrics=metrics)
+    preclassified_log = AuditLog(os.path.join(tmp.name, "ai_preclassified.log"), metrics=metrics)
+    sinks = [asyncio.create_task(log.run()) for log in (rejected_log, low_confidence_log, preclassified_log)]
+
+    pipeline = Pipeline(
+        deduper=MessageDeduper(),
+        near_dups=NearDupStore(path=None, metrics=metrics),
+        chat_cache=EntityCache("chat", metrics=metrics),
+        sender_cache=EntityCache("sender", metrics=metrics),
+        region_detector=RegionDetector(LOCATION_ALIAS),
+        location_alias=LOCATION_ALIAS,
+        canonical_locations=regions,
+        keyword_matcher=matcher,
+        routing_index=routing_index,
+        subscriptions=subscriptions,
+        categories=categories,
+        classify=classify,
+        apply_overrides=apply_overrides,
+        deliver=sink,
+        rejected_log=rejected_log,
+        low_confidence_log=low_confidence_log,
+        metrics=metrics,
+        logger=log,
+        speech_acts=None if args.no_speech_acts else speech_acts.detect,
+        preclassifier=preclassifier,
+        preclassified_log=preclassified_log,
+    )
+
+    async def handle(event):
+        trace = tracer.start(f"{event.chat_id}/{event.id}", origin=event.date.timestamp())
+        try:
+            await pipeline.process(event, trace)
+        finally:
+            tracer.finish(trace)
+
+    rnd = random.Random(3)
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    tasks = []
+    started = time.perf_counter()
+    for msg_id, rec in enumerate(records, 1):
+        chat = chat_for(rec.get("source_group") or "bench")
+        event = FakeEvent(chat, msg_id, rec["text"], rnd.randint(1, 50000), args.telegram_latency_ms / 1000)
+        tasks.append(asyncio.create_task(handle(event)))
+        if interval:
+            await asyncio.sleep(max(0.0, started + msg_id * interval - time.perf_counter()))
+        elif msg_id % 256 == 0:
+            await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    for task in sinks:
+        task.cancel()
+    tmp.cleanup()
+
+    if fake_ai is not None:
+        ai_calls = fake_ai.calls
+    elif fake_api is not None:
+        ai_calls = fake_api.stats["requests"]
+        fake_api.stop()
+    else:
+        ai_calls = metrics['ai_batches'] or metrics['classify_cache_miss']
+    return {
+        "messages": len(records),
+        "seconds": round(elapsed, 3),
+        "msgs_per_sec": round(len(records) / elapsed, 1),
+        "ai_calls": ai_calls,
+        "preclassifier_threshold": preclassifier.threshold if preclassifier is not None else None,
+        "leads": sink.leads,
+        "deliveries": sink.deliveries,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "funnel": {key: metrics[key] for key in FUNNEL},
+        "stages": tracer.summary(),
+    }
+
+
+def print_report(report):
+    print(f"Messages: {report['messages']} in {report['seconds']:.2f}s → {report['msgs_per_sec']:.1f} msgs/sec")
+    print(f"AI calls: {report['ai_calls']}, leads: {report['leads']}, deliveries: {report['deliveries']}")
+    threshold = report["preclassifier_threshold"]
+    print(f"Pre-classifier: {'off' if threshold is None else f'threshold {threshold:.3f}'}")
+    print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+    print("\nFunnel:")
+    for key, value in report["funnel"].items():
+        print(f"  {key:<28}{value:>8}")
+    print("\nStages (ms):       count      p50      p95      p99")
+    for stage, row in report["stages"].items():
+        print(f"  {stage:<16}{row['count']:>7}{row.get('p50_ms', 0):>9.2f}{row.get('p95_ms', 0):>9.2f}{row.get('p99_ms', 0):>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="*", help="Paths to competitor leads .jsonl files")
+    parser.add_argument("--users", type=int, default=500, help="Number of synthetic subscribers")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the corpus N times (new msg ids)")
+    parser.add_argument("--limit", type=int, default=0, help="Max messages to replay (0 = all)")
+    parser.add_argument("--rate", type=float, default=0, help="Arrival rate, msgs/sec (0 = full speed)")
+    parser.add_argument("--ai", choices=["fake", "fake-http", "openai"], default="fake")
+    parser.add_argument("--ai-latency-ms", type=float, default=300, help="Fake classifier latency")
+    parser.add_argument("--api-latency", default="lognormal:400:0.5", help="fake-http latency distribution (fake_openai.py)")
+    parser.add_argument("--api-error-rate", type=float, default=0.0, help="fake-http random 5xx fraction")
+    parser.add_argument("--api-burst", action="append", default=[], help="fake-http CODE:SECONDS:EVERY")
+    parser.add_argument("--batch", type=int, default=1, help="AI_BATCH_MAX_ITEMS for --ai openai")
+    parser.add_argument("--batch-wait-ms", type=float, default=250, help="AI_BATCH_WAIT_MS for --ai openai/fake-http")
+    parser.add_argument("--no-speech-acts", action="store_true", help="Disable the offer-with-contacts prefilter")
+    parser.add_argument("--preclassifier", default=os.getenv("PRECLASSIFIER_MODEL", "preclassifier.bin"),
+                        help="Pre-classifier model (used when the file exists)")
+    parser.add_argument("--preclassifier-threshold", type=float, default=None,
+                        help="Override the model's threshold (PRECLASSIFIER_THRESHOLD in production)")
+    parser.add_argument("--no-preclassifier", action="store_true", help="Replay without the pre-classifier")
+    parser.add_argument("--telegram-latency-ms", type=float, default=0, help="get_chat/get_sender latency on cache miss")
+    parser.add_argument("--json", metavar="PATH", help="Also write the report as JSON")
+    args = parser.parse_args()
+    args.paths = args.paths or sorted(glob.glob("summary/competitor_leads*.jsonl"))
+    report = asyncio.run(run(args))
+    if report is None:
+        sys.exit(1)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,106 @@
+# bench_match_plan.py
+"""
+Микробенчмарк персонального фильтра подписчика в delivery.
+
+Сравнивает прежнюю проверку (на каждый лид и каждого подписчика: extract_stems
+по его категориям/подкатегориям + `kw.lower() in text.lower()` по каждому
+keyword) с routing.MatchPlan (пересечение множеств keyword_id с KeywordMatch,
+посчитанным один раз на лид).
+
+    python bench_match_plan.py summary/competitor_leads*.jsonl --users 500
+
+Пользователи синтетические: случайные категории/подкатегории из categories.json.
+"""
+import argparse
+import glob
+import json
+import random
+import time
+
+from filters import extract_stems
+from keywords import KeywordMatcher
+from routing import compile_plan
+
+
+def legacy_wants(prefs, categories, text):
+    keywords = []
+    for cat in prefs.get("categories", []):
+        keywords.extend(extract_stems(categories.get(cat, {})))
+    for cat, sub_list in prefs.get("subcats", {}).items():
+        for sub in sub_list:
+            sub_entry = categories.get(cat, {}).get("subcategories", {}).get(sub, {})
+            keywords.extend(extract_stems(sub_entry))
+    keywords = [str(k) for k in keywords]
+    return any(kw.lower() in text.lower() for kw in keywords)
+
+
+def synthetic_users(categories, n, seed=11):
+    rnd = random.Random(seed)
+    names = list(categories)
+    users = []
+    for _ in range(n):
+        cats = rnd.sample(names, rnd.randint(1, 3))
+        subcats = {}
+        for cat in cats:
+            subs = list(categories[cat].get("subcategories", {}))
+            if subs:
+                subcats[cat] = rnd.sample(subs, rnd.randint(1, len(subs)))
+        users.append({"categories": cats, "subcats": subcats, "locations": ["Анталия"]})
+    return users
+
+
+def load_texts(paths, limit):
+    texts = []
+    for path in paths:
+        for line in open(path, encoding="utf-8"):
+            try:
+                texts.append(json.loads(line).get("text", ""))
+            except json.JSONDecodeError:
+                continue
+    return texts[:limit]
+
+
+def main(paths, users=500, limit=300):
+    with open("categories.json", encoding="utf-8") as f:
+        categories = json.load(f)
+    matcher = KeywordMatcher(categories)
+    subs = synthetic_users(categories, users)
+    texts = load_texts(paths, limit)
+    if not texts:
+        print("No messages loaded")
+        return
+    pairs = len(texts) * len(subs)
+
+    t0 = time.perf_counter()
+    legacy = [legacy_wants(p, categories, t) for t in texts for p in subs]
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    plans = [compile_plan(p, matcher) for p in subs]
+    t_compile = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    leads = [matcher.match(t.lower()).keyword_ids for t in texts]
+    t_lead = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    planned = [not plan.keyword_ids.isdisjoint(ids) for ids in leads for plan in plans]
+    t_plan = time.perf_counter() - t0
+
+    agree = sum(1 for a, b in zip(legacy, planned) if a == b)
+    print(f"Leads: {len(texts)}, users: {len(subs)}, (lead, user) pairs: {pairs:,}")
+    print(f"Legacy extract_stems + substring: {t_legacy * 1e6 / pairs:8.2f} µs/pair")
+    print(f"MatchPlan check:                  {t_plan * 1e6 / pairs:8.2f} µs/pair")
+    print(f"  + once per lead (tokens/stems): {t_lead * 1e6 / len(texts):8.1f} µs/lead")
+    print(f"  + once per filter change:       {t_compile * 1e6 / len(subs):8.1f} µs/user")
+    print(f"Speed-up per lead at {len(subs)} users: x{t_legacy / (t_plan + t_lead):.1f}")
+    print(f"Agreement with substring check: {agree}/{pairs} ({agree / pairs * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="*", help="Paths to competitor leads .jsonl files")
+    parser.add_argument("--users", type=int, default=500, help="Number of synthetic subscribers")
+    parser.add_argument("--limit", type=int, default=300, help="Max leads to replay")
+    args = parser.parse_args()
+    main(args.paths or sorted(glob.glob("summary/competitor_leads*.jsonl")), users=args.users, limit=args.limit)
@@ -0,0 +1,130 @@
+# bench_regions.py
+"""
+Бенчмарк детектора регионов на корпусах summary/competitor_leads*.jsonl.
+
+Сравнивает прежнюю логику handler (substring + RapidFuzz partial_ratio ≥ 60 по
+каждому алиасу, сначала по заголовку, затем по тексту) с regions.RegionDetector:
+скорость на сообщение и согласие результатов.
+
+    python bench_regions.py summary/competitor_leads*.jsonl --pad 300
+
+--pad N добавляет N синтетических алиасов, чтобы оценить масштабирование на
+газетир из сотен турецких населённых пунктов.
+"""
+import argparse
+import glob
+import json
+import random
+import re
+import time
+from collections import Counter
+
+from filters import is_similar
+from regions import RegionDetector
+
+from locations import LOCATION_ALIAS
+
+
+def legacy_detect(aliases, title_lower, lower_text):
+    for alias in aliases:
+        if alias in title_lower or is_similar(alias, title_lower, threshold=60):
+            return aliases[alias]
+    for alias in aliases:
+        if alias in lower_text or is_similar(alias, lower_text, threshold=60):
+            return aliases[alias]
+    return None
+
+
+def split_title(raw_text: str):
+    """Заголовок группы – всё до первой пустой строки (если она есть)."""
+    parts = re.split(r"\n\s*\n", raw_text, maxsplit=1)
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    return "", raw_text
+
+
+def synthetic_aliases(n: int, seed: int = 7) -> dict:
+    rnd = random.Random(seed)
+    letters = "абвгдежзиклмнопрстуфхцчшэюя"
+    out = {}
+    while len(out) < n:
+        name = "".join(rnd.choice(letters) for _ in range(rnd.randint(5, 10)))
+        out[name] = name.capitalize()
+    return out
+
+
+def load_messages(paths):
+    messages = []
+    for path in paths:
+        for line in open(path, encoding="utf-8"):
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            title, body = split_title(item.get("text", ""))
+            lower_text = re.sub(r'#\w+', '', body).lower()
+            messages.append((title.lower(), lower_text))
+    return messages
+
+
+def main(paths, pad=0, show=10):
+    aliases = dict(LOCATION_ALIAS)
+    aliases.update(synthetic_aliases(pad))
+    messages = load_messages(paths)
+    if not messages:
+        print("No messages loaded")
+        return
+
+    detector = RegionDetector(aliases)
+
+    t0 = time.perf_counter()
+    legacy = [legacy_detect(aliases, title, text) for title, text in messages]
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    new = []
+    for title, text in messages:
+        hit = detector.first(title) or detector.first(text)
+        new.append(hit.region if hit else None)
+    t_new = time.perf_counter() - t0
+
+    total = len(messages)
+    agree = sum(1 for a, b in zip(legacy, new) if a == b)
+    outcomes = Counter()
+    for a, b in zip(legacy, new):
+        if a == b:
+            outcomes["agree"] += 1
+        elif a and not b:
+            outcomes["legacy_only"] += 1
+        elif b and not a:
+            outcomes["detector_only"] += 1
+        else:
+            outcomes["different_region"] += 1
+
+    print(f"Messages: {total}, aliases: {len(aliases)} (padding {pad})")
+    print(f"Legacy fuzzy scan: {t_legacy * 1e6 / total:8.1f} µs/msg  ({total / t_legacy:,.0f} msg/s)")
+    print(f"RegionDetector:    {t_new * 1e6 / total:8.1f} µs/msg  ({total / t_new:,.0f} msg/s)")
+    print(f"Speed-up: x{t_legacy / t_new:.1f}")
+    print(f"Agreement: {agree}/{total} ({agree / total * 100:.1f}%)")
+    for k, v in outcomes.most_common():
+        print(f"  {k}: {v}")
+
+    if show:
+        print(f"\nFirst {show} disagreements (legacy → detector):")
+        shown = 0
+        for (title, text), a, b in zip(messages, legacy, new):
+            if a != b:
+                snippet = (title + " | " + text).replace("\n", " ")[:120]
+                print(f"  {a} → {b}: {snippet}")
+                shown += 1
+                if shown >= show:
+                    break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="*", help="Paths to competitor leads .jsonl files")
+    parser.add_argument("--pad", type=int, default=0, help="Add N synthetic aliases to the gazetteer")
+    parser.add_argument("--show", type=int, default=10, help="Print N disagreement samples")
+    args = parser.parse_args()
+    main(args.paths or sorted(glob.glob("summary/competitor_leads*.jsonl")), pad=args.pad, show=args.show)
@@ -0,0 +1,133 @@
+# bench_speech_acts.py
+"""
+Бенчмарк speech_acts.detect на корпусах summary/competitor_leads*.jsonl.
+
+• стоимость: прежние проверки (цикл re.search по _seller_patterns, контакты,
+  filters.contains_negative, REQUEST/OFFER_MARKERS analyze_competitor) против
+  одного прохода speech_acts.detect и против одной regex-альтернативы из тех
+  же шаблонов, мкс на сообщение, и согласие флагов;
+• эффект: сколько сообщений отбрасывается как offer_with_contacts до AI, и
+  сколько из них – лиды по размеченным данным preclassifier.load_training_data
+  (ai_low_confidence.log, classification_test_report.json) – цена в recall.
+
+    python bench_speech_acts.py summary/competitor_leads*.jsonl --show 5
+"""
+import argparse
+import glob
+import json
+import re
+import time
+from collections import Counter
+
+import speech_acts
+from analyze_competitor import strip_metadata
+
+_legacy_contact = re.compile(r"(@[\w_]+|t\.me/[\w_\-]+|https?://t\.me/[\w_\-]+|\+?[\d\-\s\(\)]{7,}|whatsapp)", flags=re.IGNORECASE)
+_legacy_negative = re.compile(rf"(?<!\bне\s)({'|'.join(speech_acts.NEGATIVE_STEMS)})", flags=re.IGNORECASE)
+# Прежние списки шаблонов (ai_utils._seller_patterns, analyze_competitor)
+_legacy_seller = [
+    r"\bпредлагаем\b", r"\bзабронируйте\b", r"\bузнайте стоимость\b", r"\bнаши услуги\b",
+    r"\bVIP\b", r"\bпревратите\b", r"\bскидк\b", r"\bдешевле\b", r"\bпродаем\b",
+    r"\bзабронируйте сейчас\b", r"\bзарезервируйте\b", r"\bспецпредложение\b", r"\bкупить сейчас\b", r"\bскидка на страховку\b"
+]
+_legacy_request = [re.compile(p, re.IGNORECASE) for p in [
+    r"\bхочу\b", r"\bищу\b", r"\bнужн[аоы]?\b", r"\bсколько стоит\b", r"\bподскажите\b", r"\bсниму\b",
+    r"\bнужна\b", r"\bпомогите\b", r"\bкак добраться\b", r"\bгде взять\b"
+]]
+_legacy_offer = [re.compile(p, re.IGNORECASE) for p in [
+    r"\bсдам\b", r"\bпрода(?:ёт|ётся|ется)\b", r"\bпредлага(?:ем|ется)\b", r"\bузнать стоимость\b", r"\bбез комиссии\b",
+    r"\bдепозит\b", r"\bот собственника\b", r"\bаренда недвижимость\b"
+]]
+
+
+def legacy_detect(lower_text: str):
+    """Прежние отдельные проверки: (seller, offer, request, negative, contact)."""
+    seller = any(re.search(p, lower_text, flags=re.IGNORECASE) for p in _legacy_seller)
+    offer = any(p.search(lower_text) for p in _legacy_offer)
+    request = any(p.search(lower_text) for p in _legacy_request)
+    negative = bool(_legacy_negative.search(lower_text))
+    contact = bool(_legacy_contact.search(lower_text))
+    return seller, offer or seller, request, negative, contact
+
+
+# Та же логика одной regex-альтернативой с именованными группами (вариант «в лоб»)
+_ALT_KINDS = {}
+_alt_parts = []
+for _kind, _pats in [("seller", _legacy_seller), ("offer", [p.pattern for p in _legacy_offer]),
+                     ("request", [p.pattern for p in _legacy_request]), ("negative", [_legacy_negative.pattern]),
+                     ("contact", [_legacy_contact.pattern])]:
+    for _pat in _pats:
+        _ALT_KINDS[f"g{len(_ALT_KINDS)}"] = _kind
+        _alt_parts.append(f"(?P<g{len(_ALT_KINDS) - 1}>{_pat})")
+_ALT_RE = re.compile("|".join(_alt_parts), re.IGNORECASE)
+
+
+def alternation_detect(lower_text: str):
+    return {_ALT_KINDS[m.lastgroup] for m in _ALT_RE.finditer(lower_text)}
+
+
+def load_messages(paths):
+    messages = []
+    for path in paths:
+        for line in open(path, encoding="utf-8"):
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            messages.append(re.sub(r'#\w+', '', strip_metadata(item.get("text", ""))).lower())
+    return messages
+
+
+def main(paths, show=5):
+    messages = load_messages(paths)
+    if not messages:
+        print("No messages loaded")
+        return
+
+    t0 = time.perf_counter()
+    legacy = [legacy_detect(m) for m in messages]
+    t_legacy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    fresh = [speech_acts.detect(m) for m in messages]
+    t_fresh = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for m in messages:
+        alternation_detect(m)
+    t_alt = time.perf_counter() - t0
+
+    n = len(messages)
+    print(f"Messages: {n}")
+    print(f"legacy checks:     {t_legacy / n * 1e6:8.1f} µs/msg")
+    print(f"one alternation:   {t_alt / n * 1e6:8.1f} µs/msg")
+    print(f"speech_acts.detect {t_fresh / n * 1e6:8.1f} µs/msg  (x{t_legacy / t_fresh:.1f} vs legacy)")
+    flags = ("seller", "offer", "request", "negative", "contact")
+    disagree = Counter(name for old, new in zip(legacy, fresh) for name, a, b in zip(flags, old, new[:5]) if a != b)
+    print(f"Flag disagreements: {dict(disagree) or 'none'}")
+
+    labels = Counter(acts.label for acts in fresh)
+    rejected = labels["offer_with_contacts"]
+    print(f"\nLabels: {dict(labels)}")
+    print(f"Rejected before AI (offer_with_contacts): {rejected} ({rejected / n * 100:.1f}% of corpus)")
+    for msg, acts in [(m, a) for m, a in zip(messages, fresh) if a.offer_with_contacts][:show]:
+        print(f"  - {msg[:90]!r}  {[t for k, t in acts.markers if k != speech_acts.CONTACT]}")
+
+    # Цена в recall: отброшенные сообщения среди размеченных данных
+    from preclassifier import load_training_data
+    labelled = load_training_data()
+    leads = [t for t, y in labelled if y == 1]
+    others = [t for t, y in labelled if y == 0]
+    lost = [t for t in leads if speech_acts.detect(t.lower()).offer_with_contacts]
+    caught = sum(speech_acts.detect(t.lower()).offer_with_contacts for t in others)
+    print(f"\nLabelled: {len(leads)} leads, {len(others)} non-leads")
+    print(f"Non-leads rejected: {caught} ({caught / max(len(others), 1) * 100:.1f}%)")
+    print(f"Leads rejected:     {len(lost)} ({len(lost) / max(len(leads), 1) * 100:.1f}% recall loss)")
+    for text in lost[:show]:
+        print(f"  - {text[:90]!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the single-pass speech-act detector")
+    parser.add_argument("paths", nargs="*", help="Paths to competitor leads .jsonl files")
+    parser.add_argument("--show", type=int, default=5, help="Examples to print")
+    args = parser.parse_args()
+    main(args.paths or sorted(glob.glob("summary/competitor_leads*.jsonl")), show=args.show)
@@ -0,0 +1,150 @@
+r"""
+category_reload.py
+Горячая перезагрузка categories.json без рестарта (dedup, кэши и сессии
+Telethon остаются).
+
+reload():
+1. в потоке: чтение и проверка файла, новый KeywordMatcher (его стемы – в
+   предзаполнение stemmer), версии категорий;
+2. на loop: RoutingIndex.freeze – копия фильтров подписчиков;
+3. в потоке: RoutingIndex.build – ключи и MatchPlan с новым matcher (с
+   периодической отдачей GIL, чтобы loop не простаивал);
+4. на loop одним шагом, без await: categories (тот же dict – его держат ui и
+   Pipeline) обновляется на месте, RoutingIndex.install публикует снимок,
+   слушатели on_swap получают matcher (Pipeline.keyword_matcher),
+   ClassificationCache.set_category_versions – вердикты невалидны только у
+   категорий, чья запись изменилась (и «без категории», если изменился набор).
+
+Битый файл не трогает рабочее состояние (categories_reload_failed).
+run(interval) – наблюдатель по mtime; ui: /reload_categories для админа.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from classify_cache import category_versions
+from keywords import KeywordMatcher
+from stemmer import stemmer
+
+
+def load_categories(path: str) -> Dict[str, Any]:
+    """categories.json с проверкой структуры (ValueError, если что-то не так)."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or not data:
+        raise ValueError("categories.json: expected a non-empty object")
+    for cat, entry in data.items():
+        if not isinstance(entry, dict) or not isinstance(entry.get("keywords", []), list):
+            raise ValueError(f"categories.json: bad entry for {cat!r}")
+        subs = entry.get("subcategories", {})
+        if not isinstance(subs, dict) or any(not isinstance(v, dict) for v in subs.values()):
+            raise ValueError(f"categories.json: bad subcategories for {cat!r}")
+    return data
+
+
+class CategoryReloader:
+    def __init__(self, path: str, categories: Dict[str, Any], routing_index, subscriptions,
+                 classify_cache=None, metrics=None, logger=None):
+        self.path = path
+        self.categories = categories
+        self.routing_index = routing_index
+        self.subscriptions = subscriptions
+        self.classify_cache = classify_cache
+        self.metrics = metrics
+        self.logger = logger
+        self.versions = category_versions(categories)
+        self._stamp = self._file_stamp()
+        self._lock = asyncio.Lock()
+        self._listeners: List[Callable[[KeywordMatcher], None]] = []
+
+    def on_swap(self, fn: Callable[[KeywordMatcher], None]) -> None:
+        """fn(matcher) вызывается на loop сразу после подмены."""
+        self._listeners.append(fn)
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def changed(self) -> bool:
+        stamp = self._file_stamp()
+        return stamp is not None and stamp != self._stamp
+
+    def _prepare(self):
+        categories = load_categories(self.path)
+        matcher = KeywordMatcher(categories)
+        stemmer.seed_phrases(matcher.keywords)
+        return categories, matcher, category_versions(categories)
+
+    async def reload(self, force: bool = False) -> Optional[dict]:
+        """Сводка изменений или None, если файл не менялся (и не force)."""
+        async with self._lock:
+            stamp = self._file_stamp()
+            if not force and (stamp is None or stamp == self._stamp):
+                return None
+            self._stamp = stamp
+            started = time.perf_counter()
+            try:
+                categories, matcher, versions = await asyncio.to_thread(self._prepare)
+            except (OSError, ValueError) as e:
+                if self.metrics is not None:
+                    self.metrics['categories_reload_failed'] += 1
+                if self.logger:
+                    self.logger.error(f"categories.json not reloaded: {e}")
+                return {"error": str(e)}
+            frozen = self.routing_index.freeze(self.subscriptions)
+            built = None
+            try:
+                built = await asyncio.to_thread(self.routing_index.build, frozen, matcher, 200)
+            except Exception as e:
+                if self.metrics is not None:
+                    self.metrics['categories_reload_failed'] += 1
+                if self.logger:
+                    self.logger.error(f"Routing index rebuild failed, keeping the current one: {e}")
+                return {"error": str(e)}
+            finally:
+                if built is None:
+                    # иначе update_user копил бы uid в _dirty до следующей перезагрузки
+                    self.routing_index.abort_rebuild()
+
+            # --- подмена: без await до конца блока ---
+            old_versions = self.versions
+            self.categories.clear()
+            self.categories.update(categories)
+            self.routing_index.install(built, matcher, self.subscriptions)
+            for fn in self._listeners:
+                fn(matcher)
+            if self.classify_cache is not None:
+                self.classify_cache.set_category_versions(versions)
+            self.versions = versions
+
+            summary = {
+                "added": sorted(c for c in categories if c not in old_versions),
+                "removed": sorted(c for c in old_versions if c and c not in categories),
+                "changed": sorted(c for c in categories if c in old_versions and old_versions[c] != versions[c]),
+                "keywords": len(matcher.keywords),
+                "subscribers": len(frozen),
+                "seconds": round(time.perf_counter() - started, 3),
+            }
+            if self.metrics is not None:
+                self.metrics['categories_reloaded'] += 1
+            if self.logger:
+                self.logger.info(f"categories.json reloaded: {summary}")
+            return summary
+
+    async def run(self, interval: float = 30.0) -> None:
+        """Наблюдатель: перезагрузка при изменении mtime/размера файла."""
+        while True:
+            await asyncio.sleep(interval)
+            if self.changed():
+                try:
+                    await self.reload()
+                except Exception as e:           # наблюдатель не должен умирать
+                    if self.logger:
+                        self.logger.error(f"categories reload failed: {e}")
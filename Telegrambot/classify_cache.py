@@ -0,0 +1,331 @@
+r"""
+classify_cache.py
+Двухуровневый кэш вердиктов ИИ: горячий LRU в памяти + SQLite на диске.
+
+• ключ – отпечаток нормализованного текста: без контактов, ссылок, эмодзи,
+  пунктуации и лишних пробелов (одно и то же объявление с другими смайликами
+  или телефоном попадает в ту же запись);
+• запись действительна, пока совпадает версия (хэш промпта + модели) и версия
+  категории из вердикта (хэш её записи в categories.json) – правка одной
+  категории инвалидирует только её вердикты;
+• вытеснение: TTL по времени создания + LRU по времени последнего обращения,
+  когда строк больше max_rows;
+• put() кладёт вердикт в горячий LRU и в очередь; на диск (INSERT и
+  обновление accessed) пишет отдельный поток раз в flush_interval одной
+  транзакцией, он же раз в 1000 вставок запускает prune – event loop SQLite
+  не пишет. get() читает диск через своё соединение (WAL), не дожидаясь
+  транзакций потока записи. Размер таблицы ведётся счётчиком (len() для gauge без COUNT(*));
+• счётчики classify_cache_hot_hit / _disk_hit / _miss / _evicted и
+  classify_cache_hit_rate_pct пишутся в metrics.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+# Контакты и ссылки: телефоны, @username, t.me, http(s)://, whatsapp
+_CONTACT_RE = re.compile(
+    r"(@[\w_]+|(?:https?://)?t\.me/[\w_\-/]+|https?://\S+|\+?[\d\-\s\(\)]{7,}|whats\s?app|ватсап)",
+    re.IGNORECASE,
+)
+# Эмодзи, пунктуация и прочие не-буквенные символы схлопываются в пробел
+_NON_WORD_RE = re.compile(r"[^\w]+|_+", re.UNICODE)
+_NULL_CATEGORY = ""
+_log = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Текст без контактов, эмодзи и пунктуации, ё→е, пробелы схлопнуты."""
+    text = _CONTACT_RE.sub(" ", text.lower()).replace("ё", "е")
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _digest(obj) -> str:
+    data = obj if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def category_versions(categories: dict) -> Dict[str, str]:
+    """Версия каждой категории (хэш её записи) + версия для вердиктов без категории."""
+    versions = {name: _digest(entry) for name, entry in categories.items()}
+    # «Не лид» зависит от всего набора категорий
+    versions[_NULL_CATEGORY] = _digest(sorted(categories))
+    return versions
+
+
+class ClassificationCache:
+    """Кэш вердиктов по отпечатку текста (см. модуль)."""
+
+    def __init__(self, path: str = "classify_cache.sqlite3", version: str = "",
+                 hot_size: int = 2000, ttl: float = 7 * 24 * 3600,
+                 max_rows: int = 200_000, metrics: Optional[Counter] = None,
+                 flush_interval: float = 1.0):
+        self.path = path
+        self.version = version
+        self.hot_size = hot_size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.metrics = metrics if metrics is not None else Counter()
+        self._category_versions: Dict[str, str] = {}
+        self._hot: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()          # горячий LRU и очередь записи
+        self._db_lock = threading.Lock()       # соединение SQLite (поток записи, чтение с диска, prune)
+        self._db: Optional[sqlite3.Connection] = None
+        # отдельное соединение для get(): в WAL чтение не ждёт транзакций потока записи
+        self._read_db: Optional[sqlite3.Connection] = None
+        self._read_lock = threading.Lock()
+        self._rows = 0                         # строк на диске, без COUNT(*)
+        # очередь записи: fp → (category, cat_version, created, result) | accessed для touch
+        self._pending: Dict[str, tuple] = {}
+        self._touched: Dict[str, float] = {}
+        self._inserts = 0
+        self._prune_due = False
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+
+    # --- SQLite ------------------------------------------------------------
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts ("
+                " fp TEXT PRIMARY KEY, version TEXT NOT NULL, category TEXT NOT NULL,"
+                " cat_version TEXT NOT NULL, result TEXT NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS verdicts_accessed ON verdicts(accessed)")
+            db.execute("CREATE INDEX IF NOT EXISTS verdicts_category ON verdicts(category)")
+            # единственный COUNT(*) – при открытии; дальше размер ведёт поток записи
+            self._rows = db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+            self._db = db
+        return self._db
+
+    def _reader(self) -> Optional[sqlite3.Connection]:
+        """Соединение только для чтения; None для ":memory:" (там база у каждого соединения своя)."""
+        if self._read_db is None:
+            if self.path == ":memory:":
+                return None
+            with self._db_lock:
+                self._conn()                   # файл и схема
+            self._read_db = sqlite3.connect(Path(self.path).resolve().as_uri() + "?mode=ro", uri=True,
+                                            check_same_thread=False, isolation_level=None)
+        return self._read_db
+
+    def _read_row(self, key: str):
+        sql = "SELECT version, category, cat_version, result, created, accessed FROM verdicts WHERE fp = ?"
+        reader = self._reader()
+        if reader is None:
+            with self._db_lock:
+                return self._conn().execute(sql, (key,)).fetchone()
+        with self._read_lock:
+            return reader.execute(sql, (key,)).fetchone()
+
+    # --- версии ------------------------------------------------------------
+    def set_category_versions(self, versions: Dict[str, str]) -> None:
+        """Новые версии категорий; горячие записи устаревших категорий выбрасываются."""
+        with self._lock:
+            self._category_versions = dict(versions)
+            for fp in [fp for fp, (cat, ver, _, _) in self._hot.items() if not self._fresh(cat, ver)]:
+                del self._hot[fp]
+
+    def _fresh(self, category: str, cat_version: str) -> bool:
+        return self._category_versions.get(category, "") == cat_version
+
+    @staticmethod
+    def _category_of(result: dict) -> str:
+        return result.get("category") or _NULL_CATEGORY
+
+    # --- API ---------------------------------------------------------------
+    def key(self, text: str) -> str:
+        return fingerprint(text)
+
+    def _count(self, name: str) -> None:
+        m = self.metrics
+        m[f"classify_cache_{name}"] += 1
+        hits = m["classify_cache_hot_hit"] + m["classify_cache_disk_hit"]
+        total = hits + m["classify_cache_miss"]
+        m["classify_cache_hit_rate_pct"] = round(hits * 100 / total, 1) if total else 0
+
+    def get(self, key: str) -> Optional[dict]:
+        """Копия закэшированного вердикта или None."""
+        now = time.time()
+        with self._lock:
+            # вытесненная из LRU, но ещё не записанная строка – тоже в памяти
+            item = self._hot.get(key) or self._pending.get(key)
+            if item is not None:
+                cat, ver, created, result = item
+                if created + self.ttl > now and self._fresh(cat, ver):
+                    if key in self._hot:
+                        self._hot.move_to_end(key)
+                    self._count("hot_hit")
+                    return dict(result)
+                self._hot.pop(key, None)
+        row = self._read_row(key)
+        with self._lock:
+            if row is None or row[0] != self.version or row[4] + self.ttl <= now or not self._fresh(row[1], row[2]):
+                self._count("miss")
+                return None
+            result = json.loads(row[3])
+            # accessed обновляем грубо (раз в час), чтобы хиты не превращались в записи
+            if now - row[5] > 3600:
+                self._touched[key] = now
+                self._schedule()
+            self._remember(key, row[1], row[2], row[4], result)
+            self._count("disk_hit")
+            return dict(result)
+
+    def put(self, key: str, result: dict) -> None:
+        """Вердикт – в горячий LRU сразу, на диск – в фоне (поток записи)."""
+        now = time.time()
+        category = self._category_of(result)
+        with self._lock:
+            cat_version = self._category_versions.get(category, "")
+            item = (category, cat_version, now, dict(result))
+            self._hot[key] = item
+            self._hot.move_to_end(key)
+            self._trim_hot()
+            self._pending[key] = item
+            self._touched.pop(key, None)
+            self._inserts += 1
+            if self._inserts % 1000 == 0:
+                self._prune_due = True
+            self._schedule()
+
+    def _remember(self, key, category, cat_version, created, result) -> None:
+        self._hot[key] = (category, cat_version, created, result)
+        self._hot.move_to_end(key)
+        self._trim_hot()
+
+    def _trim_hot(self) -> None:
+        while len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+
+    # --- запись в фоне -------------------------------------------------------
+    def _schedule(self) -> None:
+        """Будит поток записи (под self._lock); поток стартует при первой записи."""
+        if self._writer is None and not self._stop.is_set():
+            self._writer = threading.Thread(target=self._write_loop, name="classify-cache-writer", daemon=True)
+            self._writer.start()
+        self._wakeup.set()
+
+    def _write_loop(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait()
+            # окно накопления: серия вердиктов → одна транзакция
+            self._stop.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        """Записать очередь одной транзакцией (поток записи; при остановке и в тестах – синхронно)."""
+        with self._db_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                touched, self._touched = self._touched, {}
+                prune_due, self._prune_due = self._prune_due, False
+                self._wakeup.clear()
+            if batch or touched:
+                self._write_batch(batch, touched)
+            if prune_due:
+                self._prune_locked(time.time())
+
+    def _write_batch(self, batch: Dict[str, tuple], touched: Dict[str, float]) -> None:
+        db = self._conn()
+        added = 0
+        try:
+            db.execute("BEGIN")
+            for key, (category, cat_version, created, result) in batch.items():
+                row = (self.version, category, cat_version,
+                       json.dumps(result, ensure_ascii=False, default=str), created, created)
+                if db.execute("INSERT OR IGNORE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)", (key,) + row).rowcount:
+                    added += 1
+                else:
+                    db.execute(
+                        "UPDATE verdicts SET version = ?, category = ?, cat_version = ?, result = ?,"
+                        " created = ?, accessed = ? WHERE fp = ?", row + (key,),
+                    )
+            db.executemany("UPDATE verdicts SET accessed = ? WHERE fp = ?",
+                           [(ts, key) for key, ts in touched.items()])
+            db.execute("COMMIT")
+            self._rows += added
+        except Exception as e:
+            db.execute("ROLLBACK")
+            _log.error(f"Failed to persist {len(batch)} cached verdicts: {e}")
+            # вернуть в очередь то, что не перезаписано более свежими вердиктами
+            with self._lock:
+                for key, item in batch.items():
+                    self._pending.setdefault(key, item)
+
+    def close(self) -> None:
+        """Остановить поток записи и дописать очередь (atexit)."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._wakeup.set()
+        if self._writer is not None:
+            self._writer.join(timeout=5)
+        self.flush()
+        if self._read_db is not None:
+            self._read_db.close()
+            self._read_db = None
+
+    # --- обслуживание ----------------------------------------------------------
+    def prune(self) -> int:
+        """Удаляет протухшие/чужой версии записи и лишние по LRU; возвращает число удалённых."""
+        self.flush()
+        with self._db_lock:
+            return self._prune_locked(time.time())
+
+    def _prune_locked(self, now: float) -> int:
+        db = self._conn()
+        removed = db.execute(
+            "DELETE FROM verdicts WHERE version != ? OR created <= ?", (self.version, now - self.ttl)
+        ).rowcount
+        stale = [
+            cat for cat, ver in db.execute("SELECT DISTINCT category, cat_version FROM verdicts").fetchall()
+            if not self._fresh(cat, ver)
+        ]
+        for cat in stale:
+            removed += db.execute(
+                "DELETE FROM verdicts WHERE category = ? AND cat_version != ?",
+                (cat, self._category_versions.get(cat, "")),
+            ).rowcount
+        excess = self._rows - removed - self.max_rows
+        if excess > 0:
+            removed += db.execute(
+                "DELETE FROM verdicts WHERE fp IN (SELECT fp FROM verdicts ORDER BY accessed LIMIT ?)", (excess,)
+            ).rowcount
+        self._rows -= removed
+        self.metrics["classify_cache_evicted"] += removed
+        return removed
+
+    def clear(self) -> None:
+        with self._db_lock:
+            with self._lock:
+                self._hot.clear()
+                self._pending.clear()
+                self._touched.clear()
+            self._conn().execute("DELETE FROM verdicts")
+            self._rows = 0
+
+    def __len__(self) -> int:
+        """Строк на диске (gauge classify_cache_rows) – счётчик, без запроса к SQLite."""
+        if self._db is None:
+            with self._db_lock:
+                self._conn()
+        return self._rows
@@ -1,23 +1,12 @@
-LOCATION_ALIAS = {
-    "анталия": "Анталия",
-    "анталья": "Анталия",
-    "кемер": "Кемер",
-    "стамбул": "Стамбул",
-    "белдиби": "Бельдиби",
-    "бельдиби": "Бельдиби",
-    "гейнюк": "Гёйнюк",
-    "гёйнюк": "Гёйнюк",
-    "манавгат": "Манавгат",
-    "чамьюва": "Чамьюва",
-    "турция": "Турция",
-    "сиде": "Сиде"
-}
+from locations import LOCATION_ALIAS
 import os
 import json
 import logging
 from telethon import TelegramClient
-from collections import Counter
 from subscription import subscriptions, save_subscriptions
+from keywords import KeywordMatcher
+from routing import RoutingIndex
+from expiry import ExpiryScheduler
 
 from dotenv import load_dotenv
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
@@ -38,7 +27,17 @@ logger.addHandler(_file_handler)
 if os.getenv("BOT_DEBUG") == "1":
     logger.setLevel(logging.DEBUG)
 
-metrics = Counter()
+from metrics import metrics, collector
+from tracing import Tracer
+
+# Per-stage latency of handler/delivery: rolling p50/p95/p99 + slow-message samples
+tracer = Tracer(
+    window=int(os.getenv("TRACE_WINDOW", 2048)),
+    slow_threshold=float(os.getenv("TRACE_SLOW_MS", 5000)) / 1000,
+    logger=logger,
+    metrics=metrics,
+)
+collector(tracer.prometheus_lines)
 
 # Safe environment variable loading and validation
 api_id_str = os.getenv("API_ID")
@@ -59,8 +58,45 @@ if not admin_id_str.isdigit():
     raise RuntimeError("ADMIN_ID must be an integer")
 ADMIN_ID = int(admin_id_str)
 
-# categories — словарь из categories.json
-with open("categories.json", encoding="utf-8") as f:
+# categories — словарь из categories.json (category_reloader обновляет его на месте)
+CATEGORIES_PATH = os.getenv("CATEGORIES_PATH", "categories.json")
+with open(CATEGORIES_PATH, encoding="utf-8") as f:
     categories = json.load(f)
 
+# Инвертированный индекс keywords → категории, строится один раз при старте
+keyword_matcher = KeywordMatcher(categories)
+
+# Стемы keywords и алиасов регионов – в общий кэш стеммера, не вытесняются
+from stemmer import stemmer
+stemmer.seed_phrases(keyword_matcher.keywords)
+stemmer.seed_phrases(list(LOCATION_ALIAS) + list(LOCATION_ALIAS.values()))
+collector(stemmer.prometheus_lines)
+
+# Вердикты ИИ в кэше версионируются по записи своей категории в categories.json
+from ai_utils import _classify_cache, category_versions
+_classify_cache.set_category_versions(category_versions(categories))
+
+# Сроки пробного периода/подписки: даты разбираются здесь один раз, а не на каждый лид
+expiry_scheduler = ExpiryScheduler(
+    subscriptions,
+    batch_size=int(os.getenv("EXPIRY_BATCH_SIZE", 20)),
+    batch_interval=float(os.getenv("EXPIRY_BATCH_INTERVAL", 1.0)),
+)
+
+# (регион, категория, подкатегория) → подписчики с действующим доступом; ui.callback обновляет инкрементально
+routing_index = RoutingIndex(subscriptions, matcher=keyword_matcher, entitled=expiry_scheduler.is_entitled)
+
+# Правка categories.json без рестарта: наблюдатель (Botparsing) и /reload_categories (ui)
+from category_reload import CategoryReloader
+category_reloader = CategoryReloader(CATEGORIES_PATH, categories, routing_index, subscriptions,
+                                     classify_cache=_classify_cache, metrics=metrics, logger=logger)
+
+
+def _swap_matcher(matcher):
+    global keyword_matcher
+    keyword_matcher = matcher
+
+
+category_reloader.on_swap(_swap_matcher)
+
 bot_client = TelegramClient("bot", api_id, api_hash)
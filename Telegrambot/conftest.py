@@ -0,0 +1,4 @@
+import os
+
+# Тесты не должны писать кэш вердиктов рядом с кодом
+os.environ.setdefault("CLASSIFY_CACHE_DB", ":memory:")
@@ -0,0 +1,141 @@
+r"""
+dedup.py
+Дедупликация апдейтов по (chat_id, msg_id) с настоящим TTL.
+
+id сообщений уникальны только внутри чата, поэтому ключ – пара (chat_id,
+msg_id), хранится точно: свёртка в одно 64-битное число давала коллизии
+между разными -100… супергруппами.
+
+Хранение – по временным корзинам шириной bucket_seconds:
+• текущая корзина – set кортежей (chat_id, msg_id) (быстрая вставка);
+• закрытые корзины – два параллельных array('q') (chat_id, msg_id),
+  отсортированные по паре: 16 байт на ключ, поиск – bisect по chat_id, затем
+  по msg_id внутри его диапазона;
+• корзины старше ttl выбрасываются целиком – TTL без очереди по элементам.
+
+checkpoint() пишет компактный бинарный снимок (tmp + os.replace), load()
+поднимает его при старте – апдейты, повторно доставленные после реконнекта или
+рестарта, тоже распознаются.
+"""
+
+from __future__ import annotations
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import Deque, Iterable, Optional, Set, Tuple
+
+_MAGIC = b"DDP2"
+_HEADER = struct.Struct("<4sdI")      # magic, bucket_seconds, число корзин
+_BUCKET = struct.Struct("<qI")        # начало корзины (с), число ключей
+
+
+class _Sealed:
+    """Закрытая корзина: пары (chat_id, msg_id), отсортированные, в двух array('q')."""
+    __slots__ = ("start", "chats", "msgs")
+
+    def __init__(self, start: int, chats: array, msgs: array):
+        self.start = start
+        self.chats = chats
+        self.msgs = msgs
+
+    @classmethod
+    def from_pairs(cls, start: int, pairs: Iterable[Tuple[int, int]]) -> "_Sealed":
+        ordered = sorted(pairs)
+        return cls(start, array("q", [c for c, _ in ordered]), array("q", [m for _, m in ordered]))
+
+    def __len__(self) -> int:
+        return len(self.chats)
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        chat_id, msg_id = key
+        lo = bisect_left(self.chats, chat_id)
+        if lo == len(self.chats) or self.chats[lo] != chat_id:
+            return False
+        hi = bisect_right(self.chats, chat_id, lo)
+        i = bisect_left(self.msgs, msg_id, lo, hi)
+        return i < hi and self.msgs[i] == msg_id
+
+
+class MessageDeduper:
+    def __init__(self, ttl: float = 48 * 3600, bucket_seconds: float = 3600,
+                 path: Optional[str] = None):
+        self.ttl = ttl
+        self.bucket_seconds = bucket_seconds
+        self.path = path
+        self._sealed: Deque[_Sealed] = deque()
+        self._current_start = self._bucket_start(time.time())
+        self._current: Set[Tuple[int, int]] = set()
+
+    def _bucket_start(self, ts: float) -> int:
+        return int(ts // self.bucket_seconds * self.bucket_seconds)
+
+    def __len__(self) -> int:
+        return len(self._current) + sum(len(bucket) for bucket in self._sealed)
+
+    def _rotate(self, now: float) -> None:
+        start = self._bucket_start(now)
+        if start != self._current_start:
+            if self._current:
+                self._sealed.append(_Sealed.from_pairs(self._current_start, self._current))
+            self._current = set()
+            self._current_start = start
+        horizon = now - self.ttl
+        while self._sealed and self._sealed[0].start + self.bucket_seconds <= horizon:
+            self._sealed.popleft()
+
+    def seen(self, chat_id: int, msg_id: int, now: Optional[float] = None) -> bool:
+        """True, если пара уже встречалась за ttl; иначе запоминает её и возвращает False."""
+        now = time.time() if now is None else now
+        self._rotate(now)
+        key = (chat_id, msg_id)
+        if key in self._current:
+            return True
+        for bucket in reversed(self._sealed):
+            if key in bucket:
+                return True
+        self._current.add(key)
+        return False
+
+    # --- checkpoint ----------------------------------------------------------
+    def checkpoint(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        if not path:
+            return
+        buckets = list(self._sealed)
+        if self._current:
+            buckets.append(_Sealed.from_pairs(self._current_start, self._current))
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, self.bucket_seconds, len(buckets)))
+            for bucket in buckets:
+                f.write(_BUCKET.pack(bucket.start, len(bucket)))
+                bucket.chats.tofile(f)
+                bucket.msgs.tofile(f)
+        os.replace(tmp, path)
+
+    def load(self, path: Optional[str] = None, now: Optional[float] = None) -> int:
+        """Поднимает снимок (если есть и совместим); возвращает число загруженных ключей."""
+        path = path or self.path
+        if not path or not os.path.exists(path):
+            return 0
+        now = time.time() if now is None else now
+        with open(path, "rb") as f:
+            magic, bucket_seconds, count = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or bucket_seconds != self.bucket_seconds:
+                return 0
+            sealed = []
+            for _ in range(count):
+                start, n = _BUCKET.unpack(f.read(_BUCKET.size))
+                chats, msgs = array("q"), array("q")
+                chats.fromfile(f, n)
+                msgs.fromfile(f, n)
+                sealed.append(_Sealed(start, chats, msgs))
+        # Все корзины из снимка закрыты; текущая начинается заново
+        self._sealed = deque(sealed)
+        self._current = set()
+        self._current_start = self._bucket_start(now)
+        self._rotate(now)
+        return len(self)
@@ -1,90 +1,98 @@
 import logging
+import os
+import time
 from telethon import Button
-from datetime import datetime, timezone, timedelta
-from filters import extract_stems
-from config import bot_client, ADMIN_ID, categories, subscriptions, save_subscriptions, metrics, logger
+from config import bot_client, ADMIN_ID, routing_index, subscriptions, save_subscriptions, metrics, logger, tracer
+from metrics import histogram, gauge
+from expiry import NOTIFIED_FLAG, PAID, TRIAL
+from routing import select_recipients
+from delivery_engine import DeliveryEngine, Fanout
 
+# Per-recipient queues, global concurrency and msgs/sec budget (Bot API: ~30 msg/s, ~1 msg/s per chat)
+delivery_engine = DeliveryEngine(
+    bot_client,
+    max_concurrency=int(os.getenv("DELIVERY_CONCURRENCY", 20)),
+    rate=float(os.getenv("DELIVERY_RPS", 25)),
+    burst=float(os.getenv("DELIVERY_BURST", 25)),
+    per_chat_interval=float(os.getenv("DELIVERY_PER_CHAT_INTERVAL", 1.0)),
+    metrics=metrics,
+    logger=logger,
+)
+gauge("delivery_queue_depth", delivery_engine.queue_depth, help="Messages waiting in per-recipient delivery queues")
 
-async def send_lead_to_users(chat_id, group_name, group_username, sender_name, sender_id, sender_username, text, link, region, detected_category=None, **kwargs):
-    failed_uids = []
-    # Send to each user based on their subscriptions
-    for uid_str, prefs in subscriptions.items():
+# Lead fan-out: first enqueue → last send attempt
+_FANOUT_SECONDS = histogram("fanout_seconds", buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+                            help="Lead fan-out duration")
+# Source message date (event.date) → last send of the fan-out
+_FRESHNESS_SECONDS = histogram("lead_freshness_seconds", buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600),
+                               help="End-to-end lead freshness: event.date to final send")
+
+
+async def _on_fanout_done(fanout):
+    elapsed = time.monotonic() - fanout.started
+    _FANOUT_SECONDS.observe(elapsed)
+    tracer.record("fanout", elapsed)
+    if fanout.origin and fanout.sent:
+        freshness = max(0.0, time.time() - fanout.origin)
+        _FRESHNESS_SECONDS.observe(freshness)
+        tracer.record("freshness", freshness)
+    # Notify admin if any sends failed
+    if fanout.failed:
         try:
-            uid = int(uid_str)
-        except ValueError:
-            continue
-        now = datetime.now(timezone.utc)
-        # Debug trial/subscription state
-        logger.debug(f"[DEBUG TRIAL] User {uid_str}: subscription_end={prefs.get('subscription_end')}, trial_start={prefs.get('trial_start')}, now={now.isoformat()}")
-        # Check paid subscription first
-        sub_end = prefs.get('subscription_end')
-        if sub_end:
-            end = datetime.fromisoformat(sub_end)
-            if now > end:
-                # Paid subscription expired: notify user once
-                if not prefs.get('paid_expired_notified'):
-                    await bot_client.send_message(
-                        uid,
-                        "⌛ Ваша подписка закончилась. Чтобы продолжить получать лиды, нажмите кнопку:",
-                        buttons=[[Button.inline("Подписаться", b"menu:subscribe")]]
-                    )
-                    prefs['paid_expired_notified'] = True
-                    # Save updated subscriptions
-                    save_subscriptions()
-                metrics['sub_expired_skipped'] += 1
-                continue
-        else:
-            # No paid subscription: check trial
-            ts = prefs.get('trial_start')
-            if not ts:
-                # Trial not started yet
-                continue
-            start = datetime.fromisoformat(ts)
-            if start.tzinfo is None:
-                start = start.replace(tzinfo=timezone.utc)
-            if now - start > timedelta(days=2):
-                # Trial expired: notify user once
-                if not prefs.get('trial_expired_notified'):
-                    await bot_client.send_message(
-                        uid,
-                        "⌛ Ваш пробный период закончился. Чтобы продолжить получать лиды, нажмите кнопку:",
-                        buttons=[[Button.inline("Подписаться", b"menu:subscribe")]]
-                    )
-                    prefs['trial_expired_notified'] = True
-                    # Save updated subscriptions
-                    save_subscriptions()
-                metrics['trial_expired_skipped'] += 1
-                continue
-        keywords = []
-        # Stems from выбранных категорий
-        for cat in prefs.get("categories", []):
-            keywords.extend(extract_stems(categories.get(cat, {})))
+            await bot_client.send_message(
+                ADMIN_ID,
+                f"⚠️ Ошибка рассылки лида пользователям: {len(fanout.failed)} не удалось отправить. UIDs: {fanout.failed}"
+            )
+        except Exception as notify_error:
+            logger.error(f"Failed to notify admin about send errors: {notify_error}")
 
-        # Stems from выбранных подкатегорий
-        for cat, sub_list in prefs.get("subcats", {}).items():
-            for sub in sub_list:
-                sub_entry = categories.get(cat, {}).get("subcategories", {}).get(sub, {})
-                keywords.extend(extract_stems(sub_entry))
 
-        keywords = [str(k) for k in keywords]
-        locations = prefs.get("locations", [])
-        # Check if this message matches the user's region subscription
-        if region not in locations:
-            metrics['pref_region_skipped'] += 1
-            logger.debug(f"Skipping user {uid}: region {region} not in their locations {locations}")
-            continue
-        # --- strict AI‑category filter ---------------------------------
-        # Отправляем лид только если AI определил категорию
-        # и она входит в подписку пользователя.
-        if detected_category and detected_category not in prefs.get("categories", []):
-            metrics['pref_ai_category_skipped'] += 1
-            logger.debug(f"Skipping user {uid}: AI category '{detected_category}' "
-                         f"not in user's categories {prefs.get('categories')}")
+_EXPIRED_TEXT = {
+    PAID: "⌛ Ваша подписка закончилась. Чтобы продолжить получать лиды, нажмите кнопку:",
+    TRIAL: "⌛ Ваш пробный период закончился. Чтобы продолжить получать лиды, нажмите кнопку:",
+}
+
+
+async def notify_expired(uid_str, kind):
+    """Колбэк expiry_scheduler: снять пользователя из маршрутизации и один раз уведомить."""
+    prefs = subscriptions.get(uid_str)
+    routing_index.update_user(uid_str, prefs)
+    metrics['sub_expired' if kind == PAID else 'trial_expired'] += 1
+    if prefs is None or prefs.get(NOTIFIED_FLAG[kind]):
+        return
+    try:
+        uid = int(uid_str)
+    except ValueError:
+        return
+    delivery_engine.submit(
+        uid,
+        _EXPIRED_TEXT[kind],
+        buttons=[[Button.inline("Подписаться", b"menu:subscribe")]]
+    )
+    prefs[NOTIFIED_FLAG[kind]] = True
+    save_subscriptions(uid_str)
+
+
+async def send_lead_to_users(chat_id, group_name, group_username, sender_name, sender_id, sender_username, text, link, region, detected_category=None, kw_match=None, trace=None, **kwargs):
+    """Отбирает получателей и ставит лид в очереди delivery_engine; отправка идёт в фоне."""
+    fanout = Fanout(name=f"{chat_id}/{link or region}", on_done=_on_fanout_done,
+                    origin=trace.origin if trace is not None else None)
+    if kw_match is None:
+        # routing_index.matcher – всегда текущий (category_reloader подменяет его)
+        kw_match = routing_index.matcher.match(text.lower())
+    # Subscribers of this region whose plans accept the AI category and share a keyword with the lead
+    recipients = select_recipients(routing_index.snapshot, region, kw_match, detected_category,
+                                   metrics=metrics, logger=logger)
+    if trace is not None:
+        trace.lap("delivery_route")
+    for uid_str, plan in recipients:
+        # Only entitled users are in the index: expiry_scheduler removes them when trial/subscription ends
+        prefs = subscriptions.get(uid_str)
+        if prefs is None:
             continue
-        # Check if any stem from subscribed categories appears in the text
-        if not any(kw.lower() in text.lower() for kw in keywords):
-            metrics['pref_category_skipped'] += 1
-            logger.debug(f"Skipping user {uid}: none of their category stems {keywords} found in text '{text}'")
+        try:
+            uid = int(uid_str)
+        except ValueError:
             continue
         # Build clickable group name using username if available
         if group_username:
@@ -122,27 +130,16 @@ async def send_lead_to_users(chat_id, group_name, group_username, sender_name, s
             ]]
         else:
             buttons = None
-        # Send message with the constructed buttons
-        try:
-            await bot_client.send_message(
-                uid,
-                msg,
-                parse_mode="HTML",
-                link_preview=False,
-                buttons=buttons
-            )
-            metrics['leads_sent'] += 1
-            logger.info(f"Lead sent to user {uid}")
-        except Exception as e:
-            metrics['send_errors'] += 1
-            failed_uids.append(uid)
-            logger.error(f"Failed to send lead to {uid}: {e}")
-    # Notify admin if any sends failed
-    if failed_uids:
-        try:
-            await bot_client.send_message(
-                ADMIN_ID,
-                f"⚠️ Ошибка рассылки лида пользователям: {len(failed_uids)} не удалось отправить. UIDs: {failed_uids}"
-            )
-        except Exception as notify_error:
-            logger.error(f"Failed to notify admin about send errors: {notify_error}")
\ No newline at end of file
+        # Queue the message; the engine handles concurrency, rate limits and FloodWait
+        delivery_engine.submit(
+            uid,
+            msg,
+            parse_mode="HTML",
+            link_preview=False,
+            buttons=buttons,
+            fanout=fanout
+        )
+        metrics['leads_queued'] += 1
+        logger.info(f"Lead queued for user {uid}")
+    if trace is not None:
+        trace.lap("delivery_queue")
@@ -0,0 +1,173 @@
+r"""
+delivery_engine.py
+Рассылка лидов без блокировки parser handler.
+
+• у каждого получателя своя очередь (порядок сообщений сохраняется, между
+  сообщениями одному чату – не меньше per_chat_interval);
+• глобально: не больше max_concurrency одновременных send_message и не больше
+  rate сообщений в секунду (лимиты Bot API: ~30/с всего, ~1/с в один чат);
+• FloodWaitError не считается ошибкой и не тратит попытки: вся рассылка
+  ставится на паузу на e.seconds, сообщение остаётся первым в очереди и
+  уходит после паузы, сколько бы раз сервер ни попросил подождать;
+• токен rate берётся до слота max_concurrency: отправка, ждущая бюджета, не
+  занимает слот;
+• submit() только ставит задачу в очередь – отправка идёт в фоновых задачах;
+• по каждому лиду (Fanout) считается длительность рассылки (от создания до
+  последней отправки): fanout_ms_total / fanout_ms_max / fanouts, а также
+  leads_sent / send_errors в metrics.
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from ratelimit import AsyncTokenBucket
+
+try:
+    from telethon.errors import FloodWaitError
+except ImportError:  # offline-скрипты без telethon
+    FloodWaitError = None
+
+
+def flood_wait_seconds(e: Exception) -> Optional[float]:
+    """Сколько ждать по FloodWait (None – это не FloodWait)."""
+    if FloodWaitError is not None and isinstance(e, FloodWaitError):
+        return float(e.seconds)
+    seconds = getattr(e, "seconds", None)
+    if seconds is not None and "FLOOD" in type(e).__name__.upper():
+        return float(seconds)
+    return None
+
+
+class Fanout:
+    """Рассылка одного лида: ждёт, пока все её сообщения отправлены или провалены."""
+
+    def __init__(self, name: str = "", on_done: Optional[Callable[["Fanout"], Awaitable[None]]] = None,
+                 origin: Optional[float] = None):
+        self.name = name
+        self.started = time.monotonic()
+        # время исходного сообщения (epoch, event.date) – для свежести лида
+        self.origin = origin
+        self.pending = 0
+        self.sent = 0
+        self.failed: List[Any] = []
+        self.on_done = on_done
+        self.done = asyncio.Event()
+
+
+class _Job:
+    __slots__ = ("uid", "args", "kwargs", "fanout")
+
+    def __init__(self, uid, args, kwargs, fanout):
+        self.uid = uid
+        self.args = args
+        self.kwargs = kwargs
+        self.fanout = fanout
+
+
+class DeliveryEngine:
+    def __init__(self, client, max_concurrency: int = 20, rate: float = 25, burst: float = 25,
+                 per_chat_interval: float = 1.0,
+                 metrics: Optional[Counter] = None, logger=None):
+        self.client = client
+        self.per_chat_interval = per_chat_interval
+        self.metrics = metrics if metrics is not None else Counter()
+        self.logger = logger
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bucket = AsyncTokenBucket(rate, burst=burst)
+        self._queues: Dict[Any, Deque[_Job]] = {}
+        self._workers: Dict[Any, asyncio.Task] = {}
+        self._next_send: Dict[Any, float] = {}
+        self._paused_until = 0.0
+
+    # --- API ---------------------------------------------------------------
+    def submit(self, uid, *args, fanout: Optional[Fanout] = None, **kwargs) -> None:
+        """Поставить client.send_message(uid, *args, **kwargs) в очередь получателя."""
+        if fanout is not None:
+            fanout.pending += 1
+        self._queues.setdefault(uid, deque()).append(_Job(uid, args, kwargs, fanout))
+        self.metrics['delivery_queued'] += 1
+        if uid not in self._workers:
+            self._workers[uid] = asyncio.get_running_loop().create_task(self._drain(uid))
+
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in list(self._queues.values()))
+
+    async def join(self) -> None:
+        """Дождаться опустошения всех очередей (тесты, остановка)."""
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+
+    # --- фоновая отправка ----------------------------------------------------
+    async def _drain(self, uid) -> None:
+        queue = self._queues[uid]
+        try:
+            while queue:
+                job = queue[0]
+                wait = max(self._next_send.get(uid, 0.0), self._paused_until) - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                error = await self._send(job)
+                if error is None:
+                    queue.popleft()
+                    self._next_send[uid] = time.monotonic() + self.per_chat_interval
+                    await self._finish(job, ok=True)
+                    continue
+                seconds = flood_wait_seconds(error)
+                if seconds is not None:
+                    # FloodWait: пауза для всех, сообщение остаётся первым в очереди
+                    self.metrics['delivery_flood_waits'] += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+                    if self.logger:
+                        self.logger.warning(f"FloodWait {seconds:.0f}s while sending to {uid}, rescheduled")
+                    continue
+                queue.popleft()
+                if self.logger:
+                    self.logger.error(f"Failed to send to {uid}: {error}")
+                await self._finish(job, ok=False)
+        finally:
+            self._workers.pop(uid, None)
+            if not queue:
+                self._queues.pop(uid, None)
+                self._next_send.pop(uid, None)
+
+    async def _send(self, job: _Job) -> Optional[Exception]:
+        # Сначала бюджет rate, потом слот: ожидание токена не держит семафор
+        await self._bucket.acquire()
+        async with self._semaphore:
+            try:
+                await self.client.send_message(job.uid, *job.args, **job.kwargs)
+            except Exception as e:
+                return e
+        return None
+
+    async def _finish(self, job: _Job, ok: bool) -> None:
+        self.metrics['delivery_sent' if ok else 'delivery_failed'] += 1
+        fanout = job.fanout
+        if fanout is None:
+            return
+        fanout.pending -= 1
+        if ok:
+            fanout.sent += 1
+            self.metrics['leads_sent'] += 1
+        else:
+            fanout.failed.append(job.uid)
+            self.metrics['send_errors'] += 1
+        if fanout.pending == 0 and not fanout.done.is_set():
+            fanout.done.set()
+            elapsed_ms = int((time.monotonic() - fanout.started) * 1000)
+            self.metrics['fanouts'] += 1
+            self.metrics['fanout_ms_total'] += elapsed_ms
+            self.metrics['fanout_ms_max'] = max(self.metrics['fanout_ms_max'], elapsed_ms)
+            if self.logger:
+                self.logger.info(f"Lead fan-out {fanout.name}: {fanout.sent} sent, "
+                                 f"{len(fanout.failed)} failed in {elapsed_ms} ms")
+            if fanout.on_done is not None:
+                try:
+                    await fanout.on_done(fanout)
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f"Fan-out callback failed: {e}")
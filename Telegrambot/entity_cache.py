@@ -0,0 +1,86 @@
+r"""
+entity_cache.py
+Кэш Telethon-сущностей (чаты, отправители) для горячего пути parser handler.
+
+• TTL + ограничение размера (LRU-вытеснение);
+• одновременные промахи по одному id ждут один и тот же запрос; если первый
+  вызывающий отменён, ожидающие не зависают, а запрашивают сами;
+• счётчики <name>_cache_hit / <name>_cache_miss пишутся в metrics.
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class EntityCache:
+    """TTL/LRU-кэш сущностей по id."""
+
+    def __init__(self, name: str, maxsize: int = 5000, ttl: float = 3600,
+                 metrics: Optional[Counter] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.metrics = metrics if metrics is not None else Counter()
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Any, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key) -> Tuple[bool, Any]:
+        """(найдено, значение); протухшие записи удаляются."""
+        item = self._data.get(key)
+        if item is None:
+            return False, None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def put(self, key, value) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def resolve(self, key, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Значение из кэша или результат await fetch() (None тоже кэшируется)."""
+        found, value = self.get(key)
+        if found:
+            self.metrics[f"{self.name}_cache_hit"] += 1
+            return value
+        self.metrics[f"{self.name}_cache_miss"] += 1
+        while True:
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise               # отменили этого вызывающего
+                # отменён первый вызывающий (его fetch не завершился) – запрашиваем сами
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await fetch()
+        except BaseException as e:
+            # CancelledError – тоже: иначе future не завершится и ожидающие зависнут
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # исключение уже передано вызывающему; не даём asyncio ругаться на future
+                future.exception()
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
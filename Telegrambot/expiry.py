@@ -0,0 +1,144 @@
+r"""
+expiry.py
+Планировщик окончания пробного периода и платной подписки.
+
+• при старте и при каждом изменении (старт пробного периода, подтверждение
+  оплаты в ui.callback) даты из prefs разбираются один раз и кладутся в
+  min-heap (срок, uid); устаревшие записи кучи отбрасываются лениво;
+• is_entitled(uid) – O(1) по множеству пользователей с действующим доступом;
+  routing.RoutingIndex держит в индексе только их, поэтому delivery даты не
+  разбирает вообще;
+• run(on_expired) спит до ближайшего срока, снимает истёкших пользователей из
+  маршрутизации и шлёт уведомления пачками по batch_size с паузой
+  batch_interval (сами сообщения уходят через DeliveryEngine).
+
+Правила прежние: если есть subscription_end – действует только она;
+иначе пробный период 2 дня от trial_start; без trial_start доступа нет.
+"""
+
+from __future__ import annotations
+import asyncio
+import heapq
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+TRIAL_DAYS = 2
+
+PAID = "paid"
+TRIAL = "trial"
+# флаг «уведомление уже отправлено» по типу доступа
+NOTIFIED_FLAG = {PAID: "paid_expired_notified", TRIAL: "trial_expired_notified"}
+
+
+def _parse(ts: str) -> datetime:
+    dt = datetime.fromisoformat(ts)
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
+
+def entitlement_deadline(prefs: dict) -> Optional[Tuple[str, float]]:
+    """(тип доступа, срок окончания в epoch) или None, если доступа нет и не было."""
+    sub_end = prefs.get("subscription_end")
+    if sub_end:
+        return PAID, _parse(sub_end).timestamp()
+    trial = prefs.get("trial_start")
+    if trial:
+        return TRIAL, (_parse(trial) + timedelta(days=TRIAL_DAYS)).timestamp()
+    return None
+
+
+class ExpiryScheduler:
+    def __init__(self, subscriptions=None, batch_size: int = 20, batch_interval: float = 1.0):
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self._heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, Tuple[str, float]] = {}
+        self._entitled: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        if subscriptions:
+            now = time.time()
+            for uid, prefs in subscriptions.items():
+                self._track(uid, prefs, now)
+
+    def _track(self, uid: str, prefs: Optional[dict], now: float) -> None:
+        deadline = entitlement_deadline(prefs) if prefs else None
+        if deadline is None:
+            self._deadlines.pop(uid, None)
+            self._entitled.discard(uid)
+            return
+        self._deadlines[uid] = deadline
+        if deadline[1] > now:
+            self._entitled.add(uid)
+            heapq.heappush(self._heap, (deadline[1], uid))
+        else:
+            self._entitled.discard(uid)
+
+    # --- API ---------------------------------------------------------------
+    def is_entitled(self, uid: str) -> bool:
+        return uid in self._entitled
+
+    def entitled_count(self) -> int:
+        return len(self._entitled)
+
+    def update_user(self, uid: str, prefs: Optional[dict]) -> None:
+        """Пересчитать срок пользователя (после старта пробного периода / оплаты)."""
+        self._track(uid, prefs, time.time())
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending_expired(self, subscriptions) -> List[Tuple[str, str]]:
+        """Истёкшие, но ещё не уведомлённые (uid, тип) – для догоняющей рассылки после рестарта."""
+        out = []
+        for uid, (kind, _) in self._deadlines.items():
+            prefs = subscriptions.get(uid)
+            if uid not in self._entitled and prefs is not None and not prefs.get(NOTIFIED_FLAG[kind]):
+                out.append((uid, kind))
+        return out
+
+    def pop_expired(self, now: Optional[float] = None) -> List[Tuple[str, str]]:
+        """Снимает с кучи всех, чей срок наступил; возвращает [(uid, тип)]."""
+        now = time.time() if now is None else now
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, uid = heapq.heappop(self._heap)
+            current = self._deadlines.get(uid)
+            # запись устарела: срок продлён или пользователь удалён
+            if current is None or current[1] != deadline:
+                continue
+            self._entitled.discard(uid)
+            expired.append((uid, current[0]))
+        return expired
+
+    def next_deadline(self) -> Optional[float]:
+        while self._heap:
+            deadline, uid = self._heap[0]
+            current = self._deadlines.get(uid)
+            if current is not None and current[1] == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    async def _fire(self, expired: List[Tuple[str, str]], on_expired) -> None:
+        for i in range(0, len(expired), self.batch_size):
+            if i:
+                await asyncio.sleep(self.batch_interval)
+            await asyncio.gather(*(on_expired(uid, kind) for uid, kind in expired[i:i + self.batch_size]))
+
+    async def run(self, on_expired: Callable[[str, str], Awaitable[None]],
+                  backlog: Iterable[Tuple[str, str]] = (), max_sleep: float = 3600) -> None:
+        """
+        Фоновая задача: сначала backlog (истёкшие до рестарта, см. pending_expired),
+        затем ждёт ближайший срок (или update_user) и вызывает on_expired(uid, тип)
+        пачками по batch_size.
+        """
+        self._wakeup = asyncio.Event()
+        await self._fire(list(backlog), on_expired)
+        while True:
+            deadline = self.next_deadline()
+            timeout = max_sleep if deadline is None else min(max_sleep, max(0.0, deadline - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._fire(self.pop_expired(), on_expired)
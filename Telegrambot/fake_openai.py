@@ -0,0 +1,318 @@
+r"""
+fake_openai.py
+Локальная замена OpenAI chat.completions для нагрузочных прогонов и тестов
+без сети (только stdlib: http.server + json).
+
+• POST /v1/chat/completions – ответ в формате OpenAI; содержимое:
+  – записи (--recordings, JSONL {"text": ..., "verdict": {...}}) по точному
+    тексту сообщения;
+  – правила (--rules, JSON [{"match": regex, "verdict": {...}}]), первое
+    совпадение дополняет вердикт;
+  – иначе встроенная эвристика: категория/регион из списков промпта по
+    вхождению, контакты + речь продавца → relevant=false;
+  одиночный промпт → JSON-объект, пронумерованный список (ai_batch) → массив;
+• задержка по распределению (--latency fixed:300 | uniform:100:800 |
+  normal:300:80 | lognormal:300:0.6, миллисекунды), сид --seed;
+• отказы: --error-rate (случайные 500/502/503), --rpm (лимит запросов в
+  минуту → 429 с retry-after), --burst CODE:SECONDS:EVERY (первые SECONDS
+  каждых EVERY секунд отвечаем CODE; можно несколько), --timeout-rate
+  (ответ задерживается на --hang секунд, клиент уходит по таймауту);
+• GET /stats – счётчики по статусам.
+
+    python fake_openai.py --port 8765 --latency lognormal:400:0.5 --burst 429:5:60
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake python bench.py --ai openai
+
+В коде: FakeOpenAIServer(...).start() → base_url, stop().
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+_QUOTED_RE = re.compile(r'"([^"]+)"')
+_CATEGORIES_RE = re.compile(r"category \(одно из: (.*?) или null\)", re.S)
+_LOCATIONS_RE = re.compile(r"region \(одно из: (.*?) или null\)", re.S)
+_MESSAGE_RE = re.compile(r'"""(.*?)"""', re.S)
+_CONTACT_RE = re.compile(r"(@[\w_]+|t\.me/|\+?\d[\d\-\s\(\)]{6,}|whatsapp)", re.I)
+_SELLER_RE = re.compile(r"предлага|забронир|узнайте стоимость|наши услуги|\bvip\b|скидк|дешевле|продаем|спецпредлож", re.I)
+_HESITANT_RE = re.compile(r"может|пока|присматрива|не уверен|подумаю", re.I)
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """'fixed:300' | 'uniform:100:800' | 'normal:300:80' | 'lognormal:300:0.6' (мс) → секунды."""
+    kind, *params = spec.split(":")
+    p = [float(x) for x in params]
+    if kind == "fixed":
+        return lambda rng: p[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(p[0], p[1]) / 1000
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(p[0], p[1])) / 1000
+    if kind == "lognormal":
+        # медиана p[0] мс, sigma p[1]
+        return lambda rng: rng.lognormvariate(math.log(p[0]), p[1]) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def parse_burst(spec: str) -> Tuple[int, float, float]:
+    code, seconds, every = spec.split(":")
+    return int(code), float(seconds), float(every)
+
+
+def _stem(word: str) -> str:
+    return word.lower()[:max(4, len(word) - 2)]
+
+
+def heuristic_verdict(text: str, categories: List[str], locations: List[str]) -> dict:
+    """Детерминированный вердикт в формате классификатора."""
+    lower = text.lower()
+    category = next((c for c in categories if _stem(c) in lower), None)
+    region = next((l for l in locations if _stem(l) in lower), None)
+    if _CONTACT_RE.search(text) and _SELLER_RE.search(text):
+        return {"relevant": False, "category": None, "region": None,
+                "explanation": "Реклама/продажа", "confidence": 0.9}
+    if _HESITANT_RE.search(lower):
+        return {"relevant": True, "category": category, "region": region,
+                "explanation": "Неоднозначный интерес", "confidence": 0.5}
+    return {"relevant": True, "category": category, "region": region,
+            "explanation": "Запрос услуги", "confidence": 0.85}
+
+
+class Responder:
+    """Текст ответа модели по messages запроса."""
+
+    def __init__(self, rules: Optional[List[dict]] = None, recordings: Optional[Dict[str, dict]] = None):
+        self.rules = [(re.compile(r["match"], re.I), r["verdict"]) for r in (rules or [])]
+        self.recordings = recordings or {}
+
+    def verdict(self, text: str, categories: List[str], locations: List[str]) -> dict:
+        recorded = self.recordings.get(text.strip())
+        if recorded is not None:
+            return dict(recorded)
+        result = heuristic_verdict(text, categories, locations)
+        for pattern, override in self.rules:
+            if pattern.search(text):
+                result.update(override)
+                break
+        return result
+
+    def content(self, messages: List[dict]) -> str:
+        system = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        user = "\n".join(m.get("content", "") for m in messages if m.get("role") == "user")
+        # списки и формат ответа – в переменной части промпта (user), раньше были в system
+        cats = _CATEGORIES_RE.search(system) or _CATEGORIES_RE.search(user)
+        locs = _LOCATIONS_RE.search(system) or _LOCATIONS_RE.search(user)
+        categories = _QUOTED_RE.findall(cats.group(1)) if cats else []
+        locations = _QUOTED_RE.findall(locs.group(1)) if locs else []
+        texts = _MESSAGE_RE.findall(user) or [user]
+        if "JSON-массив" in system or "JSON-массив" in user:
+            return json.dumps([{"id": i, **self.verdict(t, categories, locations)} for i, t in enumerate(texts, 1)],
+                              ensure_ascii=False)
+        return json.dumps(self.verdict(texts[-1], categories, locations), ensure_ascii=False)
+
+
+class FaultPlan:
+    """Решает, как ответить на очередной запрос: (статус, задержка)."""
+
+    def __init__(self, latency: str = "fixed:0", error_rate: float = 0.0, rpm: int = 0,
+                 bursts: Optional[List[Tuple[int, float, float]]] = None, timeout_rate: float = 0.0,
+                 hang: float = 600.0, seed: int = 0):
+        self._latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.bursts = bursts or []
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._tokens = float(rpm)
+        self._refill_ts = self._started
+
+    def _rate_limited(self, now: float) -> bool:
+        if not self.rpm:
+            return False
+        self._tokens = min(self.rpm, self._tokens + (now - self._refill_ts) * self.rpm / 60)
+        self._refill_ts = now
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    def decide(self) -> Tuple[int, float]:
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._started
+            delay = self._latency(self._rng)
+            for code, seconds, every in self.bursts:
+                if elapsed % every < seconds:
+                    return code, delay
+            if self._rate_limited(now):
+                return 429, delay
+            roll = self._rng.random()
+            if roll < self.timeout_rate:
+                return 200, self.hang
+            if roll < self.timeout_rate + self.error_rate:
+                return self._rng.choice((500, 502, 503)), delay
+            return 200, delay
+
+
+def _completion(content: str, model: str, prompt_chars: int) -> dict:
+    prompt_tokens = max(1, prompt_chars // 4)
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "id": f"chatcmpl-fake-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+_ERRORS = {
+    429: ("Rate limit reached for requests", "rate_limit_exceeded"),
+    500: ("The server had an error while processing your request.", "server_error"),
+    502: ("Bad gateway.", "server_error"),
+    503: ("The engine is currently overloaded, please try again later.", "server_error"),
+}
+
+
+class FakeOpenAIServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, responder: Optional[Responder] = None,
+                 faults: Optional[FaultPlan] = None):
+        self.responder = responder or Responder()
+        self.faults = faults or FaultPlan()
+        self.stats: Counter = Counter()
+        self._stats_lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: dict, headers: Optional[dict] = None) -> None:
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/stats"):
+                    with server._stats_lock:
+                        self._send(200, dict(server.stats))
+                else:
+                    self._send(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length)
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found"}})
+                    return
+                try:
+                    request = json.loads(raw)
+                except json.JSONDecodeError:
+                    self._send(400, {"error": {"message": "invalid JSON", "type": "invalid_request_error"}})
+                    return
+                server._count("requests")
+                status, delay = server.faults.decide()
+                time.sleep(delay)
+                server._count(f"status_{status}")
+                if status != 200:
+                    message, kind = _ERRORS.get(status, ("error", "server_error"))
+                    headers = {"retry-after": "1"} if status == 429 else None
+                    self._send(status, {"error": {"message": message, "type": kind, "code": kind}}, headers)
+                    return
+                messages = request.get("messages", [])
+                content = server.responder.content(messages)
+                prompt_chars = sum(len(m.get("content", "")) for m in messages)
+                self._send(200, _completion(content, request.get("model", "fake"), prompt_chars))
+
+        return Handler
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+
+def load_recordings(path: str) -> Dict[str, dict]:
+    recordings = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if rec.get("text") and isinstance(rec.get("verdict"), dict):
+                recordings[rec["text"].strip()] = rec["verdict"]
+    return recordings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI chat.completions stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:400:0.5", help="fixed:MS | uniform:A:B | normal:MU:SD | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of random 500/502/503")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before 429 (0 = unlimited)")
+    parser.add_argument("--burst", action="append", default=[], help="CODE:SECONDS:EVERY, e.g. 429:5:60")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Fraction of requests that hang")
+    parser.add_argument("--hang", type=float, default=600.0, help="Seconds a hanging request sleeps")
+    parser.add_argument("--rules", help="JSON file: [{\"match\": regex, \"verdict\": {...}}]")
+    parser.add_argument("--recordings", help="JSONL file: {\"text\": ..., \"verdict\": {...}}")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rules = None
+    if args.rules:
+        with open(args.rules, encoding="utf-8") as f:
+            rules = json.load(f)
+    server = FakeOpenAIServer(
+        args.host, args.port,
+        responder=Responder(rules, load_recordings(args.recordings) if args.recordings else None),
+        faults=FaultPlan(args.latency, args.error_rate, args.rpm, [parse_burst(b) for b in args.burst],
+                         args.timeout_rate, args.hang, args.seed),
+    )
+    print(f"Fake OpenAI listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -16,23 +16,13 @@ from rapidfuzz import fuzz
 import logging
 
 # ---------- Negative context -----------------------------------------------
-NEGATIVE_STEMS: List[str] = [
-    "осторожн",
-    "мошенник",
-    "спам",
-    "реклама",
-    "мошенников",
-    "предоплат",
-]
+# Маркеры и сам поиск – в speech_acts (один проход вместе с offer/request/contact)
+from speech_acts import NEGATIVE_STEMS, detect as _detect_speech_acts
 
-_NEGATIVE_REGEX = re.compile(
-    rf"(?<!\bне\s)({'|'.join(NEGATIVE_STEMS)})",
-    flags=re.IGNORECASE
-)
 
 def contains_negative(text: str) -> bool:
     """True, если сообщение содержит нежелательный контекст."""
-    return bool(_NEGATIVE_REGEX.search(text.lower()))
+    return _detect_speech_acts(text.lower()).negative
 
 
 # ---------- Fuzzy similarity ------------------------------------------------
@@ -1,5 +1,8 @@
 import os
-from flask import Flask
+import threading
+from flask import Flask, Response
+
+from metrics import render_prometheus
 
 app = Flask(__name__)
 
@@ -7,6 +10,22 @@ app = Flask(__name__)
 def healthcheck():
     return "OK"
 
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+def start(port=None):
+    """Запускает Flask в фоновом потоке (health-check и /metrics на PORT)."""
+    port = port or int(os.environ.get("PORT", 8080))
+    thread = threading.Thread(
+        target=app.run,
+        kwargs={"host": "0.0.0.0", "port": port, "use_reloader": False},
+        name="keep-alive",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
-    app.run(host="0.0.0.0", port=port)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=port)
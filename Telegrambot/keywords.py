@@ -0,0 +1,154 @@
+r"""
+keywords.py
+Компилированный матчер ключевых слов из categories.json.
+
+Строится один раз при старте (см. config.keyword_matcher):
+• каждый стем получает целочисленный id (интернирование);
+• однословные keywords → инвертированный индекс stem_id → keyword_id;
+• многословные keywords («нужен трансфер», «аренда яхт») → n-граммы стемов,
+  проверяются по потоку токенов сообщения;
+• keyword_id → категории и (категория, подкатегория), к которым он относится;
+• категория / (категория, подкатегория) → множество её keyword_id (для
+  персональных планов подписчиков, см. routing.MatchPlan).
+
+match(lower_text) делает один проход по токенам сообщения и возвращает все
+найденные категории/подкатегории.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from stemmer import WORD_RE, stem as _stem, stem_many
+
+
+@dataclass
+class KeywordMatch:
+    """Результат матчинга одного сообщения."""
+    # категория → первый сработавший keyword (в порядке появления в тексте)
+    categories: Dict[str, str] = field(default_factory=dict)
+    # (категория, подкатегория) → первый сработавший keyword
+    subcategories: Dict[Tuple[str, str], str] = field(default_factory=dict)
+    # первая категория в порядке categories.json (эвристика для AI)
+    first_category: Optional[str] = None
+    # id всех сработавших keywords (однословных и фраз)
+    keyword_ids: FrozenSet[int] = frozenset()
+
+    def wanted_by(self, prefs: dict) -> Optional[Tuple[str, str]]:
+        """
+        Возвращает (метка, keyword), если сообщение попадает в категории или
+        подкатегории подписчика, иначе None. Метка — "cat" или "cat/sub".
+        """
+        for cat in prefs.get("categories", []):
+            kw = self.categories.get(cat)
+            if kw:
+                return cat, kw
+        for cat, sub_list in prefs.get("subcats", {}).items():
+            for sub in sub_list:
+                kw = self.subcategories.get((cat, sub))
+                if kw:
+                    return f"{cat}/{sub}", kw
+        return None
+
+
+class KeywordMatcher:
+    """Инвертированный индекс keywords из categories.json по стемам."""
+
+    def __init__(self, categories: Dict[str, Any]):
+        self._stem_ids: Dict[str, int] = {}
+        # keyword_id → исходная строка keyword (для логов)
+        self.keywords: List[str] = []
+        self._keyword_ids: Dict[Tuple[int, ...], int] = {}
+        self._kw_categories: List[set] = []
+        self._kw_subcategories: List[set] = []
+        # однословные keywords: stem_id → keyword_id
+        self._single: Dict[int, int] = {}
+        # многословные keywords: первый stem_id → [(шаблон, keyword_id)]
+        self._phrases: Dict[int, List[Tuple[Tuple[int, ...], int]]] = {}
+        self._category_rank = {cat: i for i, cat in enumerate(categories)}
+
+        for cat, entry in categories.items():
+            for kw in entry.get("keywords", []):
+                self._add(kw, cat, None)
+            for sub, sub_entry in entry.get("subcategories", {}).items():
+                for kw in sub_entry.get("keywords", []):
+                    self._add(kw, cat, sub)
+
+        # Длинные фразы проверяем первыми
+        for patterns in self._phrases.values():
+            patterns.sort(key=lambda p: -len(p[0]))
+        self.kw_categories: List[FrozenSet[str]] = [frozenset(c) for c in self._kw_categories]
+        self.kw_subcategories: List[FrozenSet[Tuple[str, str]]] = [frozenset(s) for s in self._kw_subcategories]
+        del self._kw_categories, self._kw_subcategories
+
+        # Обратные индексы: keywords категории включают keywords её подкатегорий
+        by_cat: Dict[str, set] = {}
+        by_sub: Dict[Tuple[str, str], set] = {}
+        for kw_id, cats in enumerate(self.kw_categories):
+            for cat in cats:
+                by_cat.setdefault(cat, set()).add(kw_id)
+            for pair in self.kw_subcategories[kw_id]:
+                by_sub.setdefault(pair, set()).add(kw_id)
+        self.category_keywords: Dict[str, FrozenSet[int]] = {c: frozenset(v) for c, v in by_cat.items()}
+        self.subcategory_keywords: Dict[Tuple[str, str], FrozenSet[int]] = {p: frozenset(v) for p, v in by_sub.items()}
+
+    def _intern(self, stem: str) -> int:
+        sid = self._stem_ids.get(stem)
+        if sid is None:
+            sid = self._stem_ids[stem] = len(self._stem_ids)
+        return sid
+
+    def _add(self, keyword: str, cat: str, sub: Optional[str]) -> None:
+        tokens = WORD_RE.findall(str(keyword).lower())
+        if not tokens:
+            return
+        pattern = tuple(self._intern(_stem(tok)) for tok in tokens)
+        kw_id = self._keyword_ids.get(pattern)
+        if kw_id is None:
+            kw_id = self._keyword_ids[pattern] = len(self.keywords)
+            self.keywords.append(keyword)
+            self._kw_categories.append(set())
+            self._kw_subcategories.append(set())
+            if len(pattern) == 1:
+                self._single[pattern[0]] = kw_id
+            else:
+                self._phrases.setdefault(pattern[0], []).append((pattern, kw_id))
+        self._kw_categories[kw_id].add(cat)
+        if sub is not None:
+            self._kw_subcategories[kw_id].add((cat, sub))
+
+    def stem_ids(self, lower_text: str) -> List[int]:
+        """Поток stem_id токенов сообщения; -1 для стемов вне словаря."""
+        get = self._stem_ids.get
+        return [get(stem, -1) for stem in stem_many(WORD_RE.findall(lower_text))]
+
+    def keyword_hits(self, ids: List[int]) -> List[int]:
+        """keyword_id в порядке появления в потоке токенов (без повторов)."""
+        hits: Dict[int, None] = {}
+        single = self._single
+        phrases = self._phrases
+        for pos, sid in enumerate(ids):
+            if sid < 0:
+                continue
+            for pattern, kw_id in phrases.get(sid, ()):
+                if tuple(ids[pos:pos + len(pattern)]) == pattern:
+                    hits.setdefault(kw_id)
+            kw_id = single.get(sid)
+            if kw_id is not None:
+                hits.setdefault(kw_id)
+        return list(hits)
+
+    def match(self, lower_text: str) -> KeywordMatch:
+        """Один проход по токенам: все найденные категории и подкатегории."""
+        result = KeywordMatch()
+        hits = self.keyword_hits(self.stem_ids(lower_text))
+        result.keyword_ids = frozenset(hits)
+        for kw_id in hits:
+            keyword = self.keywords[kw_id]
+            for cat in self.kw_categories[kw_id]:
+                result.categories.setdefault(cat, keyword)
+            for pair in self.kw_subcategories[kw_id]:
+                result.subcategories.setdefault(pair, keyword)
+        if result.categories:
+            result.first_category = min(result.categories, key=self._category_rank.__getitem__)
+        return result
@@ -0,0 +1,16 @@
+# Алиасы регионов (lowercase) → каноническое название.
+# Отдельный модуль, чтобы офлайн-скрипты не тянули config (он требует .env).
+LOCATION_ALIAS = {
+    "анталия": "Анталия",
+    "анталья": "Анталия",
+    "кемер": "Кемер",
+    "стамбул": "Стамбул",
+    "белдиби": "Бельдиби",
+    "бельдиби": "Бельдиби",
+    "гейнюк": "Гёйнюк",
+    "гёйнюк": "Гёйнюк",
+    "манавгат": "Манавгат",
+    "чамьюва": "Чамьюва",
+    "турция": "Турция",
+    "сиде": "Сиде"
+}
@@ -0,0 +1,134 @@
+# Общие метрики бота (Counter). Отдельный модуль, чтобы ai_utils и офлайн-скрипты
+# могли писать метрики без импорта config (config требует .env Telegram).
+#
+# Экспорт в формате Prometheus (keep_alive.py → /metrics):
+# • счётчики воронки – ключи metrics (leadbot_<key>_total); ключи *_max / *_pct
+#   экспортируются как gauge;
+# • gauge – функции, которые вызываются только при скрейпе (размеры кэшей,
+#   глубина очередей, число подписчиков), в handler они ничего не стоят;
+# • histogram – фиксированные корзины, observe() = bisect + два сложения;
+# • collector – функция, возвращающая готовые строки (например, квантили этапов
+#   из tracing.Tracer).
+from bisect import bisect_left
+from collections import Counter
+import re
+from typing import Callable, Dict, Iterable, List, Tuple
+
+metrics = Counter()
+
+PREFIX = "leadbot_"
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+_GAUGE_SUFFIXES = ("_max", "_pct")
+
+# Корзины по умолчанию (секунды): от 5 мс до 2 минут
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _metric_name(key: str) -> str:
+    return PREFIX + _NAME_RE.sub("_", key)
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (кумулятивные суммы считаются при экспорте)."""
+
+    __slots__ = ("name", "help", "buckets", "counts", "sum", "count")
+
+    def __init__(self, name: str, buckets: Iterable[float] = DEFAULT_BUCKETS, help: str = ""):
+        self.name = name
+        self.help = help
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self) -> str:
+        name = _metric_name(self.name)
+        lines = []
+        if self.help:
+            lines.append(f"# HELP {name} {self.help}")
+        lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{le="{_fmt(bound)}"}} {cumulative}')
+        lines.append(f"{name}_sum {_fmt(self.sum)}")
+        lines.append(f"{name}_count {self.count}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self, counters: Counter):
+        self.counters = counters
+        self.histograms: Dict[str, Histogram] = {}
+        self.gauges: Dict[str, Tuple[Callable[[], float], str]] = {}
+        self.collectors: List[Callable[[], Iterable[str]]] = []
+
+    def histogram(self, name: str, buckets: Iterable[float] = DEFAULT_BUCKETS, help: str = "") -> Histogram:
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram(name, buckets, help)
+        return hist
+
+    def gauge(self, name: str, fn: Callable[[], float], help: str = "") -> None:
+        """Регистрирует gauge; fn вызывается при каждом скрейпе."""
+        self.gauges[name] = (fn, help)
+
+    def collector(self, fn: Callable[[], Iterable[str]]) -> None:
+        """Регистрирует источник готовых строк экспозиции; fn вызывается при скрейпе."""
+        self.collectors.append(fn)
+
+    def render(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus 0.0.4. Вызывается из потока
+        Flask, пока event loop добавляет ключи: словари копируются list(...)
+        одним шагом под GIL, а не обходятся напрямую.
+        """
+        lines = []
+        for key, value in sorted(list(self.counters.items())):
+            if not isinstance(value, (int, float)):
+                continue
+            if key.endswith(_GAUGE_SUFFIXES):
+                name = _metric_name(key)
+                lines.append(f"# TYPE {name} gauge")
+            else:
+                name = _metric_name(key)
+                if not name.endswith("_total"):
+                    name += "_total"
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {_fmt(value)}")
+        for key, (fn, help) in sorted(list(self.gauges.items())):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            name = _metric_name(key)
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_fmt(value)}")
+        for _, hist in sorted(list(self.histograms.items())):
+            lines.append(hist.render())
+        for fn in list(self.collectors):
+            try:
+                lines.extend(fn())
+            except Exception:
+                continue
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(metrics)
+histogram = registry.histogram
+gauge = registry.gauge
+collector = registry.collector
+render_prometheus = registry.render
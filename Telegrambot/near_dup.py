@@ -0,0 +1,408 @@
+r"""
+near_dup.py
+Хранилище почти-дубликатов: одно и то же объявление, разосланное по десяткам
+чатов, классифицируется один раз.
+
+• SimHash (64 бита) по словам и биграммам нормализованного текста
+  (classify_cache.normalize_text – без контактов, эмодзи, пунктуации);
+• поиск кандидатов – max_distance + 1 полос по ~64/(d+1) бит: при расстоянии
+  Хэмминга ≤ d хотя бы одна полоса совпадает точно (принцип Дирихле).
+  По корпусу конкурентов перепосты с другим заголовком/контактами лежат в 2–8
+  битах, поэтому по умолчанию d = 6 (7 полос по 9–10 бит);
+• кластер хранит вердикт ИИ и флаг «отклонён» в течение окна window;
+• в памяти не больше max_clusters кластеров (LRU), вытесненные сбрасываются в
+  SQLite и поднимаются обратно при совпадении; к SQLite обращаемся, только
+  если полоса отпечатка есть среди полос сброшенных кластеров (счётчики в
+  памяти) – обычный промах не делает запросов на loop;
+• сброс на диск не идёт на loop: вытесненные кластеры копятся в очереди, её
+  раз в flush_interval пишет одной транзакцией отдельный поток (как в
+  classify_cache); до записи кластеры из очереди тоже находятся lookup'ом,
+  а чтение с диска идёт своим соединением и не ждёт транзакций записи;
+• протухшие кластеры пропускаются при поиске (и удаляются), ближайшим
+  становится лучший живой; suppressed_by_chat – только отклонённые;
+• короткие тексты (< min_tokens слов) не участвуют: у них SimHash ненадёжен.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from classify_cache import normalize_text
+
+_log = logging.getLogger(__name__)
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# Байт → те же биты, разнесённые по 16-битным «дорожкам»: сумма разнесённых хэшей
+# даёт сразу все 64 счётчика SimHash одним сложением длинных целых
+_LANE = 16
+_SPREAD = [sum(1 << (_LANE * i) for i in range(8) if b >> i & 1) for b in range(256)]
+
+
+@lru_cache(maxsize=65536)
+def _spread(feature: str) -> int:
+    """Разнесённый хэш признака (кэшируется: слова и биграммы объявлений повторяются)."""
+    h = _feature_hash(feature)
+    s = 0
+    for pos in range(8):
+        s |= _SPREAD[(h >> (8 * pos)) & 0xFF] << (8 * _LANE * pos)
+    return s
+
+
+def simhash(words: List[str]) -> int:
+    """64-битный SimHash по словам и биграммам (биграммы весят вдвое больше)."""
+    acc = total = 0
+    for w in words:
+        acc += _spread(w)
+        total += 1
+    for a, b in zip(words, words[1:]):
+        acc += 2 * _spread(a + " " + b)
+        total += 2
+    value = 0
+    lane_mask = (1 << _LANE) - 1
+    for bit in range(64):
+        # бит = 1, если взвешенных «единиц» больше половины
+        if 2 * ((acc >> (_LANE * bit)) & lane_mask) > total:
+            value |= 1 << bit
+    return value
+
+
+def band_layout(n: int) -> List[Tuple[int, int]]:
+    """(сдвиг, маска) для n полос, покрывающих 64 бита."""
+    bounds = [64 * i // n for i in range(n + 1)]
+    return [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(bounds, bounds[1:])]
+
+
+def _to_signed(value: int) -> int:
+    """SQLite INTEGER – знаковый 64-бит."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class Fingerprint(NamedTuple):
+    value: int
+    bands: List[int]
+
+
+class NearDupHit(NamedTuple):
+    verdict: dict
+    rejected: bool
+    distance: int
+
+
+class _Cluster:
+    __slots__ = ("value", "verdict", "rejected", "expires")
+
+    def __init__(self, value, verdict, rejected, expires):
+        self.value = value
+        self.verdict = verdict
+        self.rejected = rejected
+        self.expires = expires
+
+
+class NearDupStore:
+    def __init__(self, path: Optional[str] = "near_dup.sqlite3", window: float = 24 * 3600,
+                 max_clusters: int = 20000, max_distance: int = 6, min_tokens: int = 8,
+                 metrics: Optional[Counter] = None, flush_interval: float = 1.0):
+        if not 0 <= max_distance < 16:
+            raise ValueError("max_distance must be in [0, 16)")
+        self.path = path
+        self.window = window
+        self.max_clusters = max_clusters
+        self.max_distance = max_distance
+        self.min_tokens = min_tokens
+        self.flush_interval = flush_interval
+        self.metrics = metrics if metrics is not None else Counter()
+        self.suppressed_by_chat: Counter = Counter()
+        self._layout = band_layout(max_distance + 1)
+        self._clusters: "OrderedDict[int, _Cluster]" = OrderedDict()
+        self._index: List[Dict[int, set]] = [{} for _ in self._layout]
+        # Полосы кластеров на диске (key → число кластеров) и их значения: промах в памяти
+        # идёт в SQLite, только если у отпечатка есть хоть одна такая полоса
+        self._disk_bands: List[Counter] = [Counter() for _ in self._layout]
+        self._disk_values: set = set()
+        self._lock = threading.Lock()          # кластеры в памяти, полосы диска, очередь
+        self._db_lock = threading.Lock()       # соединение записи (поток записи, prune, flush)
+        # Очередь сброса: value → кластер для записи или None (удалить с диска).
+        # _writing – пачка, которую поток записи сейчас коммитит: до COMMIT её видно в lookup
+        self._pending: Dict[int, Optional[_Cluster]] = {}
+        self._writing: Dict[int, Optional[_Cluster]] = {}
+        self._wakeup = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self._db: Optional[sqlite3.Connection] = None
+        self._read_db: Optional[sqlite3.Connection] = None
+        if path:
+            self._open()
+
+    def __len__(self) -> int:
+        return len(self._clusters)
+
+    def _bands(self, value: int) -> List[int]:
+        return [(value >> shift) & mask for shift, mask in self._layout]
+
+    # --- SQLite spill ------------------------------------------------------
+    def _open(self) -> None:
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS clusters ("
+            " value INTEGER PRIMARY KEY, verdict TEXT NOT NULL,"
+            " rejected INTEGER NOT NULL, expires REAL NOT NULL)"
+        )
+        # Полосы – отдельной таблицей: смена max_distance не требует миграции схемы
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS cluster_bands ("
+            " layout INTEGER NOT NULL, band INTEGER NOT NULL,"
+            " key INTEGER NOT NULL, value INTEGER NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS cluster_bands_key ON cluster_bands(layout, band, key)")
+        db.execute("CREATE INDEX IF NOT EXISTS cluster_bands_value ON cluster_bands(value)")
+        self._db = db
+        # Чтение на loop – своим соединением: в WAL оно не ждёт транзакций потока записи
+        self._read_db = sqlite3.connect(Path(self.path).resolve().as_uri() + "?mode=ro", uri=True,
+                                        check_same_thread=False, isolation_level=None)
+        rows = db.execute("SELECT band, key, value FROM cluster_bands WHERE layout = ?", (len(self._layout),))
+        for band, key, value in rows:
+            self._disk_bands[band][key] += 1
+            self._disk_values.add(value)
+
+    def _track_disk(self, value: int, sign: int) -> None:
+        """value – знаковое (как в SQLite); sign = +1 при сбросе на диск, -1 при удалении."""
+        if (value in self._disk_values) == (sign > 0):
+            return
+        if sign > 0:
+            self._disk_values.add(value)
+        else:
+            self._disk_values.discard(value)
+        for i, key in enumerate(self._bands(value & (1 << 64) - 1)):
+            bands = self._disk_bands[i]
+            bands[key] += sign
+            if bands[key] <= 0:
+                del bands[key]
+
+    def _spill(self, c: _Cluster) -> None:
+        """Вытесненный кластер – в очередь записи (под self._lock, без I/O)."""
+        if self._db is None or c.expires <= time.time():
+            return
+        self._pending[c.value] = c
+        self._track_disk(_to_signed(c.value), +1)
+        self.metrics['near_dup_spilled'] += 1
+        self._schedule()
+
+    def _unspill(self, value: int) -> None:
+        self._pending[value] = None
+        self._track_disk(_to_signed(value), -1)
+        self._schedule()
+
+    def _queued(self, value: int):
+        """(True, кластер или None), если по value есть незаписанная операция."""
+        for queue in (self._pending, self._writing):
+            if value in queue:
+                return True, queue[value]
+        return False, None
+
+    # --- запись в фоне -------------------------------------------------------
+    def _schedule(self) -> None:
+        """Будит поток записи (под self._lock); поток стартует при первом сбросе."""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="near-dup-writer", daemon=True)
+            self._writer.start()
+        self._wakeup.set()
+
+    def _write_loop(self) -> None:
+        while True:
+            self._wakeup.wait()
+            # окно накопления: серия вытеснений → одна транзакция
+            time.sleep(self.flush_interval)
+            self._write_pending()
+
+    def _write_pending(self) -> None:
+        with self._db_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._writing = batch
+                self._wakeup.clear()
+            if not batch:
+                return
+            db = self._db
+            layout = len(self._layout)
+            try:
+                db.execute("BEGIN")
+                for value, c in batch.items():
+                    signed = _to_signed(value)
+                    db.execute("DELETE FROM cluster_bands WHERE value = ?", (signed,))
+                    if c is None:
+                        db.execute("DELETE FROM clusters WHERE value = ?", (signed,))
+                        continue
+                    db.execute(
+                        "INSERT OR REPLACE INTO clusters VALUES (?, ?, ?, ?)",
+                        (signed, json.dumps(c.verdict, ensure_ascii=False, default=str), int(c.rejected), c.expires),
+                    )
+                    db.executemany(
+                        "INSERT INTO cluster_bands VALUES (?, ?, ?, ?)",
+                        [(layout, i, key, signed) for i, key in enumerate(self._bands(value))],
+                    )
+                db.execute("COMMIT")
+            except Exception as e:
+                db.execute("ROLLBACK")
+                _log.error(f"Failed to spill {len(batch)} near-duplicate clusters: {e}")
+                # вернуть в очередь то, что не перезаписано более свежими операциями
+                with self._lock:
+                    for value, c in batch.items():
+                        self._pending.setdefault(value, c)
+            finally:
+                with self._lock:
+                    self._writing = {}
+
+    # --- память ------------------------------------------------------------
+    def _add(self, c: _Cluster) -> None:
+        old = self._clusters.pop(c.value, None)
+        if old is not None:
+            self._unindex(old)
+        self._clusters[c.value] = c
+        for i, band in enumerate(self._bands(c.value)):
+            self._index[i].setdefault(band, set()).add(c.value)
+        while len(self._clusters) > self.max_clusters:
+            _, evicted = self._clusters.popitem(last=False)
+            self._unindex(evicted)
+            self._spill(evicted)
+
+    def _unindex(self, c: _Cluster) -> None:
+        for i, band in enumerate(self._bands(c.value)):
+            bucket = self._index[i].get(band)
+            if bucket is not None:
+                bucket.discard(c.value)
+                if not bucket:
+                    del self._index[i][band]
+
+    def _drop(self, c: _Cluster) -> None:
+        del self._clusters[c.value]
+        self._unindex(c)
+
+    # --- API ---------------------------------------------------------------
+    def fingerprint(self, text: str) -> Optional[Fingerprint]:
+        """Отпечаток текста или None, если текст слишком короткий."""
+        words = normalize_text(text).split()
+        if len(words) < self.min_tokens:
+            return None
+        value = simhash(words)
+        return Fingerprint(value, self._bands(value))
+
+    def lookup(self, fp: Optional[Fingerprint], chat_id=None) -> Optional[NearDupHit]:
+        """Ближайший живой кластер в пределах max_distance; считает подавления по чату."""
+        if fp is None:
+            return None
+        now = time.time()
+        with self._lock:
+            best, best_dist = None, self.max_distance + 1
+            expired = []
+            target = fp.value
+            clusters = self._clusters
+            for i, band in enumerate(fp.bands):
+                for value in self._index[i].get(band, ()):
+                    dist = (value ^ target).bit_count()
+                    if dist < best_dist:
+                        c = clusters[value]
+                        if c.expires <= now:
+                            # протухший кластер: вердикт недействителен, ищем среди остальных
+                            expired.append(c)
+                        else:
+                            best, best_dist = c, dist
+            for c in set(expired):
+                self._drop(c)
+            if best is None and self._on_disk(fp):
+                best, best_dist = self._lookup_disk(fp, now)
+            if best is None:
+                self.metrics['near_dup_miss'] += 1
+                return None
+            self._clusters.move_to_end(best.value)
+        self.metrics['near_dup_rejected_hit' if best.rejected else 'near_dup_accepted_hit'] += 1
+        if chat_id is not None and best.rejected:
+            self.suppressed_by_chat[chat_id] += 1
+        return NearDupHit(dict(best.verdict), best.rejected, best_dist)
+
+    def _on_disk(self, fp: Fingerprint) -> bool:
+        """Есть ли на диске кластер хоть с одной общей полосой (без запроса к SQLite)."""
+        if self._db is None:
+            return False
+        return any(key in self._disk_bands[i] for i, key in enumerate(fp.bands))
+
+    def _lookup_disk(self, fp: Fingerprint, now: float):
+        where = " OR ".join("(band = ? AND key = ?)" for _ in fp.bands)
+        params = [x for i, key in enumerate(fp.bands) for x in (i, key)]
+        rows = self._read_db.execute(
+            "SELECT value, verdict, rejected, expires FROM clusters WHERE expires > ? AND value IN"
+            f" (SELECT value FROM cluster_bands WHERE layout = ? AND ({where}))",
+            (now, len(self._layout), *params),
+        ).fetchall()
+        candidates = []
+        for value, verdict, rejected, expires in rows:
+            value &= (1 << 64) - 1
+            if not self._queued(value)[0]:        # иначе на диске устаревшая копия
+                candidates.append((value, verdict, rejected, expires))
+        # ещё не записанные кластеры (без полос в SQL – их мало, просто перебираем)
+        for queue in (self._pending, self._writing):
+            for value, c in queue.items():
+                if c is not None and c.expires > now and self._pending.get(value, c) is c:
+                    candidates.append((value, c.verdict, c.rejected, c.expires))
+        best, best_dist = None, self.max_distance + 1
+        for candidate in candidates:
+            dist = (candidate[0] ^ fp.value).bit_count()
+            if dist < best_dist:
+                best, best_dist = candidate, dist
+        if best is None:
+            return None, None
+        value, verdict, rejected, expires = best
+        # Кластер снова горячий: переезжает в память, с диска удаляется
+        self._unspill(value)
+        c = _Cluster(value, json.loads(verdict) if isinstance(verdict, str) else verdict, bool(rejected), expires)
+        self._add(c)
+        self.metrics['near_dup_disk_hit'] += 1
+        return c, best_dist
+
+    def remember(self, fp: Optional[Fingerprint], verdict: dict, rejected: bool) -> None:
+        """Запомнить вердикт для кластера этого отпечатка на window секунд."""
+        if fp is None:
+            return
+        with self._lock:
+            self._add(_Cluster(fp.value, dict(verdict), bool(rejected), time.time() + self.window))
+
+    def prune(self) -> int:
+        """Удаляет протухшие кластеры из памяти и с диска (cleaner_task, в потоке)."""
+        now = time.time()
+        with self._lock:
+            expired = [c for c in self._clusters.values() if c.expires <= now]
+            for c in expired:
+                self._drop(c)
+        if self._db is None:
+            return len(expired)
+        with self._db_lock:
+            gone = [v for (v,) in self._db.execute("SELECT value FROM clusters WHERE expires <= ?", (now,))]
+            self._db.execute("DELETE FROM clusters WHERE expires <= ?", (now,))
+            self._db.execute("DELETE FROM cluster_bands WHERE value NOT IN (SELECT value FROM clusters)")
+        with self._lock:
+            for value in gone:
+                # кластер, снова поставленный в очередь, будет записан заново
+                if not self._queued(value & (1 << 64) - 1)[0]:
+                    self._track_disk(value, -1)
+        return len(expired) + len(gone)
+
+    def flush(self) -> None:
+        """Сбросить все живые кластеры на диск синхронно (при остановке), чтобы пережить рестарт."""
+        if self._db is None:
+            return
+        with self._lock:
+            for c in self._clusters.values():
+                self._spill(c)
+        self._write_pending()
@@ -0,0 +1,189 @@
+r"""
+overrides.py
+Пост-правила поверх вердикта AI из overrides.json (без редеплоя).
+
+Формат файла:
+    {"version": 3, "rules": [
+        {"id": "insurance_ad", "enabled": true,
+         "when": {"all": ["страховка"], "any": ["купить", ...], "none": ["сколько стоит", ...]},
+         "set": {"relevant": false, "explanation": "Реклама страховки"}}]}
+
+• условия – подстроки lower_text (как прежние `in`-проверки apply_overrides):
+  all – все есть, any – хотя бы одна, none – ни одной;
+• правила применяются по порядку, срабатывают все подходящие; set
+  перезаписывает поля вердикта;
+• компиляция при загрузке: все термы всех правил интернируются в общую
+  таблицу, правило хранит кортежи id термов. На сообщение каждый терм ищется
+  не больше одного раза (результат кэшируется между правилами), условия all
+  проверяются первыми и отсекают правило до остальных термов. Поиск – C-шный
+  str.__contains__: regex-альтернатива из тех же термов медленнее;
+• reload_if_changed() – перечитать файл при смене mtime; битый или
+  отсутствующий файл не заменяет рабочие правила (overrides_reload_failed и
+  ошибка в логе – в том числе при старте без файла);
+• счётчики по правилу: проверки, срабатывания, время – stats() и
+  prometheus_lines() (leadbot_override_rule_*).
+"""
+
+from __future__ import annotations
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+_log = logging.getLogger(__name__)
+
+_CONDITIONS = ("all", "any", "none")
+
+
+class Rule:
+    __slots__ = ("id", "all", "any", "none", "set")
+
+    def __init__(self, rule_id: str, all_ids: Tuple[int, ...], any_ids: Tuple[int, ...],
+                 none_ids: Tuple[int, ...], fields: dict):
+        self.id = rule_id
+        self.all = all_ids
+        self.any = any_ids
+        self.none = none_ids
+        self.set = fields
+
+
+class CompiledRules:
+    """Неизменяемый снимок правил одной версии файла (подменяется целиком при reload)."""
+
+    def __init__(self, spec: dict):
+        if not isinstance(spec, dict) or not isinstance(spec.get("rules"), list):
+            raise ValueError("overrides: expected {'version': ..., 'rules': [...]}")
+        self.version = spec.get("version")
+        self.terms: List[str] = []
+        term_id: Dict[str, int] = {}
+        self.rules: List[Rule] = []
+        seen = set()
+        for raw in spec["rules"]:
+            rule_id = raw.get("id")
+            if not rule_id or rule_id in seen:
+                raise ValueError(f"overrides: missing or duplicate rule id {rule_id!r}")
+            seen.add(rule_id)
+            if not raw.get("enabled", True):
+                continue
+            when = raw.get("when") or {}
+            unknown = set(when) - set(_CONDITIONS)
+            if unknown or not isinstance(raw.get("set"), dict):
+                raise ValueError(f"overrides: rule {rule_id!r} has bad 'when'/'set'")
+            ids = []
+            for cond in _CONDITIONS:
+                cond_ids = []
+                for term in when.get(cond, []):
+                    term = term.lower()
+                    if term not in term_id:
+                        term_id[term] = len(self.terms)
+                        self.terms.append(term)
+                    cond_ids.append(term_id[term])
+                ids.append(tuple(cond_ids))
+            self.rules.append(Rule(rule_id, *ids, dict(raw["set"])))
+
+
+class OverrideRules:
+    def __init__(self, path: Optional[str] = None, spec: Optional[dict] = None, metrics=None):
+        self.path = path
+        self.metrics = metrics
+        self._mtime: Optional[float] = None
+        self._missing = False
+        # rule id → [проверок, срабатываний, наносекунд]
+        self._stats: Dict[str, List[int]] = {}
+        self.compiled = CompiledRules(spec if spec is not None else {"version": None, "rules": []})
+        if spec is None and path:
+            self.reload_if_changed()
+
+    @property
+    def version(self):
+        return self.compiled.version
+
+    def reload_if_changed(self) -> bool:
+        """True, если файл перечитан и правила подменены."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            # Без файла бот работает без правил (или со старыми) – сообщаем один раз, а не каждые 30 с
+            if not self._missing:
+                self._missing = True
+                _log.error(f"Override rules file unavailable, keeping {len(self.compiled.rules)} rules: {e}")
+                if self.metrics is not None:
+                    self.metrics['overrides_reload_failed'] += 1
+            return False
+        self._missing = False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                compiled = CompiledRules(json.load(f))
+        except (OSError, ValueError) as e:
+            _log.error(f"Override rules not reloaded from {self.path}: {e}")
+            if self.metrics is not None:
+                self.metrics['overrides_reload_failed'] += 1
+            return False
+        self.compiled = compiled
+        _log.info(f"Override rules v{compiled.version} loaded: {len(compiled.rules)} rules, {len(compiled.terms)} terms")
+        if self.metrics is not None:
+            self.metrics['overrides_reloaded'] += 1
+        return True
+
+    def apply(self, cla: dict, lower_text: str) -> dict:
+        """Применяет все сработавшие правила к cla (на месте) и возвращает его."""
+        compiled = self.compiled               # один снимок на всё сообщение
+        terms = compiled.terms
+        present: Dict[int, bool] = {}
+        stats = self._stats
+        for rule in compiled.rules:
+            started = time.perf_counter_ns()
+            hit = True
+            for i in rule.all:
+                if i not in present:
+                    present[i] = terms[i] in lower_text
+                if not present[i]:
+                    hit = False
+                    break
+            if hit and rule.any:
+                hit = False
+                for i in rule.any:
+                    if i not in present:
+                        present[i] = terms[i] in lower_text
+                    if present[i]:
+                        hit = True
+                        break
+            if hit:
+                for i in rule.none:
+                    if i not in present:
+                        present[i] = terms[i] in lower_text
+                    if present[i]:
+                        hit = False
+                        break
+            if hit:
+                cla.update(rule.set)
+            counters = stats.get(rule.id)
+            if counters is None:
+                counters = stats[rule.id] = [0, 0, 0]
+            counters[0] += 1
+            counters[1] += hit
+            counters[2] += time.perf_counter_ns() - started
+        return cla
+
+    def stats(self) -> Dict[str, dict]:
+        return {rule_id: {"evaluated": n, "hits": hits, "seconds": ns / 1e9}
+                for rule_id, (n, hits, ns) in sorted(self._stats.items())}
+
+    def prometheus_lines(self, prefix: str = "leadbot_override_rule") -> List[str]:
+        lines = []
+        for suffix, idx, kind, help_text in (
+                ("evaluations_total", 0, "counter", "Override rule evaluations"),
+                ("hits_total", 1, "counter", "Override rule hits"),
+                ("seconds_total", 2, "counter", "Time spent evaluating the override rule")):
+            name = f"{prefix}_{suffix}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for rule_id, counters in sorted(list(self._stats.items())):
+                value = counters[idx] / 1e9 if idx == 2 else counters[idx]
+                lines.append(f'{name}{{rule="{rule_id}"}} {value!r}')
+        if isinstance(self.version, (int, float)):
+            lines += [f"# TYPE {prefix}s_version gauge", f"{prefix}s_version {self.version}"]
+        return lines
@@ -0,0 +1,287 @@
+r"""
+pipeline.py
+Обработка одного сообщения из группы: от дедупликации до постановки лида в
+рассылку, без привязки к Telethon-клиенту и OpenAI.
+
+Все зависимости передаются явно (см. Botparsing.py для боевой сборки и
+bench.py для офлайн-прогона):
+• deduper / near_dups / chat_cache / sender_cache – состояние между сообщениями;
+• region_detector, keyword_matcher, routing_index – скомпилированные индексы;
+• classify(text, categories, locations) – async-классификатор (ai_batcher.classify);
+• apply_overrides – пост-правила поверх вердикта AI;
+• deliver(...) – async-приёмник лида с сигнатурой delivery.send_lead_to_users;
+• rejected_log / low_confidence_log – объекты с write(line) (audit_log.AuditLog);
+• speech_acts(lower_text) – необязательный детектор речевых актов
+  (speech_acts.detect): предложение с контактами без запроса не идёт в AI
+  (проверка после маршрутизации – в ai_rejected.log только то, что иначе
+  ушло бы в AI);
+• preclassifier / preclassified_log – необязательный локальный фильтр
+  (preclassifier.PreClassifier): уверенно нерелевантное не уходит в AI.
+
+event – любой объект с полями NewMessage: chat_id, id, date, is_group,
+is_channel, sender_id, raw_text и корутинами get_chat() / get_sender().
+"""
+
+from __future__ import annotations
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+def now_istanbul():
+    return datetime.now(timezone.utc) + timedelta(hours=3)
+
+
+class Pipeline:
+    def __init__(self, *, deduper, near_dups, chat_cache, sender_cache, region_detector,
+                 location_alias: Dict[str, str], canonical_locations: List[str], keyword_matcher,
+                 routing_index, subscriptions, categories: Dict[str, Any],
+                 classify: Callable[..., Awaitable[dict]], apply_overrides: Callable[..., dict],
+                 deliver: Callable[..., Awaitable[None]], rejected_log, low_confidence_log,
+                 metrics, logger, conf_threshold: float = 0.7, verbose_debug: bool = False,
+                 speech_acts: Optional[Callable[[str], Any]] = None, preclassifier=None,
+                 preclassified_log=None):
+        self.deduper = deduper
+        self.near_dups = near_dups
+        self.chat_cache = chat_cache
+        self.sender_cache = sender_cache
+        self.region_detector = region_detector
+        self.location_alias = location_alias
+        self.canonical_locations = canonical_locations
+        self.keyword_matcher = keyword_matcher
+        self.routing_index = routing_index
+        self.subscriptions = subscriptions
+        self.categories = categories
+        self.classify = classify
+        self.apply_overrides = apply_overrides
+        self.deliver = deliver
+        self.rejected_log = rejected_log
+        self.low_confidence_log = low_confidence_log
+        self.metrics = metrics
+        self.logger = logger
+        # Confidence threshold: below this value leads are flagged for review
+        self.conf_threshold = conf_threshold
+        self.verbose_debug = verbose_debug
+        self.speech_acts = speech_acts
+        self.preclassifier = preclassifier
+        self.preclassified_log = preclassified_log
+        # id бота: его собственные сообщения пропускаются (задаётся после login)
+        self.self_id: Optional[int] = None
+
+    async def process(self, event, trace) -> None:
+        """Один NewMessage; trace – tracing.Trace (этапы отмечаются через lap)."""
+        self.metrics['received'] += 1
+        # Deduplication with TTL: message ids are per chat, so key on (chat_id, msg_id)
+        if self.deduper.seen(event.chat_id, event.id):
+            self.metrics['deduplicated'] += 1
+            return
+        trace.lap("dedup")
+        # Only groups and channels
+        if not (event.is_group or event.is_channel):
+            return
+        chat_id = event.chat_id
+        # Ignore own messages
+        if event.sender_id == self.self_id:
+            return
+        text = event.raw_text or ""
+        # Remove hashtags to avoid false matches
+        clean_text = re.sub(r'#\w+', '', text)
+        # Lowercase text for matching
+        lower_text = clean_text.lower()
+
+        # Near-duplicate of an ad already rejected elsewhere: drop before region/AI work
+        near_fp = self.near_dups.fingerprint(text)
+        near_hit = self.near_dups.lookup(near_fp, chat_id)
+        trace.lap("near_dup")
+        if near_hit and near_hit.rejected:
+            self.metrics['near_dup_dropped'] += 1
+            return
+
+        dialog = await self.chat_cache.resolve(chat_id, event.get_chat)
+        group_name = getattr(dialog, 'title', 'Без названия')
+        trace.lap("get_chat")
+
+        # Determine region by group title first, then by message text
+        region_hit = self.region_detector.first(group_name.lower()) or self.region_detector.first(lower_text)
+        trace.lap("region")
+        if not region_hit:
+            self.metrics['no_region'] += 1
+            return
+        found_alias = region_hit.alias
+        region = self.location_alias[found_alias]
+        self.metrics['region_detected'] += 1
+
+        # Single pass over the message tokens: keyword (and phrase) hits → categories
+        kw_match = self.keyword_matcher.match(lower_text)
+        trace.lap("keywords")
+        # Heuristic category: first matched category in categories.json order
+        category_heuristic = kw_match.first_category
+        if category_heuristic:
+            self.metrics['category_heuristic_detected'] += 1
+        else:
+            self.metrics['category_not_detected'] += 1
+        if found_alias and category_heuristic:
+            self.metrics['coverage_ok'] += 1
+
+        # User-specific pre-filter via the routing index: subscribers of this region
+        # who want one of the matched categories/subcategories
+        routes = self.routing_index.snapshot
+        if not routes.has_region(region):
+            self.metrics['no_subscribers_for_region'] += 1
+            return
+        targets = routes.lookup(region, kw_match.categories, kw_match.subcategories)
+        trace.lap("routing")
+        if not targets:
+            self.metrics['no_category_match'] += 1
+            return
+        matched_cat, matched_kw = kw_match.wanted_by(self.subscriptions.get(next(iter(targets)), {})) or ("?", "?")
+        self.logger.info(f"Keyword match: '{matched_kw}' → category '{matched_cat}'")
+        # Offer-only ad with contacts: rejected before the AI call. Runs after routing, so
+        # ai_rejected.log (also read by preclassifier training) only gets messages
+        # that would otherwise have reached the AI
+        if self.speech_acts is not None:
+            acts = self.speech_acts(lower_text)
+            trace.lap("speech_acts")
+            if acts.negative:
+                self.metrics['speech_act_negative'] += 1
+            if acts.offer_with_contacts:
+                self.metrics['speech_act_rejected'] += 1
+                verdict = {"relevant": False, "category": None, "region": None,
+                           "explanation": "speech_act:offer_with_contacts", "confidence": 1.0}
+                # Crossposts of the same ad are then dropped at the near-dup stage
+                self.near_dups.remember(near_fp, verdict, rejected=True)
+                ts = now_istanbul().strftime("%m-%d %H:%M")
+                self.rejected_log.write(
+                    f"{ts} | {chat_id} ({group_name}) | {text} | "
+                    f"relevant:False, category:None, region:None, "
+                    f"explanation:{verdict['explanation']}, confidence:1.0"
+                )
+                return
+
+        # Local pre-classifier: confidently irrelevant messages never reach the API
+        if self.preclassifier is not None and not near_hit:
+            p_lead = self.preclassifier.score(text)
+            trace.lap("preclassifier")
+            if p_lead < self.preclassifier.threshold:
+                self.metrics['preclassifier_dropped'] += 1
+                if self.preclassified_log is not None:
+                    ts = now_istanbul().strftime("%m-%d %H:%M")
+                    self.preclassified_log.write(f"{ts} | {chat_id} ({group_name}) | {text} | p_lead:{p_lead:.3f}")
+                return
+            self.metrics['preclassifier_passed'] += 1
+        # AI classification with caching; near-duplicates of accepted leads reuse the cluster verdict
+        if near_hit:
+            self.metrics['near_dup_reused'] += 1
+            cla = near_hit.verdict
+        else:
+            try:
+                # Only use [category_heuristic] if present, else full list
+                cats_to_use = [category_heuristic] if category_heuristic else list(self.categories.keys())
+                cla = await self.classify(
+                    text,
+                    cats_to_use,
+                    self.canonical_locations
+                )
+            except Exception as e:
+                self.logger.error(f"[AI ERROR] {e}")
+                return
+        trace.lap("ai")
+        ai_verdict = dict(cla) if isinstance(cla, dict) and not cla.get("error") else None
+
+        # Override AI classification with heuristics and post-hoc rules
+        if isinstance(cla, dict):
+            cla["region"] = region
+            cla = self.apply_overrides(cla, lower_text, category_heuristic)
+        if ai_verdict is not None and not near_hit:
+            self.near_dups.remember(near_fp, ai_verdict, rejected=not cla.get("relevant", False))
+        trace.lap("overrides")
+
+        # Drop if no response or not relevant, with debug explanation
+        if not cla or not cla.get("relevant", False):
+            self.metrics['ai_dropped'] += 1
+            if self.verbose_debug:
+                self.logger.debug(f"AI dropped message: relevant={cla.get('relevant') if cla else None}")
+                relevant = cla.get("relevant") if isinstance(cla, dict) else None
+                explanation = cla.get("explanation") if isinstance(cla, dict) else None
+                self.logger.debug(f"AI dropped message. relevant={relevant}, explanation={explanation}, full={cla}")
+            # Queue a line for ai_rejected.log with classification details and concise timestamp
+            ts = now_istanbul().strftime("%m-%d %H:%M")
+            self.rejected_log.write(
+                f"{ts} | {chat_id} ({group_name}) | {text} | "
+                f"relevant:{cla.get('relevant')}, "
+                f"category:{cla.get('category')}, "
+                f"region:{cla.get('region')}, "
+                f"explanation:{cla.get('explanation')}, "
+                f"confidence:{cla.get('confidence')}"
+            )
+            return
+
+        # Handle low-confidence yet relevant cases
+        confidence = cla.get("confidence", 0.0)
+        if confidence < self.conf_threshold:
+            self.metrics['low_confidence'] += 1
+            self.logger.info(f"Low confidence ({confidence}) for message, flagging for review")
+            # Queue a line for ai_low_confidence.log for later analysis
+            ts = now_istanbul().strftime("%m-%d %H:%M")
+            self.low_confidence_log.write(
+                f"{ts} | {chat_id} ({group_name}) | {text} | "
+                f"relevant:{cla.get('relevant')}, "
+                f"category:{cla.get('category')}, "
+                f"region:{cla.get('region')}, "
+                f"explanation:{cla.get('explanation')}, "
+                f"confidence:{confidence}"
+            )
+            return
+
+        # Skip messages where the AI could not assign a category
+        detected_cat = cla.get("category") if isinstance(cla, dict) else None
+        if not detected_cat:
+            self.metrics['ai_no_category'] += 1
+            return
+
+        # Log relevant classification
+        self.logger.info(
+            f"{chat_id} ({group_name}) | {text} | "
+            f"relevant:{cla.get('relevant')}, "
+            f"category:{cla.get('category')}, "
+            f"region:{cla.get('region')}, "
+            f"explanation:{cla.get('explanation')}, "
+            f"confidence:{cla.get('confidence')}"
+        )
+        # Optionally validate region/category but keep region from heuristics
+
+        # Sender is only needed for the lead card, so resolve it after all rejections
+        sender_entity = None
+        if event.sender_id:
+            sender_entity = await self.sender_cache.resolve(event.sender_id, event.get_sender)
+        trace.lap("get_sender")
+        if sender_entity:
+            sender_id = sender_entity.id
+            sender_name = getattr(sender_entity, 'first_name', None) or getattr(sender_entity, 'username', 'Неизвестный отправитель')
+            sender_username = getattr(sender_entity, 'username', None)
+        else:
+            # Fallback for channels without a user sender
+            sender_id = event.chat_id
+            sender_name = group_name
+            sender_username = None
+
+        # Build message link for supergroups
+        if str(chat_id).startswith("-100"):
+            short = str(chat_id)[4:]
+            link = f"https://t.me/c/{short}/{event.id}"
+        else:
+            link = ""
+        await self.deliver(
+            chat_id,
+            group_name,
+            getattr(dialog, 'username', None),
+            sender_name,
+            sender_id,
+            sender_username,
+            text,
+            link,
+            region,
+            detected_category=detected_cat,
+            kw_match=kw_match,
+            trace=trace
+        )
@@ -0,0 +1,281 @@
+r"""
+preclassifier.py
+Локальный предклассификатор «лид / не лид» перед вызовом OpenAI.
+
+• признаки – хэшированные символьные n-граммы (3–4) нормализованного
+  текста (нижний регистр, ё→е, цифры → 0), бинарные, L2-нормированные;
+  хэш – crc32, стабилен между процессами;
+• модель – логистическая регрессия (SGD, L2, веса классов), чистый Python;
+• score(text) – вероятность лида; ниже threshold сообщение отбрасывается
+  без AI (Pipeline пишет его в ai_preclassified.log). Порог подбирается при
+  обучении по отложенной выборке так, чтобы потеря лидов не превышала
+  --max-recall-loss; сохраняется именно эта модель (обученная без отложенной
+  выборки), eval оценивает сохранённый файл --out на той же выборке;
+• файл модели: PCL1 + JSON-заголовок + веса array('f').
+
+Данные для обучения (слабая разметка):
+  ai_rejected.log                 → 0 (вердикт AI «не лид»);
+  ai_low_confidence.log           → 1 (AI счёл лидом, хоть и неуверенно);
+  classification_test_report.json → expected.relevant;
+  summary/competitor_leads*.jsonl → 1 только запрос, 0 только предложение
+                                    (маркеры analyze_competitor), прочее – мимо.
+
+    python preclassifier.py train --out preclassifier.bin --max-recall-loss 0.01
+    python preclassifier.py eval
+"""
+
+from __future__ import annotations
+import argparse
+import glob
+import json
+import math
+import os
+import random
+import re
+import struct
+import zlib
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+_MAGIC = b"PCL1"
+_HEADER = struct.Struct("<4sI")        # magic, длина JSON-заголовка
+
+_DIGIT_RE = re.compile(r"\d")
+_SPACE_RE = re.compile(r"\s+")
+MAX_CHARS = 600
+
+# Заголовок записи в ai_rejected.log / ai_low_confidence.log
+_LOG_ENTRY_RE = re.compile(r"^(?:\d{2}-\d{2} \d{2}:\d{2}|\d{4}-\d{2}-\d{2}T\S+) \| -?\d+(?: \(.*?\))? \| ", re.M)
+_LOG_VERDICT_RE = re.compile(r" \| relevant:(True|False|None),.*$", re.S)
+
+
+def normalize(text: str) -> str:
+    text = _DIGIT_RE.sub("0", text.lower().replace("ё", "е"))
+    return " " + _SPACE_RE.sub(" ", text).strip()[:MAX_CHARS] + " "
+
+
+def features(text: str, dim: int, ngrams: Tuple[int, int] = (3, 4)) -> Dict[int, float]:
+    """Индексы хэшированных n-грамм → вес (бинарные признаки, L2-норма = 1)."""
+    norm = normalize(text)
+    mask = dim - 1
+    idx = set()
+    crc = zlib.crc32
+    for n in range(ngrams[0], ngrams[1] + 1):
+        for i in range(len(norm) - n + 1):
+            idx.add(crc(norm[i:i + n].encode("utf-8")) & mask)
+    if not idx:
+        return {}
+    value = 1.0 / math.sqrt(len(idx))
+    return dict.fromkeys(idx, value)
+
+
+def _sigmoid(z: float) -> float:
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+
+class PreClassifier:
+    def __init__(self, weights: array, bias: float, dim: int, ngrams: Tuple[int, int] = (3, 4),
+                 threshold: float = 0.05, meta: Optional[dict] = None):
+        self.weights = weights
+        self.bias = bias
+        self.dim = dim
+        self.ngrams = tuple(ngrams)
+        self.threshold = threshold
+        self.meta = meta or {}
+
+    def score(self, text: str) -> float:
+        """Вероятность того, что сообщение – лид."""
+        w = self.weights
+        z = self.bias + sum(w[i] * v for i, v in features(text, self.dim, self.ngrams).items())
+        return _sigmoid(z)
+
+    # --- файл модели ---------------------------------------------------------------
+    def save(self, path: str) -> None:
+        header = json.dumps({"dim": self.dim, "ngrams": list(self.ngrams), "bias": self.bias,
+                             "threshold": self.threshold, "meta": self.meta}, ensure_ascii=False).encode("utf-8")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(header)))
+            f.write(header)
+            self.weights.tofile(f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["PreClassifier"]:
+        """Модель из файла или None, если файла нет / формат другой."""
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            magic, size = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                return None
+            header = json.loads(f.read(size))
+            weights = array("f")
+            weights.fromfile(f, header["dim"])
+        return cls(weights, header["bias"], header["dim"], tuple(header["ngrams"]),
+                   header["threshold"], header.get("meta"))
+
+
+# --- обучение ---------------------------------------------------------------------
+def train(samples: Sequence[Tuple[str, int]], dim: int = 1 << 18, ngrams: Tuple[int, int] = (3, 4),
+          epochs: int = 8, lr: float = 0.5, l2: float = 1e-6, seed: int = 13) -> PreClassifier:
+    """Логистическая регрессия SGD с весами классов (положительных обычно меньше)."""
+    vectors = [(features(text, dim, ngrams), label) for text, label in samples]
+    pos = sum(label for _, label in vectors) or 1
+    neg = (len(vectors) - pos) or 1
+    class_weight = {1: len(vectors) / (2 * pos), 0: len(vectors) / (2 * neg)}
+    w = [0.0] * dim
+    bias = 0.0
+    rng = random.Random(seed)
+    order = list(range(len(vectors)))
+    step = 0
+    for epoch in range(epochs):
+        rng.shuffle(order)
+        for j in order:
+            x, y = vectors[j]
+            step += 1
+            rate = lr / (1 + 1e-4 * step)
+            z = bias + sum(w[i] * v for i, v in x.items())
+            g = (_sigmoid(z) - y) * class_weight[y]
+            for i, v in x.items():
+                w[i] -= rate * (g * v + l2 * w[i])
+            bias -= rate * g
+    return PreClassifier(array("f", w), bias, dim, ngrams)
+
+
+def evaluate(model: PreClassifier, samples: Sequence[Tuple[str, int]],
+             thresholds: Iterable[float] = (0.01, 0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5)) -> List[dict]:
+    """Для каждого порога: доля сообщений без AI и доля потерянных лидов."""
+    scored = [(model.score(text), label) for text, label in samples]
+    positives = sum(label for _, label in scored) or 1
+    rows = []
+    for t in thresholds:
+        dropped = [label for p, label in scored if p < t]
+        lost = sum(dropped)
+        rows.append({
+            "threshold": t,
+            "ai_call_reduction": len(dropped) / len(scored) if scored else 0.0,
+            "recall_loss": lost / positives,
+            "drop_precision": 1 - lost / len(dropped) if dropped else 1.0,
+        })
+    return rows
+
+
+def choose_threshold(model: PreClassifier, samples: Sequence[Tuple[str, int]], max_recall_loss: float) -> float:
+    """Наибольший порог, при котором на samples теряется не больше max_recall_loss лидов."""
+    scores = sorted(model.score(text) for text, label in samples if label == 1)
+    if not scores:
+        return 0.0
+    allowed = int(max_recall_loss * len(scores))
+    # порог = вероятность (allowed+1)-го по возрастанию лида: ниже него ровно allowed лидов
+    return scores[min(allowed, len(scores) - 1)]
+
+
+# --- данные -----------------------------------------------------------------------
+def parse_audit_log(path: str) -> List[Tuple[str, Optional[bool]]]:
+    """(текст, relevant) из ai_rejected.log / ai_low_confidence.log; многострочные записи."""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        data = f.read()
+    starts = [m.end() for m in _LOG_ENTRY_RE.finditer(data)]
+    heads = [m.start() for m in _LOG_ENTRY_RE.finditer(data)] + [len(data)]
+    entries = []
+    for start, end in zip(starts, heads[1:]):
+        body = data[start:end].strip()
+        m = _LOG_VERDICT_RE.search(body)
+        relevant = None
+        if m:
+            relevant = {"True": True, "False": False}.get(m.group(1))
+            body = body[:m.start()]
+        if body:
+            entries.append((body, relevant))
+    return entries
+
+
+def load_training_data(root: str = ".") -> List[Tuple[str, int]]:
+    from analyze_competitor import OFFER_MARKERS, REQUEST_MARKERS, contains_any, strip_metadata
+    samples: List[Tuple[str, int]] = []
+    for text, relevant in parse_audit_log(os.path.join(root, "ai_rejected.log")):
+        if relevant is not True:
+            samples.append((text, 0))
+    for text, relevant in parse_audit_log(os.path.join(root, "ai_low_confidence.log")):
+        if relevant is not False:
+            samples.append((text, 1))
+    report = os.path.join(root, "classification_test_report.json")
+    if os.path.exists(report):
+        with open(report, encoding="utf-8") as f:
+            for row in json.load(f):
+                samples.append((row["text"], int(bool(row["expected"].get("relevant")))))
+    for path in sorted(glob.glob(os.path.join(root, "summary", "competitor_leads*.jsonl"))):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    text = strip_metadata(json.loads(line).get("text", "")).strip()
+                except json.JSONDecodeError:
+                    continue
+                is_request = contains_any(REQUEST_MARKERS, text)
+                is_offer = contains_any(OFFER_MARKERS, text)
+                if text and is_request != is_offer:
+                    samples.append((text, int(is_request)))
+    # Повторы (кросспостинг, одни и те же тексты в двух корпусах) – один раз
+    seen, unique = set(), []
+    for text, label in samples:
+        key = normalize(text)
+        if key not in seen:
+            seen.add(key)
+            unique.append((text, label))
+    return unique
+
+
+def split(samples: Sequence[Tuple[str, int]], holdout: float = 0.2, seed: int = 7):
+    rows = list(samples)
+    random.Random(seed).shuffle(rows)
+    cut = int(len(rows) * (1 - holdout))
+    return rows[:cut], rows[cut:]
+
+
+def _print_rows(rows: List[dict]) -> None:
+    print("threshold  ai_call_reduction  recall_loss  drop_precision")
+    for r in rows:
+        print(f"{r['threshold']:>9.3f}  {r['ai_call_reduction'] * 100:>16.1f}%  {r['recall_loss'] * 100:>10.1f}%"
+              f"  {r['drop_precision'] * 100:>13.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train / evaluate the local lead pre-classifier")
+    parser.add_argument("command", choices=["train", "eval"])
+    parser.add_argument("--out", default=os.getenv("PRECLASSIFIER_MODEL", "preclassifier.bin"))
+    parser.add_argument("--dim-bits", type=int, default=18)
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--max-recall-loss", type=float, default=0.01, help="Allowed share of leads dropped locally")
+    parser.add_argument("--holdout", type=float, default=0.2)
+    args = parser.parse_args()
+
+    data = load_training_data()
+    train_rows, test_rows = split(data, args.holdout)
+    print(f"Samples: {len(data)} ({sum(l for _, l in data)} leads); train {len(train_rows)}, held-out {len(test_rows)}")
+    if args.command == "train":
+        # Сохраняется та же модель, на которой подобран порог: у модели, переобученной
+        # на всех данных, другое распределение score, и гарантия --max-recall-loss не держится
+        model = train(train_rows, dim=1 << args.dim_bits, epochs=args.epochs)
+        model.threshold = choose_threshold(model, test_rows, args.max_recall_loss)
+        model.meta = {"samples": len(train_rows), "leads": sum(l for _, l in train_rows),
+                      "holdout": args.holdout, "max_recall_loss": args.max_recall_loss}
+    else:
+        # Оценивается развёрнутая модель (--out), а не свежеобученная
+        model = PreClassifier.load(args.out)
+        if model is None:
+            raise SystemExit(f"No model at {args.out}: run `python preclassifier.py train` first")
+        print(f"Loaded {args.out}: threshold {model.threshold:.3f}, meta {model.meta}")
+    print("\nHeld-out evaluation:")
+    _print_rows(evaluate(model, test_rows, thresholds=sorted({0.01, 0.02, 0.05, 0.1, 0.2, 0.3, model.threshold})))
+    at = evaluate(model, test_rows, thresholds=(model.threshold,))[0]
+    print(f"\nAt threshold {model.threshold:.3f}: AI calls -{at['ai_call_reduction'] * 100:.1f}%, "
+          f"recall loss {at['recall_loss'] * 100:.1f}%")
+    if args.command == "train":
+        model.save(args.out)
+        print(f"Saved {args.out}")
@@ -0,0 +1,144 @@
+r"""
+prompts.py
+Промпт классификатора: неизменный префикс + переменная часть в конце, подсчёт
+токенов на запрос.
+
+• system – инструкции и few-shot примеры, байт-в-байт одинаковый для всех
+  запросов (одиночных и батчей ai_batch): провайдер кэширует общий префикс
+  промпта (у OpenAI – от 1024 токенов, дальше блоками по 128), поэтому ничего
+  зависящего от сообщения в system нет;
+• user – то, что меняется: блок допустимых значений (подмножество категорий
+  и регионов под текст) + формат ответа (объект или JSON-массив), затем
+  сам текст. Блок мемоизируется по (режим, категории, регионы) вместе с числом
+  его токенов: LRU на max_blocks записей (prompt_blocks_hit /
+  prompt_blocks_built);
+• count_tokens – tiktoken, если он установлен и кодировка доступна офлайн,
+  иначе оценка ≈ 4 символа на токен. Токены запроса = префикс (считается один
+  раз) + блок (из кэша) + текст + служебные токены сообщений chat-формата –
+  на сообщение считается только текст;
+• version – отпечаток всех шаблонов: входит в версию кэша вердиктов, правка
+  промпта инвалидирует старые записи.
+"""
+
+from __future__ import annotations
+import hashlib
+from collections import OrderedDict
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import tiktoken
+except ImportError:                       # опциональная зависимость
+    tiktoken = None
+
+TOKEN_ENCODING = "o200k_base"             # кодировка gpt-4o / gpt-4.1
+
+
+def _estimate_tokens(s: str) -> int:
+    """Грубая оценка числа токенов (≈ 4 символа на токен)."""
+    return len(s) // 4 + 1
+
+
+def _load_counter() -> Tuple[Callable[[str], int], str]:
+    if tiktoken is not None:
+        try:
+            encode = tiktoken.get_encoding(TOKEN_ENCODING).encode_ordinary
+            return (lambda s: len(encode(s))), TOKEN_ENCODING
+        except Exception:                 # нет файла кодировки и сети
+            pass
+    return _estimate_tokens, "estimate"
+
+
+count_tokens, TOKEN_COUNTER = _load_counter()
+
+# Служебные токены chat-формата: на каждое сообщение и на затравку ответа
+MESSAGE_OVERHEAD = 3
+REPLY_OVERHEAD = 3
+
+SYSTEM_PROMPT = """
+Ты — профессиональный классификатор запросов и лидов для Telegram. Цель: максимально точно определить, является ли входящее сообщение запросом услуги (лидом) или рекламным/продающим. Приоритетное правило: если сообщение содержит контактные данные (телефон, @username, ссылки вида t.me/...) и одновременно написано от лица продавца/организатора (например: предлагаем, забронируйте, узнайте стоимость, наши услуги, VIP, скидка, дешевле, продаем, забронируйте сейчас), то это реклама: relevant=false. Речь заинтересованного пользователя (вопрос, просьба): нужен, хочу, сколько стоит, подскажите и пр. — это лид. Вердикт — JSON-объект с ключами: relevant (boolean), category (из допустимых значений, которые придут вместе с сообщением, или null), region (из допустимых значений или null), explanation (короткая строка до 70 символов), confidence (число от 0.0 до 1.0). Модель должна варьировать confidence в зависимости от неоднозначности (напр., сомнительные сигналов: 0.4-0.7; явные лиды/реклама: около 0.9).
+"""
+
+FEW_SHOT_EXAMPLES = """
+Примеры:
+Сообщение: 'Нужен трансфер из Анталии в Кемер завтра' Ответ: {"relevant": true, "category": "трансфер", "region": "Анталия", "explanation": "Запрос трансфера"}
+Сообщение: 'Сколько стоит экскурсия в Памуккале?' Ответ: {"relevant": true, "category": "экскурсии", "region": "Памуккале", "explanation": "Уточнение цены"}
+Сообщение: 'Не интересует аренда скутеров' Ответ: {"relevant": false, "category": "аренда", "region": null, "explanation": "Отказ от услуги"}
+Сообщение: 'Экскурсия ТУРЕЦКИЙ ДИСНЕЙЛЕНД, дешевле чем в кассе. Узнать стоимость и забронировать билеты. По вопросам: @vip' Ответ: {"relevant": false, "category": null, "region": null, "explanation": "Реклама/продажа"}
+Сообщение: 'Может возьмём экскурсию и трансфер вместе позже' Ответ: {"relevant": true, "category": "экскурсии", "region": null, "explanation": "Неоднозначный интерес"}
+Сообщение: 'Хочу узнать, но ещё не уверен' Ответ: {"relevant": true, "category": null, "region": null, "explanation": "Запрос с неуверенностью"}
+Сообщение: 'Трансфер из аэропорта Анталии, звоните +7 999 1234567, забронируйте сейчас!' Ответ: {"relevant": false, "category": null, "region": null, "explanation": "Реклама/продажа"}
+Сообщение: 'Может возьму экскурсию позже, пока присматриваюсь' Ответ: {"relevant": false, "category": null, "region": null, "explanation": "Неуверенный интерес"}
+"""
+
+_VALUES = 'Допустимые значения: category (одно из: {categories} или null), region (одно из: {locations} или null).\n'
+
+# режим → (формат ответа, вводная перед текстом)
+MODES = {
+    "single": (
+        "Отвечай только одним валидным JSON-объектом с этими ключами. Никаких списков или лишних ключей.\n",
+        "Анализируй это сообщение:\n",
+    ),
+    "batch": (
+        "Тебе придёт пронумерованный список сообщений. Для каждого верни JSON-объект с ключами: id (номер сообщения) "
+        "и перечисленными выше. Ответ — только валидный JSON-массив таких объектов в порядке номеров, без лишних ключей.\n",
+        "Проанализируй каждое сообщение списка:\n",
+    ),
+}
+
+
+class Prompt(NamedTuple):
+    messages: List[dict]
+    tokens: int            # вход запроса целиком (локальный подсчёт)
+    prefix_tokens: int     # из них неизменный префикс (system)
+
+
+class PromptBuilder:
+    def __init__(self, system: str = SYSTEM_PROMPT, examples: str = FEW_SHOT_EXAMPLES,
+                 max_blocks: int = 1024, metrics=None, counter: Optional[Callable[[str], int]] = None):
+        self.system = system.strip() + "\n" + examples.strip() + "\n"
+        self.count = counter or count_tokens
+        self.max_blocks = max_blocks
+        self.metrics = metrics
+        self.prefix_tokens = self.count(self.system) + MESSAGE_OVERHEAD
+        self._blocks: "OrderedDict[tuple, Tuple[str, int]]" = OrderedDict()
+        templates = self.system + _VALUES + "".join(a + b for a, b in MODES.values())
+        self.version = hashlib.blake2b(templates.encode("utf-8"), digest_size=8).hexdigest()
+
+    def block(self, mode: str, categories: Sequence[str], locations: Sequence[str]) -> Tuple[str, int]:
+        """(начало user-сообщения, его токены) – одно на набор списков."""
+        key = (mode, tuple(categories), tuple(locations))
+        hit = self._blocks.get(key)
+        if hit is not None:
+            self._blocks.move_to_end(key)
+            if self.metrics is not None:
+                self.metrics['prompt_blocks_hit'] += 1
+            return hit
+        answer, intro = MODES[mode]
+        text = _VALUES.format(
+            categories=', '.join(f'"{c}"' for c in categories),
+            locations=', '.join(f'"{l}"' for l in locations),
+        ) + answer + intro
+        hit = self._blocks[key] = (text, self.count(text))
+        if len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        if self.metrics is not None:
+            self.metrics['prompt_blocks_built'] += 1
+        return hit
+
+    def _prompt(self, mode: str, body: str, categories, locations) -> Prompt:
+        head, head_tokens = self.block(mode, categories, locations)
+        tokens = self.prefix_tokens + head_tokens + self.count(body) + MESSAGE_OVERHEAD + REPLY_OVERHEAD
+        return Prompt([
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": head + body},
+        ], tokens, self.prefix_tokens)
+
+    def single(self, text: str, categories: Sequence[str], locations: Sequence[str]) -> Prompt:
+        return self._prompt("single", f'"""{text}"""\n', categories, locations)
+
+    def batch(self, texts: Sequence[str], categories: Sequence[str], locations: Sequence[str]) -> Prompt:
+        body = "\n".join(f'{i}. """{t}"""' for i, t in enumerate(texts, 1)) + "\n"
+        return self._prompt("batch", body, categories, locations)
+
+    def cache_size(self) -> int:
+        return len(self._blocks)
@@ -0,0 +1,37 @@
+r"""
+ratelimit.py
+Асинхронный token bucket: не блокирует поток, ожидание – через asyncio.sleep.
+
+rate  – средняя скорость (токенов в секунду);
+burst – сколько запросов можно выпустить подряд после простоя.
+Ожидающие обслуживаются по очереди (asyncio.Lock справедлив, FIFO).
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+
+
+class AsyncTokenBucket:
+    def __init__(self, rate: float, burst: float = 1.0):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """Дождаться и забрать `tokens` токенов."""
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
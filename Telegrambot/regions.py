@@ -0,0 +1,176 @@
+r"""
+regions.py
+Детектор регионов, компилируемый из config.LOCATION_ALIAS.
+
+• Точный проход: префиксное дерево по токенам (ключ токена – стем, для коротких
+  алиасов ≤ 4 букв – точная словоформа, чтобы «сиде» не ловило «сидим»).
+  Длина алиаса в токенах ограничена, поэтому проход линеен по числу токенов.
+• Фолбэк: если точных совпадений нет, токены-кандидаты (та же первая буква,
+  близкая длина) сравниваются с алиасами с ограниченным числом правок
+  (Levenshtein ≤ 1, для длинных ≤ 2) – ловит опечатки «Антолия», «Кэмер».
+  Стемы сравниваются нечётко только от 6 букв: «камер(а)» ≠ «кемер».
+
+detect(text) возвращает все найденные регионы с позициями в тексте.
+"""
+
+from __future__ import annotations
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from rapidfuzz.distance import Levenshtein
+
+from stemmer import WORD_RE, stem as _stem
+
+# Алиасы короче этого порога не стеммим: у коротких слов стем слишком общий
+_EXACT_MAX_LEN = 4
+# Минимальная длина словоформы / стема для нечёткого сравнения
+_FUZZY_MIN_LEN = 5
+_FUZZY_MIN_STEM_LEN = 6
+# Стем – префикс словоформы, поэтому стеммим только токены, начинающиеся
+# со стема какого-нибудь алиаса (кандидаты ищем по первым _PREFIX_LEN буквам)
+_PREFIX_LEN = 3
+
+
+class RegionMatch(NamedTuple):
+    region: str
+    alias: str
+    start: int
+    end: int
+    fuzzy: bool = False
+
+
+def _fold(token: str) -> str:
+    # snowball сам заменяет «ё» на «е»; делаем так же для префиксного фильтра
+    return token.replace("ё", "е")
+
+
+def _token_key(token: str) -> str:
+    if len(token) <= _EXACT_MAX_LEN:
+        return "=" + token
+    return _stem(token)
+
+
+def _max_edits(word: str) -> int:
+    if len(word) < _FUZZY_MIN_LEN:
+        return 0
+    return 1 if len(word) < 9 else 2
+
+
+class RegionDetector:
+    """Многошаблонный поиск алиасов регионов по потоку токенов."""
+
+    def __init__(self, aliases: Dict[str, str], fuzzy: bool = True):
+        # узел дерева: {"next": {key: node}, "hit": (region, alias, priority) | None}
+        self._root: dict = {"next": {}, "hit": None}
+        # Кандидаты для нечёткого сравнения, запись: (хвост алиаса, region, alias, priority)
+        # (первая буква, длина первого токена) → [(первый токен, допуск правок, запись)]
+        self._fuzzy_by_form: Dict[Tuple[str, int], List[tuple]] = {}
+        # первые 3 буквы стема → [(стем первого токена, запись)]
+        self._fuzzy_by_stem: Dict[str, List[tuple]] = {}
+        # первые буквы → стемы алиасов с таким началом
+        self._stem_prefixes: Dict[str, Tuple[str, ...]] = {}
+        self.fuzzy = fuzzy
+        for priority, (alias, region) in enumerate(aliases.items()):
+            tokens = WORD_RE.findall(alias.lower())
+            if not tokens:
+                continue
+            keys = [_token_key(tok) for tok in tokens]
+            for key in keys:
+                if not key.startswith("="):
+                    stems = self._stem_prefixes.get(key[:_PREFIX_LEN], ())
+                    if key not in stems:
+                        self._stem_prefixes[key[:_PREFIX_LEN]] = stems + (key,)
+            node = self._root
+            for key in keys:
+                node = node["next"].setdefault(key, {"next": {}, "hit": None})
+            if node["hit"] is None:
+                node["hit"] = (region, alias, priority)
+            head, head_key = tokens[0], keys[0]
+            entry = (tuple(keys[1:]), region, alias, priority)
+            limit = _max_edits(head)
+            if limit:
+                self._fuzzy_by_form.setdefault((head[0], len(head)), []).append((head, limit, entry))
+            if not head_key.startswith("=") and len(head_key) >= _FUZZY_MIN_STEM_LEN:
+                self._fuzzy_by_stem.setdefault(head_key[:_PREFIX_LEN], []).append((head_key, entry))
+
+    def _tokens(self, text: str) -> List[Tuple[str, int, int]]:
+        return [(m.group(0).lower(), m.start(), m.end()) for m in WORD_RE.finditer(text)]
+
+    def _stem_candidate(self, token: str) -> str:
+        """Стем токена, если он может совпасть со стемом алиаса, иначе ""."""
+        folded = _fold(token)
+        for stem in self._stem_prefixes.get(folded[:_PREFIX_LEN], ()):
+            if folded.startswith(stem):
+                return _stem(token)
+        return ""
+
+    def _exact(self, tokens, keys) -> List[Tuple[int, RegionMatch]]:
+        found = []
+        root_next = self._root["next"]
+        for i in range(len(tokens)):
+            node = root_next.get(keys[i][0]) or root_next.get(keys[i][1])
+            j = i
+            while node is not None:
+                if node["hit"]:
+                    region, alias, priority = node["hit"]
+                    found.append((priority, RegionMatch(region, alias, tokens[i][1], tokens[j][2])))
+                j += 1
+                if j >= len(tokens):
+                    break
+                nxt = node["next"]
+                node = nxt.get(keys[j][0]) or nxt.get(keys[j][1])
+        return found
+
+    def _fuzzy_candidates(self, token: str, stem_ref: list):
+        """Записи алиасов, отличающихся от токена не более чем на допустимое число правок."""
+        by_form = self._fuzzy_by_form
+        size = len(token)
+        for length in range(size - 2, size + 3):
+            for head, limit, entry in by_form.get((token[0], length), ()):
+                if abs(length - size) <= limit and \
+                        Levenshtein.distance(head, token, score_cutoff=limit) <= limit:
+                    yield entry
+        # словоформа с опечаткой: сравниваем стемы (стеммим только таких кандидатов)
+        for head_stem, entry in self._fuzzy_by_stem.get(token[:_PREFIX_LEN], ()):
+            if len(head_stem) - 1 <= len(token) <= len(head_stem) + 4:
+                if not stem_ref[0]:
+                    stem_ref[0] = _stem(token)
+                if Levenshtein.distance(head_stem, stem_ref[0], score_cutoff=1) <= 1:
+                    yield entry
+
+    def _fuzzy(self, tokens, keys) -> List[Tuple[int, RegionMatch]]:
+        found = []
+        seen = set()
+        for i, (token, start, _) in enumerate(tokens):
+            if len(token) < _FUZZY_MIN_LEN:
+                continue
+            stem_ref = [keys[i][1]]
+            for tail, region, alias, priority in self._fuzzy_candidates(token, stem_ref):
+                end = i + len(tail)
+                if end >= len(tokens) or (region, start) in seen:
+                    continue
+                if all(key in keys[i + 1 + k] for k, key in enumerate(tail)):
+                    seen.add((region, start))
+                    found.append((priority, RegionMatch(region, alias, start, tokens[end][2], True)))
+        return found
+
+    def _scan(self, text: str) -> List[Tuple[int, RegionMatch]]:
+        tokens = self._tokens(text)
+        keys = [("=" + tok, self._stem_candidate(tok)) for tok, _, _ in tokens]
+        found = self._exact(tokens, keys)
+        if not found and self.fuzzy:
+            found = self._fuzzy(tokens, keys)
+        return found
+
+    def detect(self, text: str) -> List[RegionMatch]:
+        """Все найденные регионы в порядке появления в тексте."""
+        return [m for _, m in sorted(self._scan(text), key=lambda pm: (pm[1].start, pm[0]))]
+
+    def first(self, text: str) -> Optional[RegionMatch]:
+        """
+        Один регион для сообщения: как и прежняя логика, побеждает алиас,
+        стоящий раньше в LOCATION_ALIAS (конкретный город важнее «Турции»).
+        """
+        found = self._scan(text)
+        if not found:
+            return None
+        return min(found, key=lambda pm: (pm[0], pm[1].start))[1]
@@ -0,0 +1,309 @@
+r"""
+shards.py
+Несколько пользовательских сессий Telethon на разбор чатов: у аккаунта есть
+лимиты на число чатов и поток апдейтов, поэтому чаты делятся между сессиями.
+
+• ShardMap – chat_id → имя сессии, хранится в JSON (tmp + os.replace), чтобы
+  после рестарта чаты оставались за теми же аккаунтами;
+• ShardManager.balance() – каждый чат закрепляется за одной живой сессией,
+  которая в нём состоит: прежний владелец сохраняется, остальные чаты
+  (сначала доступные меньшему числу сессий) достаются наименее загруженной;
+• accept(shard, chat_id) – в общий Pipeline сообщение передаёт только
+  владелец чата; копии от других сессий отбрасываются до Pipeline
+  (shard_skipped). Чат, которого нет в карте (новая группа), закрепляется за
+  первой сессией, приславшей из него сообщение; так же чат забирает сессия,
+  если его владелец не подключён (ещё не стартовал при запуске, упал или
+  убран из PARSER_SESSIONS). Глобальный dedup – общий MessageDeduper в
+  Pipeline: он же страхует окно переназначения;
+• disconnected(shard) – чаты упавшей сессии переходят к живым сессиям из
+  того же чата; если таких нет, чат «осиротел» (shard_orphaned_chats) и
+  вернётся к сессии после её переподключения. connected() заново запускает
+  balance(): осиротевшие чаты возвращаются, а с перегруженных сессий чаты
+  переезжают к вернувшейся, пока разница в нагрузке больше одного чата
+  (shard_chats_rebalanced);
+• supervise(shard, client) – run_until_disconnected + переподключение с
+  экспоненциальной паузой; health() / prometheus_lines() / report() –
+  состояние и поток сообщений по каждой сессии.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class ShardMap:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.owners: Dict[int, str] = {}
+        self.load_by_shard: Counter = Counter()   # число чатов у сессии, без пересчёта по карте
+        self.dirty = False
+
+    def load(self) -> int:
+        """Поднимает карту из файла; возвращает число чатов."""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.owners = {int(chat_id): shard for chat_id, shard in data.get("owners", {}).items()}
+        self.load_by_shard = Counter(self.owners.values())
+        self.dirty = False
+        return len(self.owners)
+
+    def save(self) -> None:
+        if not self.path or not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "owners": {str(c): s for c, s in sorted(self.owners.items())}}, f, indent=1)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def get(self, chat_id: int) -> Optional[str]:
+        return self.owners.get(chat_id)
+
+    def set(self, chat_id: int, shard: Optional[str]) -> None:
+        previous = self.owners.get(chat_id)
+        if previous == shard:
+            return
+        if previous is not None:
+            self.load_by_shard[previous] -= 1
+        if shard is None:
+            del self.owners[chat_id]
+        else:
+            self.owners[chat_id] = shard
+            self.load_by_shard[shard] += 1
+        self.dirty = True
+
+    def chats_of(self, shard: str) -> List[int]:
+        return [c for c, s in self.owners.items() if s == shard]
+
+
+class _Shard:
+    __slots__ = ("name", "connected", "members", "messages", "skipped", "last_message",
+                 "disconnects", "reported")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.connected = False
+        self.members: Set[int] = set()       # чаты, в которых состоит аккаунт
+        self.messages = 0                     # передано в Pipeline
+        self.skipped = 0                      # копии из чужих чатов
+        self.last_message: Optional[float] = None
+        self.disconnects = 0
+        self.reported = 0                     # messages на момент прошлого report()
+
+
+class ShardManager:
+    def __init__(self, names: Iterable[str], shard_map: ShardMap, metrics=None, logger=None):
+        self.shards: Dict[str, _Shard] = {name: _Shard(name) for name in names}
+        if not self.shards:
+            raise ValueError("shards: at least one session is required")
+        self.map = shard_map
+        self.metrics = metrics
+        self.logger = logger
+        self.orphaned: Set[int] = set()
+        self._reported_at = time.monotonic()
+
+    def _count(self, key: str, n: int = 1) -> None:
+        if self.metrics is not None:
+            self.metrics[key] += n
+
+    def _live(self, shard: str) -> bool:
+        s = self.shards.get(shard)
+        return s is not None and s.connected
+
+    def _load(self, shard: str) -> int:
+        return self.map.load_by_shard[shard]
+
+    def _pick(self, chat_id: int, exclude: Optional[str] = None) -> Optional[str]:
+        """Наименее загруженная живая сессия, которая состоит в чате."""
+        candidates = [s for s in self.shards.values()
+                      if s.connected and s.name != exclude and chat_id in s.members]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda s: (self._load(s.name), s.name)).name
+
+    # --- состав и распределение ------------------------------------------------
+    def set_members(self, shard: str, chat_ids: Iterable[int]) -> None:
+        self.shards[shard].members = set(chat_ids)
+
+    def balance(self) -> Dict[str, int]:
+        """Закрепляет каждый известный чат за одной живой сессией; возвращает число чатов по сессиям."""
+        known = set(self.map.owners)
+        for s in self.shards.values():
+            known |= s.members
+        # сначала оставляем живым владельцам их чаты, потом раздаём остальные
+        pending = []
+        for chat_id in sorted(known):
+            owner = self.shards.get(self.map.get(chat_id))
+            if owner is not None and owner.connected and chat_id in owner.members:
+                continue
+            pending.append(chat_id)
+        self.orphaned.clear()
+        # чаты, доступные меньшему числу сессий, раздаются первыми – остальными выравниваем нагрузку
+        live = [s.members for s in self.shards.values() if s.connected]
+        pending.sort(key=lambda c: (sum(c in m for m in live), c))
+        for chat_id in pending:
+            shard = self._pick(chat_id)
+            if shard is None:
+                self.orphaned.add(chat_id)
+            else:
+                self.map.set(chat_id, shard)
+        self._even_out()
+        self.map.save()
+        return {name: self._load(name) for name in self.shards}
+
+    def _even_out(self) -> int:
+        """Чаты переезжают к сессии, у которой хотя бы на 2 чата меньше (и которая в них состоит)."""
+        moved = 0
+        changed = True
+        while changed:
+            changed = False
+            for chat_id, owner in sorted(self.map.owners.items()):
+                source = self.shards.get(owner)
+                if source is None or not source.connected:
+                    continue
+                target = self._pick(chat_id, exclude=owner)
+                if target is not None and self._load(target) + 1 < self._load(owner):
+                    self.map.set(chat_id, target)
+                    moved += 1
+                    changed = True
+        self._count('shard_chats_rebalanced', moved)
+        return moved
+
+    def connected(self, shard: str) -> None:
+        """Сессия (пере)подключилась: забирает осиротевшие чаты, нагрузка выравнивается заново."""
+        s = self.shards[shard]
+        s.connected = True
+        before = self._load(shard)
+        orphaned = len(self.orphaned)
+        self.balance()
+        if self.logger:
+            self.logger.info(f"Shard {shard} connected: {self._load(shard) - before:+d} chats "
+                             f"({orphaned - len(self.orphaned)} orphaned reclaimed)")
+
+    def disconnected(self, shard: str) -> int:
+        """Переназначает чаты сессии; возвращает число переданных другим сессиям."""
+        s = self.shards[shard]
+        if not s.connected:
+            return 0
+        s.connected = False
+        s.disconnects += 1
+        moved = 0
+        for chat_id in self.map.chats_of(shard):
+            target = self._pick(chat_id, exclude=shard)
+            if target is None:
+                self.orphaned.add(chat_id)
+            else:
+                self.map.set(chat_id, target)
+                moved += 1
+        self.map.save()
+        self._count('shard_disconnects')
+        self._count('shard_chats_reassigned', moved)
+        if self.logger:
+            self.logger.warning(f"Shard {shard} disconnected: {moved} chats reassigned, "
+                                f"{len(self.orphaned)} orphaned")
+        return moved
+
+    # --- горячий путь ----------------------------------------------------------
+    def accept(self, shard: str, chat_id: int) -> bool:
+        """True, если сообщение из chat_id нужно передать в Pipeline от этой сессии."""
+        s = self.shards[shard]
+        owner = self.map.owners.get(chat_id)
+        if owner is None or (owner != shard and not self._live(owner)):
+            # новый чат закрепляется за первой сессией, которая его увидела; чат, чей владелец
+            # ещё не запущен (старт), упал или убран из PARSER_SESSIONS, берёт эта сессия
+            self.map.set(chat_id, shard)
+            self.orphaned.discard(chat_id)
+            s.members.add(chat_id)
+            owner = shard
+        if owner != shard:
+            s.skipped += 1
+            self._count('shard_skipped')
+            return False
+        s.messages += 1
+        s.last_message = time.time()
+        return True
+
+    # --- состояние -------------------------------------------------------------
+    def health(self) -> Dict[str, dict]:
+        now = time.time()
+        return {
+            s.name: {
+                "connected": s.connected,
+                "chats": self._load(s.name),
+                "members": len(s.members),
+                "messages": s.messages,
+                "skipped": s.skipped,
+                "disconnects": s.disconnects,
+                "idle_seconds": round(now - s.last_message, 1) if s.last_message else None,
+            }
+            for s in self.shards.values()
+        }
+
+    def healthy(self) -> bool:
+        return any(s.connected for s in self.shards.values())
+
+    def report(self) -> str:
+        """Строка для лога: сообщений в минуту по сессиям с прошлого вызова."""
+        now = time.monotonic()
+        minutes = max(now - self._reported_at, 1e-9) / 60
+        self._reported_at = now
+        parts = []
+        for s in self.shards.values():
+            rate = (s.messages - s.reported) / minutes
+            s.reported = s.messages
+            state = "up" if s.connected else "DOWN"
+            parts.append(f"{s.name}[{state}] {self._load(s.name)} chats {rate:.1f} msg/min")
+        if self.orphaned:
+            parts.append(f"orphaned {len(self.orphaned)}")
+        return "; ".join(parts)
+
+    def prometheus_lines(self, prefix: str = "leadbot_shard") -> List[str]:
+        lines = []
+        for suffix, kind, value in (
+                ("up", "gauge", lambda s: int(s.connected)),
+                ("chats", "gauge", lambda s: self._load(s.name)),
+                ("messages_total", "counter", lambda s: s.messages),
+                ("skipped_total", "counter", lambda s: s.skipped),
+                ("disconnects_total", "counter", lambda s: s.disconnects)):
+            name = f"{prefix}_{suffix}"
+            lines.append(f"# TYPE {name} {kind}")
+            lines += [f'{name}{{shard="{s.name}"}} {value(s)}' for s in self.shards.values()]
+        lines += [f"# TYPE {prefix}_orphaned_chats gauge", f"{prefix}_orphaned_chats {len(self.orphaned)}"]
+        return lines
+
+    # --- сессии ----------------------------------------------------------------
+    async def supervise(self, shard: str, client, max_backoff: float = 300.0) -> None:
+        """Держит сессию подключённой; на время обрыва её чаты обслуживают другие."""
+        backoff = 5.0
+        while True:
+            try:
+                await client.run_until_disconnected()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Shard {shard} stopped: {e}")
+            self.disconnected(shard)
+            while True:
+                await asyncio.sleep(backoff)
+                try:
+                    await client.connect()
+                    if await client.is_user_authorized():
+                        break
+                except Exception as e:
+                    if self.logger:
+                        self.logger.warning(f"Shard {shard} reconnect failed: {e}")
+                backoff = min(backoff * 2, max_backoff)
+            backoff = 5.0
+            self.connected(shard)
+
+    async def run_reporter(self, interval: float = 300.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.map.save()               # новые чаты, закреплённые в accept()
+            if self.logger:
+                self.logger.info(f"Shards: {self.report()}")
@@ -0,0 +1,148 @@
+r"""
+speech_acts.py
+Речевые акты сообщения за один проход по словам.
+
+Объединяет маркеры, которые раньше жили в трёх местах:
+• seller – самореклама (бывш. ai_utils._seller_patterns: «предлагаем», «скидк»…);
+• offer – предложение (analyze_competitor.OFFER_MARKERS: «сдам», «от собственника»…);
+• request – запрос (analyze_competitor.REQUEST_MARKERS: «ищу», «подскажите»…);
+• negative – нежелательный контекст (бывш. filters.NEGATIVE_STEMS, кроме «не спам»);
+• contact – контакты (@user, t.me/…, телефон, whatsapp).
+
+Маркеры – слова и фразы с границами слов (как \bслово\b в прежних regex),
+поэтому вместо десятков re.search хватает одного прохода по \w+ токенам:
+• слово → виды маркеров (dict), фраза проверяется только если встретилось её
+  первое слово;
+• negative-стемы ищутся подстрокой в токене; «не спам» (ровно один пробельный
+  символ после «не») не считается;
+• контакты: @user / t.me/… / whatsapp – сначала по подстроке, телефон – regex.
+Большой regex-альтернативой это сделать нельзя: re пробует все альтернативы в
+каждой позиции и выходит в разы медленнее (см. bench_speech_acts.py).
+
+detect(text) → SpeechActs; offer_with_contacts – предложение с контактами без
+единого маркера запроса: такие сообщения Pipeline отбрасывает до AI.
+"""
+
+from __future__ import annotations
+import re
+from typing import Dict, List, NamedTuple, Tuple
+
+SELLER = "seller"
+OFFER = "offer"
+REQUEST = "request"
+NEGATIVE = "negative"
+CONTACT = "contact"
+
+SELLER_WORDS: List[str] = [
+    "предлагаем", "забронируйте", "узнайте стоимость", "наши услуги", "vip", "превратите", "скидк",
+    "дешевле", "продаем", "забронируйте сейчас", "зарезервируйте", "спецпредложение", "купить сейчас",
+    "скидка на страховку",
+]
+OFFER_WORDS: List[str] = [
+    "сдам", "продаёт", "продаётся", "продается", "предлагаем", "предлагается", "узнать стоимость",
+    "без комиссии", "депозит", "от собственника", "аренда недвижимость",
+]
+REQUEST_WORDS: List[str] = [
+    "хочу", "ищу", "нужн", "нужна", "нужно", "нужны", "сколько стоит", "подскажите", "сниму",
+    "помогите", "как добраться", "где взять",
+]
+NEGATIVE_STEMS: List[str] = [
+    "осторожн", "мошенник", "спам", "реклама", "мошенников", "предоплат",
+]
+MARKERS: Dict[str, List[str]] = {SELLER: SELLER_WORDS, OFFER: OFFER_WORDS, REQUEST: REQUEST_WORDS}
+
+WORD_RE = re.compile(r"\w+")
+_HANDLE_RE = re.compile(r"@\w")
+_TME_RE = re.compile(r"t\.me/[\w\-]")
+_PHONE_RE = re.compile(r"\+?[\d\-\s\(\)]{7,}")
+
+
+def marker_patterns(words: List[str]) -> List[str]:
+    """Те же маркеры как regex \bслово\b (для analyze_competitor)."""
+    return [rf"\b{re.escape(w)}\b" for w in words]
+
+
+class SpeechActs(NamedTuple):
+    seller: bool
+    # любое предложение, включая саморекламу (seller ⊂ offer)
+    offer: bool
+    request: bool
+    negative: bool
+    contact: bool
+    # (вид, сработавший маркер) в порядке появления в тексте; контакты не перечисляются
+    markers: Tuple[Tuple[str, str], ...] = ()
+
+    @property
+    def offer_with_contacts(self) -> bool:
+        """Только предложение/самореклама с контактами – лидом быть не может."""
+        return self.offer and self.contact and not self.request
+
+    @property
+    def label(self) -> str:
+        if self.offer_with_contacts:
+            return "offer_with_contacts"
+        if self.request and not self.offer:
+            return "request"
+        if self.offer:
+            return "offer"
+        return "neutral"
+
+
+class SpeechActDetector:
+    def __init__(self, markers: Dict[str, List[str]] = MARKERS, negative_stems: List[str] = NEGATIVE_STEMS):
+        # слово → виды; первое слово фразы → [(regex фразы, вид, фраза)]
+        self._words: Dict[str, Tuple[str, ...]] = {}
+        self._phrases: Dict[str, List[Tuple[re.Pattern, str, str]]] = {}
+        for kind, words in markers.items():
+            for marker in words:
+                marker = marker.lower()
+                parts = marker.split()
+                if len(parts) == 1:
+                    self._words[marker] = self._words.get(marker, ()) + (kind,)
+                else:
+                    self._phrases.setdefault(parts[0], []).append(
+                        (re.compile(rf"\b{re.escape(marker)}\b"), kind, marker))
+        self._negative = tuple(s.lower() for s in negative_stems)
+
+    def detect(self, text: str) -> SpeechActs:
+        text = text.lower()
+        found = set()
+        markers = []
+        words, phrases = self._words, self._phrases
+        check_negative = any(stem in text for stem in self._negative)
+        prev_end = prev_word = None
+        for m in WORD_RE.finditer(text):
+            word = m.group()
+            kinds = words.get(word)
+            if kinds:
+                for kind in kinds:
+                    found.add(kind)
+                    markers.append((kind, word))
+            heads = phrases.get(word)
+            if heads:
+                for regex, kind, phrase in heads:
+                    if regex.match(text, m.start()):
+                        found.add(kind)
+                        markers.append((kind, phrase))
+            if check_negative:
+                for stem in self._negative:
+                    pos = word.find(stem)
+                    if pos < 0:
+                        continue
+                    # (?<!\bне\s): отрицание гасит только стем в начале слова сразу после «не »
+                    negated = (pos == 0 and prev_word == "не" and m.start() - prev_end == 1
+                               and text[prev_end].isspace() and word.find(stem, 1) < 0)
+                    if not negated:
+                        found.add(NEGATIVE)
+                        markers.append((NEGATIVE, stem))
+                        break
+            prev_word, prev_end = word, m.end()
+        contact = (("@" in text and _HANDLE_RE.search(text) is not None)
+                   or ("t.me/" in text and _TME_RE.search(text) is not None)
+                   or "whatsapp" in text or _PHONE_RE.search(text) is not None)
+        offer = OFFER in found or SELLER in found
+        return SpeechActs(SELLER in found, offer, REQUEST in found, NEGATIVE in found, contact, tuple(markers))
+
+
+detector = SpeechActDetector()
+detect = detector.detect
@@ -0,0 +1,115 @@
+r"""
+stemmer.py
+Общий стеммер (snowball, russian) с мемоизацией: keywords, regions и ai_utils
+стеммят через него, а не каждый своим экземпляром snowballstemmer.
+
+• snowball на чистом Python – десятки микросекунд на слово, а словарь чатов
+  маленький и повторяющийся: стем слова считается один раз, дальше – dict.get;
+• stem_many(tokens) – пакетно для потока токенов сообщения: один проход
+  dict.get по списку, snowball – только для промахов;
+• seed(words) / seed_phrases(phrases) – стемы keywords из categories.json и
+  алиасов LOCATION_ALIAS кладутся заранее и не вытесняются;
+• размер ограничен max_size: при переполнении кэш сбрасывается до
+  предзаполненных стемов (resets) – дешевле, чем LRU на каждом попадании;
+• экземпляр snowball хранит состояние разбора, поэтому промахи считаются под
+  lock (KeywordMatcher строится и в потоке – category_reload); попадания
+  lock не берут;
+• stats() – calls / misses / hit_rate / size, prometheus_lines() для /metrics.
+"""
+
+from __future__ import annotations
+import os
+import re
+import threading
+from typing import Dict, Iterable, List
+
+import snowballstemmer
+
+# Regex to extract Russian/English words for stemming
+WORD_RE = re.compile(r"[а-яa-zё]+", re.IGNORECASE | re.UNICODE)
+
+
+class Stemmer:
+    def __init__(self, max_size: int = 50000, language: str = "russian"):
+        self.max_size = max_size
+        self._snowball = snowballstemmer.stemmer(language)
+        self._lock = threading.Lock()
+        self._seeded: Dict[str, str] = {}
+        self._cache: Dict[str, str] = {}
+        self.calls = 0
+        self.misses = 0
+        self.resets = 0
+
+    def _compute(self, word: str, miss: bool = True) -> str:
+        with self._lock:
+            stem = self._snowball.stemWord(word.lower())
+            self.misses += miss
+            if len(self._cache) >= self.max_size:
+                self._cache = dict(self._seeded)
+                self.resets += 1
+            self._cache[word] = stem
+        return stem
+
+    def stem(self, word: str) -> str:
+        """Return lowercase snowball stem for Russian word."""
+        self.calls += 1
+        stem = self._cache.get(word)
+        if stem is None:
+            stem = self._compute(word)
+        return stem
+
+    def stem_many(self, words: List[str]) -> List[str]:
+        """Стемы списка токенов в том же порядке."""
+        self.calls += len(words)
+        get = self._cache.get
+        stems = [get(w) for w in words]
+        if None in stems:
+            for i, stem in enumerate(stems):
+                if stem is None:
+                    # повтор слова в том же списке уже посчитан выше
+                    stem = self._cache.get(words[i])
+                    stems[i] = stem if stem is not None else self._compute(words[i])
+        return stems
+
+    def seed(self, words: Iterable[str]) -> int:
+        """Предзаполнение (стемы не вытесняются при сбросе); возвращает число новых слов."""
+        added = 0
+        for word in words:
+            if word not in self._seeded:
+                self._seeded[word] = self._cache.get(word) or self._compute(word, miss=False)
+                added += 1
+        return added
+
+    def seed_phrases(self, phrases: Iterable[str]) -> int:
+        """seed() для всех слов фраз (keywords, алиасы регионов)."""
+        return self.seed(tok for phrase in phrases for tok in WORD_RE.findall(str(phrase).lower()))
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def hit_rate(self) -> float:
+        return 1.0 - self.misses / self.calls if self.calls else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._cache),
+            "seeded": len(self._seeded),
+            "calls": self.calls,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 4),
+            "resets": self.resets,
+        }
+
+    def prometheus_lines(self, prefix: str = "leadbot_stem_cache") -> List[str]:
+        return [
+            f"# TYPE {prefix}_lookups_total counter", f"{prefix}_lookups_total {self.calls}",
+            f"# TYPE {prefix}_misses_total counter", f"{prefix}_misses_total {self.misses}",
+            f"# TYPE {prefix}_resets_total counter", f"{prefix}_resets_total {self.resets}",
+            f"# TYPE {prefix}_size gauge", f"{prefix}_size {len(self._cache)}",
+            f"# TYPE {prefix}_seeded gauge", f"{prefix}_seeded {len(self._seeded)}",
+        ]
+
+
+stemmer = Stemmer(int(os.getenv("STEM_CACHE_SIZE", "50000")))
+stem = stemmer.stem
+stem_many = stemmer.stem_many
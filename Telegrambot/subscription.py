@@ -1,19 +1,19 @@
 import os
-import json
-from config import LOCATION_ALIAS
+import atexit
+from locations import LOCATION_ALIAS
+from subscription_store import SubscriptionStore
 
 
-if not os.path.exists("subscriptions.json"):
-    subscriptions = {}
-else:
-    with open("subscriptions.json", "r", encoding="utf-8") as f:
-        subscriptions = json.load(f)
+# SQLite (WAL), построчная запись в фоне; при первом запуске – миграция из subscriptions.json
+subscriptions = SubscriptionStore(
+    path=os.getenv("SUBSCRIPTIONS_DB", "subscriptions.sqlite3"),
+    json_path="subscriptions.json",
+)
+atexit.register(subscriptions.close)
 
-def save_subscriptions():
-    tmp_file = "subscriptions.json.tmp"
-    with open(tmp_file, "w", encoding="utf-8") as wf:
-        json.dump(subscriptions, wf, ensure_ascii=False, indent=2)
-    os.replace(tmp_file, "subscriptions.json")
+def save_subscriptions(uid=None):
+    """Сохранить подписку uid (O(1)); без uid – все подписки."""
+    subscriptions.save(uid)
 
 for uid, prefs in subscriptions.items():
     normalized_locs = []
@@ -0,0 +1,179 @@
+r"""
+subscription_store.py
+Хранилище подписок: SQLite (WAL), одна строка на пользователя.
+
+SubscriptionStore ведёт себя как dict uid → prefs (чтение – из памяти), а запись
+идёт построчно и в фоне:
+• store[uid] = prefs / del store[uid] / store.save(uid) снимают JSON одной
+  записи прямо на event loop (O(размер prefs)) и кладут в очередь;
+• отдельный поток раз в flush_interval забирает очередь и пишет все изменённые
+  строки одной транзакцией; несколько правок одного uid подряд сливаются в одну
+  запись;
+• при первом запуске (пустая база) строки импортируются из subscriptions.json;
+• export_json() – полный снимок в JSON для бэкапов.
+
+    python subscription_store.py --export backup.json
+"""
+
+from __future__ import annotations
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, Optional
+
+_log = logging.getLogger(__name__)
+_DELETED = None
+
+
+class SubscriptionStore(MutableMapping):
+    def __init__(self, path: str = "subscriptions.sqlite3", json_path: Optional[str] = "subscriptions.json",
+                 flush_interval: float = 0.2):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS subscriptions ("
+            " uid TEXT PRIMARY KEY, prefs TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._data: Dict[str, dict] = {
+            uid: json.loads(prefs) for uid, prefs in self._db.execute("SELECT uid, prefs FROM subscriptions")
+        }
+        if json_path:
+            self._migrate_from_json(json_path)
+
+        self._pending: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()          # очередь
+        self._write_lock = threading.Lock()    # соединение SQLite (поток записи и flush)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self.writes = 0
+        self._writer = threading.Thread(target=self._write_loop, name="subscriptions-writer", daemon=True)
+        self._writer.start()
+
+    # --- миграция / экспорт -------------------------------------------------
+    def _migrate_from_json(self, json_path: str) -> None:
+        done = self._db.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone()
+        if done or self._data or not os.path.exists(json_path):
+            return
+        with open(json_path, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        now = time.time()
+        self._db.execute("BEGIN")
+        self._db.executemany(
+            "INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?)",
+            [(str(uid), json.dumps(prefs, ensure_ascii=False), now) for uid, prefs in legacy.items()],
+        )
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('migrated_from_json', ?)", (json_path,))
+        self._db.execute("COMMIT")
+        self._data = {str(uid): prefs for uid, prefs in legacy.items()}
+        _log.info(f"Migrated {len(legacy)} subscriptions from {json_path} to {self.path}")
+
+    def export_json(self, path: str) -> None:
+        """Полный снимок в JSON (формат прежнего subscriptions.json)."""
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as wf:
+            json.dump(self._data, wf, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    # --- dict-интерфейс -----------------------------------------------------
+    def __getitem__(self, uid: str) -> dict:
+        return self._data[uid]
+
+    def __setitem__(self, uid: str, prefs: dict) -> None:
+        self._data[uid] = prefs
+        self.save(uid)
+
+    def __delitem__(self, uid: str) -> None:
+        del self._data[uid]
+        self._enqueue(uid, _DELETED)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, uid) -> bool:
+        return uid in self._data
+
+    # --- запись ---------------------------------------------------------------
+    def save(self, uid: Optional[str] = None) -> None:
+        """Поставить в очередь запись строки uid (без uid – все строки, как прежний save)."""
+        uids = [uid] if uid is not None else list(self._data)
+        for u in uids:
+            prefs = self._data.get(u)
+            self._enqueue(u, _DELETED if prefs is None else json.dumps(prefs, ensure_ascii=False))
+
+    def _enqueue(self, uid: str, payload: Optional[str]) -> None:
+        with self._lock:
+            self._pending[uid] = payload
+        self._wakeup.set()
+
+    def _write_loop(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait()
+            # Небольшое окно: серия переключателей одного пользователя → одна запись
+            self._stop.wait(self.flush_interval)
+            self._write_pending()
+
+    def _write_pending(self) -> None:
+        with self._write_lock:
+            self._write_batch()
+
+    def _write_batch(self) -> None:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._wakeup.clear()
+        if not batch:
+            return
+        now = time.time()
+        try:
+            self._db.execute("BEGIN")
+            for uid, payload in batch.items():
+                if payload is _DELETED:
+                    self._db.execute("DELETE FROM subscriptions WHERE uid = ?", (uid,))
+                else:
+                    self._db.execute("INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?)", (uid, payload, now))
+            self._db.execute("COMMIT")
+            self.writes += len(batch)
+        except Exception as e:
+            self._db.execute("ROLLBACK")
+            _log.error(f"Failed to persist {len(batch)} subscriptions: {e}")
+            # Вернуть в очередь то, что не перезаписано более свежими правками
+            with self._lock:
+                for uid, payload in batch.items():
+                    self._pending.setdefault(uid, payload)
+
+    def flush(self) -> None:
+        """Синхронно записать всё, что стоит в очереди (при остановке, в тестах)."""
+        self._write_pending()
+
+    def close(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._writer.join(timeout=5)
+        self.flush()
+        self._db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Subscriptions store maintenance")
+    parser.add_argument("--db", default=os.getenv("SUBSCRIPTIONS_DB", "subscriptions.sqlite3"))
+    parser.add_argument("--export", metavar="PATH", help="Write all subscriptions to a JSON file")
+    args = parser.parse_args()
+    store = SubscriptionStore(args.db)
+    if args.export:
+        store.export_json(args.export)
+        print(f"Exported {len(store)} subscriptions to {args.export}")
+    store.close()
@@ -0,0 +1,70 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import ai_utils
+from ai_batch import ClassificationBatcher
+from metrics import metrics
+
+
+class FakeClient:
+    """Минимальный AsyncOpenAI: отвечает заранее заданными строками."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        content = self.replies.pop(0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def verdict(**extra):
+    base = {"relevant": True, "category": "трансфер", "subcategory": None,
+            "location": "Анталия", "confidence": 0.9}
+    base.update(extra)
+    return base
+
+
+async def _classify_all(batcher, texts):
+    return await asyncio.gather(*(batcher.classify(t, ["трансфер"], ["Анталия"]) for t in texts))
+
+
+def test_batch_fans_out_results():
+    ai_utils._classify_cache.clear()
+    texts = ["нужен трансфер из аэропорта анталии", "сниму квартиру в кемере на месяц", "продаю велосипед"]
+    # ответ не по порядку: у каждого id свой вердикт
+    reply = json.dumps([
+        dict(verdict(relevant=False, category=None, confidence=0.3), id=3),
+        dict(verdict(category="недвижимость", location="Кемер", confidence=0.85), id=2),
+        dict(verdict(confidence=0.95), id=1),
+    ], ensure_ascii=False)
+    client = FakeClient([reply])
+
+    async def run():
+        batcher = ClassificationBatcher(3, 1000, client)
+        return await asyncio.gather(*(batcher.classify(t, ["трансфер", "недвижимость"], ["Анталия", "Кемер"])
+                                      for t in texts))
+
+    results = asyncio.run(run())
+    assert len(client.calls) == 1
+    assert "3. " in client.calls[0]["messages"][1]["content"]
+    # confidence после calibrate_confidence: 0.95 → 0.92, 0.85 → 0.85
+    assert [(r["relevant"], r["category"], r["confidence"]) for r in results] == [
+        (True, "трансфер", 0.92), (True, "недвижимость", 0.85), (False, None, 0.3)]
+    assert results[1]["location"] == "Кемер"
+    assert metrics["ai_batch_size_max"] >= 3
+
+
+def test_unparsable_batch_falls_back_to_single_calls():
+    ai_utils._classify_cache.clear()
+    texts = ["нужен трансфер в сиде", "нужен трансфер в белек"]
+    single = json.dumps(verdict(), ensure_ascii=False)
+    client = FakeClient(["не JSON", single, single])
+    before = metrics["ai_batch_fallbacks"]
+    results = asyncio.run(_classify_all(ClassificationBatcher(5, 10, client), texts))
+    assert len(client.calls) == 3
+    assert metrics["ai_batch_fallbacks"] == before + 1
+    assert all(r["category"] == "трансфер" for r in results)
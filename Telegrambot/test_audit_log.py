@@ -0,0 +1,63 @@
+import asyncio
+from collections import Counter
+
+from audit_log import AuditLog
+
+
+def test_write_never_blocks_and_drops_when_full(tmp_path):
+    metrics = Counter()
+    log = AuditLog(str(tmp_path / "rej.log"), max_queue=3, metrics=metrics)
+    assert all(log.write(f"line {i}") for i in range(3))
+    assert log.write("overflow") is False
+    assert log.queue_depth() == 3
+    assert metrics["audit_rej_dropped"] == 1
+    assert metrics["audit_rej_queue_max"] == 3
+
+
+def test_run_writes_in_batches(tmp_path):
+    path = tmp_path / "rej.log"
+    metrics = Counter()
+
+    async def scenario():
+        log = AuditLog(str(path), batch_size=10, flush_interval=0.01, metrics=metrics)
+        task = asyncio.create_task(log.run())
+        for i in range(25):
+            log.write(f"line {i}")
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert path.read_text(encoding="utf-8").splitlines() == [f"line {i}" for i in range(25)]
+    assert metrics["audit_rej_written"] == 25
+    assert metrics["audit_rej_batches"] == 3
+
+
+def test_size_rotation_keeps_backups(tmp_path):
+    path = tmp_path / "low.log"
+    log = AuditLog(str(path), max_bytes=50, backup_count=2)
+    for round_ in range(4):
+        for i in range(3):
+            log.write(f"{round_}-{i} " + "x" * 10)
+        log.flush_sync()
+    assert path.read_text().startswith("3-0")
+    assert (tmp_path / "low.log.1").read_text().startswith("2-0")
+    assert (tmp_path / "low.log.2").read_text().startswith("1-0")
+    assert not (tmp_path / "low.log.3").exists()
+    assert log.metrics["audit_low_rotations"] == 3
+
+
+def test_flush_sync_writes_carried_lines(tmp_path):
+    path = tmp_path / "rej.log"
+
+    async def scenario():
+        log = AuditLog(str(path), flush_interval=10)
+        task = asyncio.create_task(log.run())
+        log.write("a")
+        log.write("b")
+        await asyncio.sleep(0.01)
+        task.cancel()
+        return log
+
+    log = asyncio.run(scenario())
+    log.flush_sync()
+    assert path.read_text().splitlines() == ["a", "b"]
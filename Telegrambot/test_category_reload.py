@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+from collections import Counter
+
+from category_reload import CategoryReloader
+from classify_cache import ClassificationCache, category_versions
+from keywords import KeywordMatcher
+from routing import RoutingIndex, select_recipients
+
+CATEGORIES = {
+    "трансфер": {"keywords": ["трансфер"]},
+    "аренда": {"keywords": ["аренда авто"]},
+}
+
+
+def _setup(tmp_path, subs):
+    path = tmp_path / "categories.json"
+    path.write_text(json.dumps(CATEGORIES, ensure_ascii=False), encoding="utf-8")
+    categories = json.loads(path.read_text(encoding="utf-8"))
+    matcher = KeywordMatcher(categories)
+    index = RoutingIndex(subs, matcher=matcher)
+    cache = ClassificationCache(":memory:", version="v1")
+    cache.set_category_versions(category_versions(categories))
+    metrics = Counter()
+    reloader = CategoryReloader(str(path), categories, index, subs, classify_cache=cache,
+                                metrics=metrics, logger=logging.getLogger("test_category_reload"))
+    return path, categories, index, cache, metrics, reloader
+
+
+def test_reload_swaps_matcher_routing_and_cache_versions(tmp_path):
+    subs = {"1": {"locations": ["Кемер"], "categories": ["аренда"], "subcats": {}}}
+    path, categories, index, cache, metrics, reloader = _setup(tmp_path, subs)
+    cache.put("t", {"relevant": True, "category": "трансфер"})
+    cache.put("r", {"relevant": True, "category": "аренда"})
+    swapped = []
+    reloader.on_swap(swapped.append)
+
+    assert asyncio.run(reloader.reload()) is None          # файл не менялся
+    new = dict(CATEGORIES, аренда={"keywords": ["аренда авто", "прокат"]}, экскурсии={"keywords": ["экскурсия"]})
+    path.write_text(json.dumps(new, ensure_ascii=False), encoding="utf-8")
+    assert reloader.changed()
+    summary = asyncio.run(reloader.reload())
+
+    assert summary["changed"] == ["аренда"] and summary["added"] == ["экскурсии"] and summary["removed"] == []
+    assert "экскурсии" in categories                       # тот же dict обновлён на месте
+    assert swapped == [index.matcher]
+    kw = index.matcher.match("нужен прокат в кемере")
+    assert [uid for uid, _ in select_recipients(index.snapshot, "Кемер", kw)] == ["1"]
+    assert cache.get("t") is not None and cache.get("r") is None
+    assert metrics["categories_reloaded"] == 1
+
+
+def test_broken_file_keeps_current_state(tmp_path):
+    subs = {}
+    path, categories, index, cache, metrics, reloader = _setup(tmp_path, subs)
+    matcher = index.matcher
+    path.write_text("{broken", encoding="utf-8")
+    summary = asyncio.run(reloader.reload())
+    assert "error" in summary
+    assert index.matcher is matcher and set(categories) == set(CATEGORIES)
+    assert metrics["categories_reload_failed"] == 1
+    assert asyncio.run(reloader.reload()) is None          # тот же битый файл не перечитывается
+
+
+def test_filter_change_during_rebuild_is_not_lost():
+    subs = {"1": {"locations": ["Кемер"], "categories": ["трансфер"], "subcats": {}}}
+    matcher = KeywordMatcher(CATEGORIES)
+    index = RoutingIndex(subs, matcher=matcher)
+    frozen = index.freeze(subs)
+    # пока идёт build, пользователь меняет регион
+    subs["1"]["locations"] = ["Сиде"]
+    index.update_user("1", subs["1"])
+    built = RoutingIndex.build(frozen, matcher)
+    index.install(built, matcher, subs)
+    assert index.snapshot.lookup("Сиде", ["трансфер"], []) == {"1"}
+    assert index.snapshot.lookup("Кемер", ["трансфер"], []) == set()
+
+
+def test_failed_rebuild_keeps_index_and_stops_tracking(tmp_path, monkeypatch):
+    subs = {"1": {"locations": ["Кемер"], "categories": ["трансфер"], "subcats": {}}}
+    path, categories, index, cache, metrics, reloader = _setup(tmp_path, subs)
+    matcher, snapshot = index.matcher, index.snapshot
+
+    def broken_build(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(index, "build", broken_build)
+    path.write_text(json.dumps(dict(CATEGORIES, экскурсии={"keywords": ["экскурсия"]}), ensure_ascii=False),
+                    encoding="utf-8")
+    summary = asyncio.run(reloader.reload())
+    assert summary == {"error": "boom"} and metrics["categories_reload_failed"] == 1
+    assert index.matcher is matcher and index.snapshot is snapshot
+    assert index._dirty is None
+    index.update_user("1", {"locations": ["Сиде"], "categories": ["трансфер"], "subcats": {}})
+    assert index._dirty is None and index.snapshot.lookup("Сиде", ["трансфер"], []) == {"1"}
@@ -0,0 +1,99 @@
+import threading
+import time
+
+from classify_cache import ClassificationCache, category_versions, fingerprint
+
+CATEGORIES = {
+    "трансфер": {"keywords": ["трансфер"]},
+    "аренда": {"keywords": ["аренда авто"]},
+}
+
+
+def make_cache(**kw):
+    cache = ClassificationCache(":memory:", version="v1", **kw)
+    cache.set_category_versions(category_versions(CATEGORIES))
+    return cache
+
+
+def test_fingerprint_ignores_contacts_emoji_and_spacing():
+    a = "Нужен трансфер 🚕 из Анталии!!  Пишите @ivan_taxi или +90 555 123 45 67"
+    b = "нужен   трансфер из анталии\nпишите t.me/someone или whatsapp"
+    assert fingerprint(a) == fingerprint(b)
+    assert fingerprint(a) != fingerprint("нужна аренда из анталии")
+
+
+def test_hot_and_disk_tiers():
+    cache = make_cache(hot_size=1)
+    cache.put("a", {"relevant": True, "category": "трансфер"})
+    cache.put("b", {"relevant": False, "category": None})
+    cache.flush()
+    assert cache.get("b")["relevant"] is False
+    assert cache.get("a")["category"] == "трансфер"   # вытеснен из LRU, читается с диска
+    assert cache.metrics["classify_cache_hot_hit"] == 1
+    assert cache.metrics["classify_cache_disk_hit"] == 1
+    assert cache.get("missing") is None
+    assert cache.metrics["classify_cache_hit_rate_pct"] == round(2 * 100 / 3, 1)
+
+
+def test_category_change_invalidates_only_that_category():
+    cache = make_cache()
+    cache.put("t", {"relevant": True, "category": "трансфер"})
+    cache.put("r", {"relevant": True, "category": "аренда"})
+    changed = dict(CATEGORIES, аренда={"keywords": ["аренда авто", "прокат"]})
+    cache.set_category_versions(category_versions(changed))
+    assert cache.get("t") is not None
+    assert cache.get("r") is None
+    assert cache.prune() == 1
+    assert len(cache) == 1
+
+
+def test_version_and_ttl():
+    cache = make_cache(ttl=60)
+    cache.put("k", {"relevant": True, "category": "трансфер"})
+    cache.flush()
+    cache.version = "v2"
+    cache._hot.clear()
+    assert cache.get("k") is None
+    cache.version = "v1"
+    cache._hot.clear()
+    cache._conn().execute("UPDATE verdicts SET created = ?", (time.time() - 120,))
+    assert cache.get("k") is None
+
+
+def test_put_writes_behind_and_counts_rows():
+    cache = make_cache(hot_size=1, flush_interval=0.01)
+    cache.put("a", {"relevant": True, "category": "трансфер"})
+    cache.put("b", {"relevant": True, "category": "аренда"})
+    # «a» вытеснена из LRU, но ещё не на диске – читается из очереди
+    assert cache.get("a")["category"] == "трансфер"
+    cache.put("a", {"relevant": False, "category": None})
+    cache.close()
+    assert len(cache) == 2
+    assert cache._conn().execute("SELECT COUNT(*) FROM verdicts").fetchone()[0] == 2
+    assert cache.get("a")["relevant"] is False
+
+
+def test_writer_thread_persists_without_flush():
+    cache = make_cache(flush_interval=0.01)
+    cache.put("k", {"relevant": True, "category": "трансфер"})
+    deadline = time.time() + 2
+    while len(cache) == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(cache) == 1
+    cache.close()
+
+
+def test_disk_read_does_not_wait_for_the_writer(tmp_path):
+    cache = ClassificationCache(str(tmp_path / "cache.sqlite3"), version="v1")
+    cache.set_category_versions(category_versions(CATEGORIES))
+    cache.put("k", {"relevant": True, "category": "трансфер"})
+    cache.flush()
+    cache._hot.clear()
+    assert cache.get("missing") is None   # соединение для чтения открыто
+    got = []
+    with cache._db_lock:                  # поток записи посреди транзакции
+        reader = threading.Thread(target=lambda: got.append(cache.get("k")))
+        reader.start()
+        reader.join(timeout=2)
+    assert got and got[0]["category"] == "трансфер"
+    cache.close()
@@ -0,0 +1,40 @@
+from dedup import MessageDeduper
+
+
+def test_message_ids_are_scoped_per_chat():
+    d = MessageDeduper()
+    assert not d.seen(-1001, 42)
+    assert not d.seen(-1002, 42)     # тот же id в другом чате – новое сообщение
+    assert d.seen(-1001, 42)
+
+
+def test_chats_that_collided_under_the_packed_key_stay_apart():
+    # эти две супергруппы давали один и тот же 64-битный ключ прежнего pack_key
+    a, b = -1001234567890, -1005773537827
+    d = MessageDeduper(ttl=100, bucket_seconds=10)
+    assert not d.seen(a, 7, now=1000)
+    assert not d.seen(b, 7, now=1001)          # текущая корзина
+    assert not d.seen(b, 8, now=1015)
+    assert not d.seen(a, 8, now=1016)
+    assert d.seen(a, 7, now=1030) and d.seen(b, 8, now=1030)   # закрытые корзины
+    assert not d.seen(b, 9, now=1030)
+
+
+def test_entries_expire_by_bucket():
+    d = MessageDeduper(ttl=100, bucket_seconds=10)
+    assert not d.seen(1, 1, now=1000)
+    assert d.seen(1, 1, now=1050)     # в закрытой корзине
+    assert not d.seen(1, 1, now=1200)  # корзина старше ttl выброшена
+    assert len(d) == 1
+
+
+def test_checkpoint_roundtrip(tmp_path):
+    path = str(tmp_path / "dedup.bin")
+    d = MessageDeduper(ttl=3600, bucket_seconds=60, path=path)
+    for msg_id in range(100):
+        d.seen(-100123, msg_id, now=10_000 + msg_id)
+    d.checkpoint()
+    restored = MessageDeduper(ttl=3600, bucket_seconds=60, path=path)
+    assert restored.load(now=10_200) == 100
+    assert restored.seen(-100123, 5, now=10_200)
+    assert not restored.seen(-100123, 500, now=10_200)
@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+from delivery_engine import DeliveryEngine, Fanout
+
+
+class FloodWait(Exception):
+    """Похож на telethon FloodWaitError: имя содержит FLOOD, есть .seconds."""
+
+    def __init__(self, seconds):
+        super().__init__(f"wait {seconds}s")
+        self.seconds = seconds
+
+
+class FakeBot:
+    def __init__(self, delay=0.01, flood_once_for=None, fail_for=(), floods=1):
+        self.delay = delay
+        self.flood_once_for = flood_once_for
+        self.floods = floods
+        self.fail_for = set(fail_for)
+        self.sent = []
+        self.active = self.peak = 0
+
+    async def send_message(self, uid, text, **kwargs):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if uid == self.flood_once_for:
+                self.floods -= 1
+                if self.floods <= 0:
+                    self.flood_once_for = None
+                raise FloodWait(0.05)
+            if uid in self.fail_for:
+                raise RuntimeError("blocked by user")
+            self.sent.append((uid, text))
+        finally:
+            self.active -= 1
+
+
+def test_fanout_is_parallel_bounded_and_survives_flood_wait():
+    async def run():
+        bot = FakeBot(flood_once_for=3, fail_for={7})
+        engine = DeliveryEngine(bot, max_concurrency=4, rate=1000, burst=1000, per_chat_interval=0)
+        finished = []
+
+        async def on_done(f):
+            finished.append(f)
+
+        fanout = Fanout("lead", on_done=on_done)
+        started = time.monotonic()
+        for uid in range(20):
+            engine.submit(uid, f"lead for {uid}", fanout=fanout)
+        await engine.join()
+        return bot, engine, fanout, finished, time.monotonic() - started
+
+    bot, engine, fanout, finished, elapsed = asyncio.run(run())
+    assert bot.peak == 4
+    assert elapsed < 20 * 0.01           # не последовательно
+    assert 3 in {uid for uid, _ in bot.sent}
+    assert fanout.failed == [7] and fanout.sent == 19
+    assert finished == [fanout]
+    assert engine.metrics["delivery_flood_waits"] == 1
+    assert engine.metrics["fanouts"] == 1
+
+
+def test_per_recipient_order_and_spacing():
+    async def run():
+        bot = FakeBot(delay=0)
+        engine = DeliveryEngine(bot, rate=1000, burst=1000, per_chat_interval=0.02)
+        for i in range(3):
+            engine.submit(1, f"m{i}")
+        started = time.monotonic()
+        await engine.join()
+        return bot, time.monotonic() - started
+
+    bot, elapsed = asyncio.run(run())
+    assert [text for _, text in bot.sent] == ["m0", "m1", "m2"]
+    assert elapsed >= 0.04
+
+
+def test_repeated_flood_waits_do_not_fail_the_message():
+    async def run():
+        bot = FakeBot(delay=0, flood_once_for=1, floods=7)
+        engine = DeliveryEngine(bot, rate=1000, burst=1000, per_chat_interval=0)
+        fanout = Fanout("lead")
+        engine.submit(1, "lead", fanout=fanout)
+        await engine.join()
+        return bot, engine, fanout
+
+    bot, engine, fanout = asyncio.run(run())
+    assert bot.sent == [(1, "lead")] and fanout.failed == []
+    assert engine.metrics["delivery_flood_waits"] == 7
+
+
+def test_waiting_for_rate_budget_does_not_hold_a_slot():
+    class Bucket:
+        def __init__(self, engine):
+            self.engine = engine
+            self.locked = []
+
+        async def acquire(self):
+            self.locked.append(self.engine._semaphore.locked())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        bot = FakeBot(delay=0)
+        engine = DeliveryEngine(bot, max_concurrency=1, per_chat_interval=0)
+        engine._bucket = bucket = Bucket(engine)
+        for uid in range(3):
+            engine.submit(uid, "lead")
+        await engine.join()
+        return bot, bucket
+
+    bot, bucket = asyncio.run(run())
+    assert len(bot.sent) == 3 and bucket.locked == [False] * 3
@@ -0,0 +1,115 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+import entity_cache
+from entity_cache import EntityCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(entity_cache.time, "monotonic", c)
+    return c
+
+
+def test_ttl_expiry(clock):
+    cache = EntityCache("chat", ttl=10)
+    cache.put(1, "a")
+    clock.now += 9
+    assert cache.get(1) == (True, "a")
+    clock.now += 2
+    assert cache.get(1) == (False, None) and len(cache) == 0
+
+
+def test_size_eviction_is_lru(clock):
+    cache = EntityCache("chat", maxsize=2)
+    cache.put(1, "a")
+    cache.put(2, "b")
+    cache.get(1)                      # 1 теперь свежее 2
+    cache.put(3, "c")
+    assert cache.get(2) == (False, None)
+    assert cache.get(1)[0] and cache.get(3)[0]
+
+
+def test_hit_miss_counters_and_none_is_cached(clock):
+    metrics = Counter()
+    cache = EntityCache("sender", metrics=metrics)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return None
+
+    async def run():
+        assert await cache.resolve(5, fetch) is None
+        assert await cache.resolve(5, fetch) is None
+
+    asyncio.run(run())
+    assert len(calls) == 1
+    assert metrics["sender_cache_miss"] == 1 and metrics["sender_cache_hit"] == 1
+
+
+def test_concurrent_resolves_share_one_fetch():
+    cache = EntityCache("chat")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "title"
+
+    async def run():
+        return await asyncio.gather(*(cache.resolve(7, fetch) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["title"] * 5
+    assert len(calls) == 1
+
+
+def test_cancelled_first_caller_does_not_hang_waiters():
+    cache = EntityCache("chat")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05 if len(calls) == 1 else 0)
+        return "title"
+
+    async def run():
+        first = asyncio.create_task(cache.resolve(7, fetch))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.resolve(7, fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()
+        results = await asyncio.wait_for(asyncio.gather(*waiters), timeout=1)
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return results
+
+    assert asyncio.run(run()) == ["title"] * 3
+    assert len(calls) == 2            # один повторный запрос на всех ожидающих
+    assert not cache._inflight
+
+
+def test_fetch_error_reaches_waiters_and_is_not_cached():
+    cache = EntityCache("chat")
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("flood")
+
+    async def run():
+        return await asyncio.gather(*(cache.resolve(1, fetch) for _ in range(2)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(cache) == 0 and not cache._inflight
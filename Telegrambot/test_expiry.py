@@ -0,0 +1,89 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from expiry import ExpiryScheduler, entitlement_deadline, PAID, TRIAL
+from routing import RoutingIndex
+
+
+def _iso(delta_seconds):
+    return (datetime.now(timezone.utc) + timedelta(seconds=delta_seconds)).isoformat()
+
+
+def _prefs(**extra):
+    prefs = {"locations": ["Анталия"], "categories": ["Транспорт"], "subcats": {}}
+    prefs.update(extra)
+    return prefs
+
+
+def test_deadline_rules():
+    assert entitlement_deadline({}) is None
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    kind, ts = entitlement_deadline({"trial_start": start.isoformat()})
+    assert kind == TRIAL and ts == (start + timedelta(days=2)).timestamp()
+    # naive trial_start is treated as UTC
+    assert entitlement_deadline({"trial_start": "2025-01-01T00:00:00"})[1] == ts
+    # paid subscription wins over trial
+    end = start + timedelta(days=30)
+    assert entitlement_deadline({"trial_start": start.isoformat(), "subscription_end": end.isoformat()}) == (PAID, end.timestamp())
+
+
+def test_entitlement_and_backlog():
+    subs = {
+        "1": _prefs(trial_start=_iso(-3600)),
+        "2": _prefs(trial_start=_iso(-3 * 86400)),
+        "3": _prefs(subscription_end=_iso(-60), paid_expired_notified=True),
+        "4": _prefs(),
+    }
+    sched = ExpiryScheduler(subs)
+    assert sched.is_entitled("1")
+    assert not sched.is_entitled("2") and not sched.is_entitled("3") and not sched.is_entitled("4")
+    assert sched.pending_expired(subs) == [("2", TRIAL)]
+
+
+def test_pop_expired_skips_stale_entries():
+    subs = {"1": _prefs(trial_start=_iso(-2 * 86400 + 10))}
+    sched = ExpiryScheduler(subs)
+    now = time.time()
+    # extended by payment before the trial deadline
+    sched.update_user("1", _prefs(subscription_end=_iso(3600)))
+    assert sched.pop_expired(now + 60) == []
+    assert sched.is_entitled("1")
+    assert sched.pop_expired(now + 7200) == [("1", PAID)]
+    assert not sched.is_entitled("1")
+    assert sched.next_deadline() is None
+
+
+def test_routing_contains_only_entitled_users():
+    subs = {"1": _prefs(trial_start=_iso(-3600)), "2": _prefs()}
+    sched = ExpiryScheduler(subs)
+    index = RoutingIndex(subs, entitled=sched.is_entitled)
+    assert index.snapshot.lookup("Анталия", ["Транспорт"], []) == {"1"}
+    # trial started from the settings menu
+    subs["2"]["trial_start"] = _iso(0)
+    sched.update_user("2", subs["2"])
+    index.update_user("2", subs["2"])
+    assert index.snapshot.lookup("Анталия", ["Транспорт"], []) == {"1", "2"}
+    # expiry removes the user even though the filters did not change
+    sched.pop_expired(time.time() + 3 * 86400)
+    index.update_user("1", subs["1"])
+    assert index.snapshot.lookup("Анталия", ["Транспорт"], []) == {"2"}
+
+
+def test_run_fires_in_batches():
+    subs = {str(i): _prefs(subscription_end=_iso(0.05)) for i in range(5)}
+    sched = ExpiryScheduler(subs, batch_size=2, batch_interval=0.01)
+    fired = []
+
+    async def on_expired(uid, kind):
+        fired.append((uid, kind))
+
+    async def scenario():
+        task = asyncio.create_task(sched.run(on_expired, backlog=[("x", TRIAL)]))
+        await asyncio.sleep(0.3)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert fired[0] == ("x", TRIAL)
+    assert sorted(uid for uid, _ in fired[1:]) == ["0", "1", "2", "3", "4"]
+    assert sched.entitled_count() == 0
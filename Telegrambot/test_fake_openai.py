@@ -0,0 +1,77 @@
+import json
+
+import pytest
+from openai import OpenAI, RateLimitError, InternalServerError
+
+from fake_openai import FakeOpenAIServer, FaultPlan, Responder, parse_latency
+from ai_utils import _build_prompt
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def _start(**faults):
+        server = FakeOpenAIServer(faults=FaultPlan(**faults) if faults else None)
+        server.start()
+        servers.append(server)
+        return server, OpenAI(api_key="fake", base_url=server.base_url, max_retries=0, timeout=2)
+
+    yield _start
+    for server in servers:
+        server.stop()
+
+
+def _ask(client, text, categories=("трансфер", "экскурсии"), locations=("Анталия", "Кемер")):
+    _, messages, _ = _build_prompt(text, list(categories), list(locations))
+    resp = client.chat.completions.create(model="gpt-4.1-nano", messages=messages, temperature=0)
+    return json.loads(resp.choices[0].message.content)
+
+
+def test_heuristic_verdicts_follow_prompt_lists(serve):
+    _, client = serve()
+    lead = _ask(client, "Нужен трансфер из Анталии завтра")
+    assert lead["relevant"] is True and lead["category"] == "трансфер" and lead["region"] == "Анталия"
+    ad = _ask(client, "Трансфер Анталия—Кемер, звоните +90 555 123 45 67, скидка!")
+    assert ad["relevant"] is False
+
+
+def test_rules_and_recordings():
+    responder = Responder(
+        rules=[{"match": "яхт", "verdict": {"category": "аренда", "confidence": 0.7}}],
+        recordings={"записанный текст": {"relevant": False, "category": None}},
+    )
+    assert responder.verdict("Аренда яхты", ["аренда"], [])["confidence"] == 0.7
+    assert responder.verdict("  записанный текст ", [], []) == {"relevant": False, "category": None}
+
+
+def test_batch_prompt_gets_array():
+    responder = Responder()
+    messages = [
+        {"role": "system", "content": 'category (одно из: "трансфер" или null), region (одно из: "Кемер" или null). '
+                                      "Ответ — только валидный JSON-массив таких объектов"},
+        {"role": "user", "content": '1. """нужен трансфер"""\n2. """ищу жильё в Кемере"""'},
+    ]
+    data = json.loads(responder.content(messages))
+    assert [d["id"] for d in data] == [1, 2]
+    assert data[0]["category"] == "трансфер" and data[1]["region"] == "Кемер"
+
+
+def test_injected_failures(serve):
+    server, client = serve(bursts=[(429, 60, 120)])
+    with pytest.raises(RateLimitError):
+        _ask(client, "Нужен трансфер")
+    server, client = serve(error_rate=1.0)
+    with pytest.raises(InternalServerError):
+        _ask(client, "Нужен трансфер")
+    assert server.stats["requests"] == 1
+
+
+def test_rpm_limit_and_latency_specs():
+    plan = FaultPlan(rpm=2)
+    assert [plan.decide()[0] for _ in range(3)] == [200, 200, 429]
+    import random
+    rng = random.Random(0)
+    assert parse_latency("fixed:250")(rng) == 0.25
+    assert 0.1 <= parse_latency("uniform:100:200")(rng) <= 0.2
+    assert parse_latency("lognormal:300:0.5")(rng) > 0
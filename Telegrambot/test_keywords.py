@@ -0,0 +1,34 @@
+import json
+import pytest
+from keywords import KeywordMatcher
+
+with open("categories.json", encoding="utf-8") as f:
+    CATEGORIES = json.load(f)
+
+matcher = KeywordMatcher(CATEGORIES)
+
+
+@pytest.mark.parametrize("msg,expect_cat", [
+    ("Нужен трансфер из аэропорта завтра", "трансфер"),
+    ("Где найти сантехника?", "услуги_мастеров"),
+    ("Сниму квартиру на год", "недвижимость"),
+    ("Погода сегодня отличная", None),
+])
+def test_first_category(msg, expect_cat):
+    assert matcher.match(msg.lower()).first_category == expect_cat
+
+
+def test_phrase_keyword():
+    """Многословный keyword срабатывает по последовательности токенов, а не по одному стему."""
+    cats = {"аренда яхт": {"keywords": ["аренда яхт"]}}
+    m = KeywordMatcher(cats)
+    assert m.match("интересует аренда яхты на день").categories == {"аренда яхт": "аренда яхт"}
+    assert not m.match("аренда на день, яхта не нужна").categories
+
+
+def test_subcategory_wanted_by():
+    res = matcher.match("хочу снять квартиру посуточно")
+    assert ("недвижимость", "аренда") in res.subcategories
+    prefs = {"categories": [], "subcats": {"недвижимость": ["аренда"]}}
+    assert res.wanted_by(prefs)[0] == "недвижимость/аренда"
+    assert res.wanted_by({"categories": ["клининг"], "subcats": {}}) is None
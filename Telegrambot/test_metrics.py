@@ -0,0 +1,37 @@
+from collections import Counter
+
+from metrics import Registry, Histogram
+
+
+def test_histogram_buckets_are_cumulative():
+    hist = Histogram("ai_latency_seconds", buckets=(0.1, 1), help="latency")
+    for v in (0.05, 0.1, 0.5, 3):
+        hist.observe(v)
+    text = hist.render()
+    assert 'leadbot_ai_latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'leadbot_ai_latency_seconds_bucket{le="1"} 3' in text
+    assert 'leadbot_ai_latency_seconds_bucket{le="+Inf"} 4' in text
+    assert "leadbot_ai_latency_seconds_count 4" in text
+    assert "leadbot_ai_latency_seconds_sum 3.65" in text
+
+
+def test_render_counters_gauges_and_histograms():
+    counters = Counter({"received": 10, "ai_batch_size_max": 4, "near_dup_suppressed_by_chat": {"x": 1}})
+    reg = Registry(counters)
+    reg.gauge("subscribers", lambda: 7, help="Users")
+    reg.gauge("broken", lambda: 1 / 0)
+    reg.histogram("handler_seconds").observe(0.01)
+    assert reg.histogram("handler_seconds") is reg.histograms["handler_seconds"]
+    text = reg.render()
+    assert "# TYPE leadbot_received_total counter\nleadbot_received_total 10" in text
+    assert "# TYPE leadbot_ai_batch_size_max gauge\nleadbot_ai_batch_size_max 4" in text
+    assert "leadbot_subscribers 7" in text
+    assert "broken" not in text and "suppressed_by_chat" not in text
+    assert "leadbot_handler_seconds_count 1" in text
+    assert text.endswith("\n")
+
+
+def test_total_suffix_is_not_doubled():
+    text = Registry(Counter({"fanout_ms_total": 120, "received": 1})).render()
+    assert "# TYPE leadbot_fanout_ms_total counter\nleadbot_fanout_ms_total 120" in text
+    assert "_total_total" not in text
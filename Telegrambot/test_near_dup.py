@@ -0,0 +1,99 @@
+import sqlite3
+import time
+
+from near_dup import NearDupStore
+
+AD = ("Экскурсия ТУРЕЦКИЙ ДИСНЕЙЛЕНД 🎢 дешевле чем в кассе! Трансфер из отеля включён, "
+      "выезд каждый день из Анталии, Кемера, Белека и Сиде. Узнать стоимость и "
+      "забронировать билеты на любую дату. Дети до 6 лет бесплатно. По вопросам: @vip_tours")
+# Тот же текст в другом чате: другой эмодзи, регистр, контакты и подпись
+AD_COPY = ("🔥 Экскурсия турецкий диснейленд дешевле чем в кассе!!! Трансфер из отеля включён, "
+           "выезд каждый день из Анталии, Кемера, Белека и Сиде. Узнать стоимость и "
+           "забронировать билеты на любую дату. Дети до 6 лет бесплатно. Пишите +90 555 111 22 33")
+LEAD = "Подскажите, кто может организовать трансфер из аэропорта Анталии в Кемер завтра вечером"
+
+
+def test_near_duplicate_reuses_cluster_verdict():
+    store = NearDupStore(None)
+    store.remember(store.fingerprint(AD), {"relevant": False}, rejected=True)
+    hit = store.lookup(store.fingerprint(AD_COPY), chat_id=-1001)
+    assert hit is not None and hit.rejected
+    assert store.lookup(store.fingerprint(LEAD), chat_id=-1002) is None
+    assert store.suppressed_by_chat == {-1001: 1}
+    # повтор принятого лида – не подавление
+    store.remember(store.fingerprint(LEAD), {"relevant": True}, rejected=False)
+    assert store.lookup(store.fingerprint(LEAD), chat_id=-1003) is not None
+    assert store.suppressed_by_chat == {-1001: 1}
+
+
+def test_short_texts_are_not_fingerprinted():
+    assert NearDupStore(None).fingerprint("нужен трансфер") is None
+
+
+def test_evicted_clusters_spill_to_disk(tmp_path):
+    store = NearDupStore(str(tmp_path / "nd.sqlite3"), max_clusters=1)
+    store.remember(store.fingerprint(AD), {"relevant": False}, rejected=True)
+    store.remember(store.fingerprint(LEAD), {"relevant": True, "category": "трансфер"}, rejected=False)
+    assert len(store) == 1
+    hit = store.lookup(store.fingerprint(AD_COPY))
+    assert hit is not None and hit.rejected
+    assert store.metrics["near_dup_disk_hit"] == 1
+
+
+def test_window_expiry():
+    store = NearDupStore(None, window=-1)
+    store.remember(store.fingerprint(AD), {"relevant": False}, rejected=True)
+    assert store.lookup(store.fingerprint(AD)) is None
+    assert len(store) == 0
+
+
+def test_expired_closest_cluster_does_not_hide_live_one():
+    store = NearDupStore(None)
+    fp = store.fingerprint(AD_COPY)
+    store.remember(fp, {"relevant": False}, rejected=True)
+    store._clusters[fp.value].expires = 0            # точная копия (расстояние 0) протухла
+    live = fp._replace(value=fp.value ^ 1)           # живой кластер на расстоянии 1
+    store.remember(live, {"relevant": False, "live": True}, rejected=True)
+    hit = store.lookup(fp)
+    assert hit is not None and hit.verdict.get("live") and hit.distance == 1
+    assert fp.value not in store._clusters
+
+
+def test_memory_miss_skips_sqlite_when_nothing_spilled(tmp_path, monkeypatch):
+    store = NearDupStore(str(tmp_path / "nd.sqlite3"))
+    store.remember(store.fingerprint(AD), {"relevant": False}, rejected=True)
+
+    def no_disk(*args):
+        raise AssertionError("unexpected SQLite lookup")
+
+    monkeypatch.setattr(store, "_lookup_disk", no_disk)
+    assert store.lookup(store.fingerprint(LEAD)) is None
+
+    # после рестарта полосы сброшенных кластеров поднимаются из SQLite
+    store.flush()
+    monkeypatch.undo()
+    restored = NearDupStore(str(tmp_path / "nd.sqlite3"))
+    hit = restored.lookup(restored.fingerprint(AD_COPY))
+    assert hit is not None and restored.metrics["near_dup_disk_hit"] == 1
+
+
+def test_spills_are_written_behind_the_caller(tmp_path):
+    path = str(tmp_path / "nd.sqlite3")
+    store = NearDupStore(path, max_clusters=1, flush_interval=0.05)
+    store.remember(store.fingerprint(AD), {"relevant": False}, rejected=True)
+    store.remember(store.fingerprint(LEAD), {"relevant": True}, rejected=False)
+
+    def rows():
+        return sqlite3.connect(path).execute("SELECT COUNT(*) FROM clusters").fetchone()[0]
+
+    assert rows() == 0                                # remember() не пишет в SQLite сам
+    deadline = time.time() + 2
+    while rows() == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert rows() == 1
+    # AD снова в памяти, вытесненный LEAD – в очереди; на диске после записи только он
+    assert store.lookup(store.fingerprint(AD_COPY)).rejected
+    store._write_pending()
+    lead = store.fingerprint(LEAD).value
+    signed = lead - (1 << 64) if lead >= 1 << 63 else lead
+    assert [v for (v,) in sqlite3.connect(path).execute("SELECT value FROM clusters")] == [signed]
@@ -0,0 +1,93 @@
+import json
+import os
+from collections import Counter
+
+import pytest
+
+from ai_utils import apply_overrides
+from overrides import CompiledRules, OverrideRules
+
+SPEC = {
+    "version": 2,
+    "rules": [
+        {"id": "transfer", "when": {"any": ["трансфер", "в аэропорт"]}, "set": {"category": "трансфер"}},
+        {"id": "insurance_ad",
+         "when": {"all": ["страховка"], "any": ["купить", "оформить"], "none": ["подскажите"]},
+         "set": {"relevant": False, "explanation": "Реклама страховки"}},
+        {"id": "off", "enabled": False, "when": {"any": ["x"]}, "set": {"relevant": False}},
+    ],
+}
+
+
+def test_rules_apply_in_order_and_count_hits():
+    rules = OverrideRules(spec=SPEC)
+    cla = rules.apply({"relevant": True, "category": "страховка"}, "оформить страховка онлайн, трансфер в подарок")
+    assert cla == {"relevant": False, "category": "трансфер", "explanation": "Реклама страховки"}
+    cla = rules.apply({"relevant": True}, "подскажите, где купить страховка?")
+    assert cla == {"relevant": True}
+    stats = rules.stats()
+    assert stats["transfer"]["hits"] == 1 and stats["insurance_ad"]["hits"] == 1
+    assert stats["insurance_ad"]["evaluated"] == 2 and "off" not in stats
+    assert 'leadbot_override_rule_hits_total{rule="transfer"} 1' in rules.prometheus_lines()
+
+
+def test_terms_are_interned_across_rules():
+    compiled = CompiledRules({"rules": [
+        {"id": "a", "when": {"any": ["нужна", "хочу"]}, "set": {}},
+        {"id": "b", "when": {"none": ["Нужна"]}, "set": {}},
+    ]})
+    assert compiled.terms == ["нужна", "хочу"]
+    assert compiled.rules[1].none == (0,)
+
+
+def test_invalid_specs_are_rejected():
+    with pytest.raises(ValueError):
+        CompiledRules({"rules": [{"id": "a", "when": {"maybe": ["x"]}, "set": {}}]})
+    with pytest.raises(ValueError):
+        CompiledRules({"rules": [{"id": "a", "set": {}}, {"id": "a", "set": {}}]})
+
+
+def test_hot_reload_keeps_old_rules_on_bad_file(tmp_path):
+    path = tmp_path / "overrides.json"
+    path.write_text(json.dumps(SPEC), encoding="utf-8")
+    metrics = Counter()
+    rules = OverrideRules(str(path), metrics=metrics)
+    assert rules.version == 2 and not rules.reload_if_changed()
+
+    path.write_text("{broken", encoding="utf-8")
+    os.utime(path, (1, 1))
+    assert not rules.reload_if_changed()
+    assert rules.version == 2 and metrics["overrides_reload_failed"] == 1
+
+    path.write_text(json.dumps({"version": 3, "rules": []}), encoding="utf-8")
+    os.utime(path, (2, 2))
+    assert rules.reload_if_changed()
+    assert rules.version == 3 and rules.apply({"x": 1}, "трансфер") == {"x": 1}
+
+
+def test_missing_file_is_reported_once(tmp_path, caplog):
+    path = tmp_path / "overrides.json"
+    metrics = Counter()
+    with caplog.at_level("ERROR", logger="overrides"):
+        rules = OverrideRules(str(path), metrics=metrics)
+        assert not rules.reload_if_changed()
+    assert metrics["overrides_reload_failed"] == 1
+    assert len([r for r in caplog.records if "unavailable" in r.getMessage()]) == 1
+
+    path.write_text(json.dumps(SPEC), encoding="utf-8")
+    assert rules.reload_if_changed() and rules.version == 2
+
+
+def test_default_path_does_not_depend_on_cwd():
+    import ai_utils
+    assert os.path.isabs(ai_utils.override_rules.path)
+    assert ai_utils.override_rules.compiled.rules
+
+
+def test_shipped_rules_match_previous_behaviour():
+    cla = apply_overrides({"relevant": True, "confidence": 0.5}, "нужен трансфер из аэропорта", "трансфер")
+    assert cla["category"] == "трансфер" and cla["confidence"] == 0.6
+    cla = apply_overrides({"relevant": True, "confidence": 0.9}, "выгодно оформить страховка за 5 минут", None)
+    assert cla["relevant"] is False and cla["explanation"] == "Реклама страховки"
+    cla = apply_overrides({"relevant": True, "confidence": 0.9}, "хочу оформить страховка, сколько стоит?", None)
+    assert cla["relevant"] is True
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import logging
+from collections import Counter
+
+from bench import FakeChat, FakeClassifier, FakeEvent, RecordingSink
+from dedup import MessageDeduper
+from entity_cache import EntityCache
+from keywords import KeywordMatcher
+from locations import LOCATION_ALIAS
+from near_dup import NearDupStore
+from pipeline import Pipeline
+from regions import RegionDetector
+from routing import RoutingIndex
+from tracing import Tracer
+
+
+class _NullLog:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+
+
+def _pipeline(metrics, subscriptions):
+    with open("categories.json", encoding="utf-8") as f:
+        categories = json.load(f)
+    matcher = KeywordMatcher(categories)
+    routing_index = RoutingIndex(subscriptions, matcher=matcher)
+    sink = RecordingSink(routing_index)
+    ai = FakeClassifier(latency=0)
+    rejected = _NullLog()
+    pipeline = Pipeline(
+        deduper=MessageDeduper(),
+        near_dups=NearDupStore(path=None, metrics=metrics),
+        chat_cache=EntityCache("chat", metrics=metrics),
+        sender_cache=EntityCache("sender", metrics=metrics),
+        region_detector=RegionDetector(LOCATION_ALIAS),
+        location_alias=LOCATION_ALIAS,
+        canonical_locations=sorted(set(LOCATION_ALIAS.values())),
+        keyword_matcher=matcher,
+        routing_index=routing_index,
+        subscriptions=subscriptions,
+        categories=categories,
+        classify=ai.classify,
+        apply_overrides=lambda cla, lower_text, heuristic: cla,
+        deliver=sink,
+        rejected_log=rejected,
+        low_confidence_log=_NullLog(),
+        metrics=metrics,
+        logger=logging.getLogger("test_pipeline"),
+    )
+    return pipeline, sink, ai, rejected
+
+
+def test_lead_reaches_sink_once():
+    metrics = Counter()
+    with open("categories.json", encoding="utf-8") as f:
+        cat = next(iter(json.load(f)))
+    subs = {"1": {"locations": ["Анталия"], "categories": [cat], "subcats": {}}}
+    pipeline, sink, ai, _ = _pipeline(metrics, subs)
+    matcher = pipeline.keyword_matcher
+    keyword = matcher.keywords[next(iter(matcher.category_keywords[cat]))]
+    chat = FakeChat(-1001, "Анталия чат")
+    tracer = Tracer()
+
+    async def scenario():
+        for msg_id in (1, 1):
+            event = FakeEvent(chat, msg_id, f"Ищу {keyword} в Анталии, подскажите", sender_id=5)
+            trace = tracer.start(origin=event.date.timestamp())
+            await pipeline.process(event, trace)
+            tracer.finish(trace)
+
+    asyncio.run(scenario())
+    assert metrics["received"] == 2 and metrics["deduplicated"] == 1
+    assert ai.calls == 1
+    assert sink.leads == 1 and sink.deliveries == 1
+    assert {"dedup", "region", "keywords", "ai", "delivery_route"} <= set(tracer.stages)
+
+
+def test_message_without_region_stops_early():
+    metrics = Counter()
+    pipeline, sink, ai, _ = _pipeline(metrics, {})
+    chat = FakeChat(-1002, "Общий чат")
+    asyncio.run(pipeline.process(FakeEvent(chat, 1, "просто разговор", sender_id=5), Tracer().start()))
+    assert metrics["no_region"] == 1
+    assert ai.calls == 0 and sink.leads == 0
@@ -0,0 +1,88 @@
+import asyncio
+import json
+from collections import Counter
+
+from bench import FakeChat, FakeEvent
+from preclassifier import PreClassifier, choose_threshold, evaluate, parse_audit_log, train
+from test_pipeline import _NullLog, _pipeline
+from tracing import Tracer
+
+LEADS = [
+    "Ищу мастера по ремонту кондиционера, подскажите",
+    "Кто может посоветовать хорошего стоматолога?",
+    "Нужен электрик на завтра, порекомендуйте",
+    "Подскажите, где найти сантехника недорого",
+    "Ищем няню для ребёнка 3 лет, посоветуйте",
+    "Нужна помощь с ВНЖ, кто может подсказать?",
+]
+ADS = [
+    "Предлагаю услуги электрика, опыт 10 лет, пишите в личку",
+    "Продаю диван, состояние отличное, цена 5000",
+    "Сдаётся квартира 2+1, звоните +90 555 000 00 00",
+    "Делаем ремонт под ключ, гарантия, звоните",
+    "Оказываем услуги по оформлению ВНЖ, пишите",
+    "Маникюр, педикюр, запись в директ",
+]
+
+
+def _model():
+    samples = [(t, 1) for t in LEADS] + [(t, 0) for t in ADS]
+    return train(samples * 5, dim=1 << 12, epochs=10)
+
+
+def test_scores_separate_requests_from_offers():
+    model = _model()
+    assert model.score("Подскажите, ищу хорошего мастера") > model.score("Предлагаю услуги, пишите в личку")
+    rows = evaluate(model, [(t, 1) for t in LEADS] + [(t, 0) for t in ADS], thresholds=(0.5,))
+    assert rows[0]["recall_loss"] == 0.0 and rows[0]["ai_call_reduction"] == 0.5
+
+
+def test_choose_threshold_respects_recall_budget():
+    model = _model()
+    samples = [(t, 1) for t in LEADS] + [(t, 0) for t in ADS]
+    threshold = choose_threshold(model, samples, max_recall_loss=0.0)
+    assert all(model.score(t) >= threshold for t in LEADS)
+
+
+def test_save_load_round_trip(tmp_path):
+    model = _model()
+    model.threshold = 0.25
+    path = str(tmp_path / "pc.bin")
+    model.save(path)
+    loaded = PreClassifier.load(path)
+    assert loaded.threshold == 0.25 and loaded.dim == model.dim
+    assert abs(loaded.score(ADS[0]) - model.score(ADS[0])) < 1e-5
+    assert PreClassifier.load(str(tmp_path / "missing.bin")) is None
+
+
+def test_parse_audit_log_multiline(tmp_path):
+    path = tmp_path / "ai_rejected.log"
+    path.write_text(
+        "08-01 10:00 | -100 (Чат) | строка один\nстрока два | relevant:False, category:None, confidence:0.9\n"
+        "2025-07-01T10:00:00 | -100 | старый формат\n",
+        encoding="utf-8",
+    )
+    entries = parse_audit_log(str(path))
+    assert entries == [("строка один\nстрока два", False), ("старый формат", None)]
+
+
+def test_pipeline_drops_locally_before_ai():
+    metrics = Counter()
+    with open("categories.json", encoding="utf-8") as f:
+        cat = next(iter(json.load(f)))
+    subs = {"1": {"locations": ["Анталия"], "categories": [cat], "subcats": {}}}
+    pipeline, sink, ai, _ = _pipeline(metrics, subs)
+    keyword = pipeline.keyword_matcher.keywords[next(iter(pipeline.keyword_matcher.category_keywords[cat]))]
+    pipeline.preclassifier = _model()
+    pipeline.preclassifier.threshold = 1.01       # всё «нерелевантно»
+    pipeline.preclassified_log = _NullLog()
+    chat = FakeChat(-1001, "Анталия чат")
+    asyncio.run(pipeline.process(FakeEvent(chat, 1, f"Продаю {keyword} в Анталии", sender_id=5), Tracer().start()))
+    assert metrics["preclassifier_dropped"] == 1
+    assert ai.calls == 0 and sink.leads == 0
+    line = pipeline.preclassified_log.lines[0]
+    assert "| -1001 (Анталия чат) |" in line and "| p_lead:" in line
+
+    pipeline.preclassifier.threshold = 0.0
+    asyncio.run(pipeline.process(FakeEvent(chat, 2, f"Ищу {keyword} в Анталии", sender_id=5), Tracer().start()))
+    assert metrics["preclassifier_passed"] == 1 and ai.calls == 1
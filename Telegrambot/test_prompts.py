@@ -0,0 +1,43 @@
+from collections import Counter
+
+from fake_openai import Responder
+from prompts import PromptBuilder, count_tokens
+
+
+def test_system_prefix_is_shared_by_all_prompts():
+    builder = PromptBuilder()
+    a = builder.single("нужен трансфер", ["трансфер"], ["Анталия"])
+    b = builder.single("аренда авто в кемере", ["аренда", "трансфер"], ["Кемер"])
+    c = builder.batch(["раз", "два"], ["трансфер"], ["Анталия"])
+    assert a.messages[0]["content"] == b.messages[0]["content"] == c.messages[0]["content"]
+    assert "трансфер" not in a.messages[0]["content"].split("Примеры:")[0]
+    assert a.messages[1]["content"].endswith('"""нужен трансфер"""\n')
+
+
+def test_blocks_are_memoized_per_subset():
+    metrics = Counter()
+    builder = PromptBuilder(max_blocks=2, metrics=metrics)
+    builder.single("раз", ["трансфер"], ["Анталия"])
+    builder.single("два", ["трансфер"], ["Анталия"])
+    builder.batch(["три"], ["трансфер"], ["Анталия"])
+    builder.single("четыре", ["аренда"], [])
+    assert metrics["prompt_blocks_hit"] == 1 and metrics["prompt_blocks_built"] == 3
+    assert builder.cache_size() == 2
+
+
+def test_token_count_adds_up():
+    builder = PromptBuilder()
+    text = "Нужен трансфер из аэропорта Анталии в Кемер на троих"
+    prompt = builder.single(text, ["трансфер"], ["Анталия", "Кемер"])
+    exact = sum(count_tokens(m["content"]) for m in prompt.messages)
+    assert prompt.prefix_tokens < prompt.tokens
+    assert abs(prompt.tokens - exact) <= 12          # служебные токены + округления
+
+
+def test_fake_server_reads_lists_from_the_tail():
+    builder = PromptBuilder()
+    single = builder.single("нужен трансфер в кемер", ["трансфер", "аренда"], ["Кемер"])
+    verdict = Responder().content(single.messages)
+    assert '"category": "трансфер"' in verdict and '"region": "Кемер"' in verdict
+    batch = builder.batch(["нужен трансфер", "аренда авто"], ["трансфер", "аренда"], [])
+    assert Responder().content(batch.messages).startswith("[")
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import ratelimit
+from ratelimit import AsyncTokenBucket
+
+_real_sleep = asyncio.sleep
+
+
+class Clock:
+    """Виртуальное время: sleep не ждёт, а сдвигает monotonic."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        await _real_sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", c.monotonic)
+    monkeypatch.setattr(ratelimit.asyncio, "sleep", c.sleep)
+    return c
+
+
+def test_burst_is_served_without_waiting(clock):
+    bucket = AsyncTokenBucket(rate=2, burst=3)
+
+    async def run():
+        for _ in range(3):
+            await bucket.acquire()
+        assert clock.sleeps == []
+        await bucket.acquire()
+
+    asyncio.run(run())
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_refill_rate_and_capacity_cap(clock):
+    bucket = AsyncTokenBucket(rate=4, burst=2)
+
+    async def run():
+        await bucket.acquire(2)
+        clock.now += 0.25                 # один токен
+        await bucket.acquire()
+        assert clock.sleeps == []
+        clock.now += 100                  # простой не копит больше burst
+        await bucket.acquire(2)
+        assert clock.sleeps == []
+        await bucket.acquire()
+
+    asyncio.run(run())
+    assert clock.sleeps == [pytest.approx(0.25)]
+
+
+def test_concurrent_waiters_are_served_in_order_at_rate(clock):
+    bucket = AsyncTokenBucket(rate=10, burst=1)
+    granted = []
+
+    async def worker(i):
+        await bucket.acquire()
+        granted.append((i, clock.now))
+
+    async def run():
+        await asyncio.gather(*(worker(i) for i in range(6)))
+
+    asyncio.run(run())
+    assert [i for i, _ in granted] == list(range(6))
+    start = granted[0][1]
+    assert [t - start for _, t in granted] == [pytest.approx(k * 0.1) for k in range(6)]
+
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValueError):
+        AsyncTokenBucket(rate=0)
@@ -0,0 +1,28 @@
+import pytest
+from locations import LOCATION_ALIAS
+from regions import RegionDetector
+
+detector = RegionDetector(LOCATION_ALIAS)
+
+
+@pytest.mark.parametrize("msg,expect_region", [
+    ("Нужен трансфер из Анталии в отель", "Анталия"),
+    ("Ищу квартиру в Кемере", "Кемер"),
+    ("Отдыхаем в Сиде", "Сиде"),
+    ("Антолия, нужен гид", "Анталия"),   # опечатка → нечёткий фолбэк
+    ("Мы сидим дома", None),             # «сиде» не стеммится
+    ("Камера сломалась", None),          # «камер» ≠ «кемер»
+    ("Из Кемера в Турции", "Кемер"),     # конкретный город важнее «Турции»
+])
+def test_first_region(msg, expect_region):
+    hit = detector.first(msg.lower())
+    assert (hit.region if hit else None) == expect_region
+
+
+def test_detect_positions_and_phrases():
+    d = RegionDetector({"старый город": "Калеичи", "кемер": "Кемер"})
+    text = "гид по старому городу, потом кемер"
+    hits = d.detect(text)
+    assert [h.region for h in hits] == ["Калеичи", "Кемер"]
+    assert text[hits[0].start:hits[0].end] == "старому городу"
+    assert not hits[0].fuzzy
@@ -0,0 +1,96 @@
+from collections import Counter
+
+from routing import RoutingIndex, select_recipients
+
+SUBS = {
+    "1": {"locations": ["Кемер"], "categories": ["трансфер"], "subcats": {}},
+    "2": {"locations": ["Кемер", "Анталия"], "categories": [], "subcats": {"недвижимость": ["аренда"]}},
+}
+
+
+def test_lookup_by_category_and_subcategory():
+    idx = RoutingIndex(SUBS)
+    snap = idx.snapshot
+    assert snap.lookup("Кемер", ["трансфер"], []) == {"1"}
+    assert snap.lookup("Анталия", ["недвижимость"], [("недвижимость", "аренда")]) == {"2"}
+    assert snap.lookup("Сиде", ["трансфер"], []) == set()
+
+
+def test_update_user_publishes_new_snapshot():
+    idx = RoutingIndex(SUBS)
+    old = idx.snapshot
+    idx.update_user("1", {"locations": ["Сиде"], "categories": ["трансфер"], "subcats": {}})
+    assert old.lookup("Кемер", ["трансфер"], []) == {"1"}  # старый снимок не меняется
+    assert idx.snapshot.lookup("Кемер", ["трансфер"], []) == set()
+    assert idx.snapshot.lookup("Сиде", ["трансфер"], []) == {"1"}
+    idx.update_user("2", None)
+    assert not idx.snapshot.has_region("Анталия")
+
+
+def test_update_user_copies_only_touched_regions():
+    from keywords import KeywordMatcher
+    matcher = KeywordMatcher({"трансфер": {"keywords": ["трансфер"]}})
+    subs = {str(i): {"locations": ["Кемер" if i % 2 else "Сиде"], "categories": ["трансфер"], "subcats": {}}
+            for i in range(200)}
+    idx = RoutingIndex(subs, matcher=matcher)
+    old = idx.snapshot
+    idx.update_user("1", {"locations": ["Кемер"], "categories": [], "subcats": {}})
+    new = idx.snapshot
+    assert new.regions["Сиде"] is old.regions["Сиде"]            # регион не тронут – общий
+    assert new.regions["Кемер"] is not old.regions["Кемер"]
+    assert "1" not in new.lookup("Кемер", ["трансфер"], []) and "1" in old.lookup("Кемер", ["трансфер"], [])
+    shared = sum(a is b for a, b in zip(new.plans._shards, old.plans._shards))
+    assert shared == len(old.plans._shards) - 1
+    assert len(new.plans) == 200 and new.plans["1"].categories == frozenset()
+    idx.update_user("1", None)
+    assert len(idx.snapshot.plans) == 199 and "1" not in idx.snapshot.plans
+
+
+def test_select_recipients_follows_filter_changes():
+    from keywords import KeywordMatcher
+    cats = {
+        "трансфер": {"keywords": ["трансфер", "из аэропорта"]},
+        "недвижимость": {"keywords": ["квартира"], "subcategories": {"аренда": {"keywords": ["сниму"]}}},
+    }
+    matcher = KeywordMatcher(cats)
+    idx = RoutingIndex(SUBS, matcher=matcher)
+
+    def recipients(region, kw_match, category=None, metrics=None):
+        return sorted(uid for uid, _ in select_recipients(idx.snapshot, region, kw_match, category, metrics=metrics))
+
+    lead = matcher.match("нужен трансфер из аэропорта")
+    assert recipients("Кемер", lead, "трансфер") == ["1"]
+    assert recipients("Сиде", lead, "трансфер") == []
+    rent = matcher.match("сниму квартиру в кемере")
+    metrics = Counter()
+    assert recipients("Кемер", rent, metrics=metrics) == ["2"]
+    assert metrics["pref_category_skipped"] == 1          # «1» в Кемере, но keywords не его
+    assert recipients("Анталия", rent) == ["2"]
+    # keyword только категории, без подкатегории «аренда» – плану «2» не подходит
+    assert recipients("Кемер", matcher.match("продам квартиру")) == []
+
+    idx.update_user("1", {"locations": ["Кемер"], "categories": ["недвижимость"], "subcats": {}})
+    assert recipients("Кемер", lead, "трансфер") == []
+    assert recipients("Кемер", rent, "недвижимость") == ["1"]
+    idx.update_user("1", None)
+    assert "1" not in idx.snapshot.plans
+
+
+def test_select_recipients_applies_ai_category():
+    from keywords import KeywordMatcher
+    matcher = KeywordMatcher({
+        "трансфер": {"keywords": ["трансфер"]},
+        "недвижимость": {"keywords": ["квартира"]},
+    })
+    subs = {
+        "1": {"locations": ["Кемер"], "categories": ["трансфер"], "subcats": {}},
+        "2": {"locations": ["Кемер"], "categories": ["трансфер", "недвижимость"], "subcats": {}},
+    }
+    idx = RoutingIndex(subs, matcher=matcher)
+    metrics = Counter()
+    # keywords обеих категорий, AI отнёс лид к недвижимости
+    lead = matcher.match("квартира с трансфером")
+    chosen = select_recipients(idx.snapshot, "Кемер", lead, "недвижимость", metrics=metrics)
+    assert [uid for uid, _ in chosen] == ["2"]
+    assert chosen[0][1] is idx.snapshot.plans["2"]
+    assert metrics["pref_ai_category_skipped"] == 1
@@ -0,0 +1,107 @@
+import asyncio
+from collections import Counter
+
+from shards import ShardManager, ShardMap
+
+
+def _manager(tmp_path, members, metrics=None):
+    manager = ShardManager(list(members), ShardMap(str(tmp_path / "shard_map.json")), metrics=metrics)
+    for name, chats in members.items():
+        manager.set_members(name, chats)
+        manager.connected(name)
+    return manager
+
+
+def test_balance_keeps_owners_and_splits_the_rest(tmp_path):
+    manager = _manager(tmp_path, {"a": [1, 2, 3, 4], "b": [3, 4, 5, 6]})
+    manager.map.set(4, "b")
+    loads = manager.balance()
+    assert loads == {"a": 3, "b": 3}
+    assert manager.map.get(4) == "b" and manager.map.get(1) == "a" and manager.map.get(6) == "b"
+
+    # карта переживает рестарт
+    reloaded = ShardMap(manager.map.path)
+    assert reloaded.load() == 6 and reloaded.owners == manager.map.owners
+
+
+def test_only_the_owner_passes_messages(tmp_path):
+    metrics = Counter()
+    manager = _manager(tmp_path, {"a": [1, 2], "b": [1, 2]}, metrics)
+    manager.balance()
+    owner = manager.map.get(1)
+    other = "b" if owner == "a" else "a"
+    assert manager.accept(owner, 1) and not manager.accept(other, 1)
+    assert metrics["shard_skipped"] == 1
+    assert manager.accept("b", 99) and manager.map.get(99) == "b"      # новый чат
+    assert manager.health()[owner]["messages"] >= 1
+
+
+def test_disconnect_reassigns_and_orphans(tmp_path):
+    metrics = Counter()
+    manager = _manager(tmp_path, {"a": [1, 2, 3], "b": [2, 3]}, metrics)
+    manager.map.set(2, "a")
+    manager.map.set(3, "a")
+    assert manager.disconnected("a") == 2
+    assert manager.map.get(2) == manager.map.get(3) == "b"
+    assert manager.orphaned == {1} and metrics["shard_chats_reassigned"] == 2
+    assert 'leadbot_shard_up{shard="a"} 0' in manager.prometheus_lines()
+    manager.connected("a")
+    assert manager.map.get(1) == "a" and not manager.orphaned
+    assert manager.map.get(2) == "b"                                  # без лишних переездов
+
+
+def test_chat_of_a_session_not_started_yet_is_taken_over(tmp_path):
+    shard_map = ShardMap(str(tmp_path / "shard_map.json"))
+    shard_map.set(1, "b")
+    manager = ShardManager(["a", "b"], shard_map)
+    manager.set_members("a", [1])
+    manager.connected("a")                                          # b ещё стартует
+    assert manager.accept("a", 1) and manager.map.get(1) == "a"
+    manager.set_members("b", [1])
+    manager.connected("b")
+    assert manager.accept(manager.map.get(1), 1)
+
+
+def test_reconnect_rebalances_the_load(tmp_path):
+    metrics = Counter()
+    manager = _manager(tmp_path, {"a": [1, 2, 3, 4], "b": [1, 2, 3, 4]}, metrics)
+    manager.disconnected("b")
+    assert manager.health()["a"]["chats"] == 4
+    manager.connected("b")
+    assert manager.health()["a"]["chats"] == manager.health()["b"]["chats"] == 2
+    assert metrics["shard_chats_rebalanced"] >= 2
+
+
+class FlakyClient:
+    def __init__(self, manager):
+        self.manager = manager
+        self.runs = 0
+
+    async def run_until_disconnected(self):
+        self.runs += 1
+        if self.runs > 1:
+            assert self.manager.shards["a"].connected
+            raise asyncio.CancelledError
+        assert self.manager.shards["a"].connected
+
+    async def connect(self):
+        pass
+
+    async def is_user_authorized(self):
+        return True
+
+
+def test_supervise_reconnects(tmp_path, monkeypatch):
+    manager = _manager(tmp_path, {"a": [1], "b": [1]})
+    manager.map.set(1, "a")
+    client = FlakyClient(manager)
+
+    async def no_sleep(_):
+        assert manager.map.get(1) == "b"          # пока a переподключается, чат у b
+
+    monkeypatch.setattr("shards.asyncio.sleep", no_sleep)
+    try:
+        asyncio.run(manager.supervise("a", client))
+    except asyncio.CancelledError:
+        pass
+    assert client.runs == 2 and manager.shards["a"].disconnects == 1
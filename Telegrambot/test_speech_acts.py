@@ -0,0 +1,60 @@
+import asyncio
+from collections import Counter
+
+from bench import FakeChat, FakeEvent
+from filters import contains_negative
+from speech_acts import SpeechActDetector, detect
+from test_pipeline import _pipeline
+from tracing import Tracer
+
+
+def test_offer_with_contacts_without_request():
+    acts = detect("Сдам квартиру 2+1 от собственника, пишите @owner")
+    assert acts.offer and acts.contact and not acts.request
+    assert acts.offer_with_contacts and acts.label == "offer_with_contacts"
+    assert ("offer", "от собственника") in acts.markers
+
+
+def test_request_wins_over_offer_markers():
+    acts = detect("Ищу квартиру без комиссии, пишите в whatsapp")
+    assert acts.request and acts.offer and acts.contact
+    assert not acts.offer_with_contacts
+
+
+def test_seller_is_an_offer():
+    acts = detect("Предлагаем трансфер, VIP авто, +90 555 123 45 67")
+    assert acts.seller and acts.offer and acts.offer_with_contacts
+
+
+def test_negative_respects_negation():
+    assert detect("Осторожно, мошенники!").negative
+    assert not detect("это не спам, честно").negative
+    assert detect("не  спам").negative            # два пробела – как (?<!\bне\s) в прежнем regex
+    assert detect("антиспам фильтр").negative      # стем внутри слова
+    assert contains_negative("Без ПРЕДОПЛАТЫ не работаю")
+
+
+def test_phrase_markers_need_word_boundaries():
+    d = SpeechActDetector({"request": ["где взять"]}, negative_stems=[])
+    assert d.detect("подскажите, где взять машину").request
+    assert not d.detect("где взятка").request
+
+
+def test_pipeline_rejects_offer_before_ai():
+    metrics = Counter()
+    subs = {"1": {"locations": ["Анталия"], "categories": ["недвижимость"], "subcats": {}}}
+    pipeline, sink, ai, rejected = _pipeline(metrics, subs)
+    pipeline.speech_acts = detect
+    chat = FakeChat(-1001, "Анталия чат")
+    ad = "Сдам квартиру 2+1 в Анталии от собственника, рядом море и парк, пишите @owner"
+    # без подписчика на регион объявление отсекается маршрутизацией и в ai_rejected.log не попадает
+    unrouted = "Сдам квартиру 1+1 в Кемере от собственника, рядом море и пляж, пишите @owner2"
+    asyncio.run(pipeline.process(FakeEvent(FakeChat(-1003, "Кемер чат"), 2, unrouted, sender_id=5), Tracer().start()))
+    assert metrics["speech_act_rejected"] == 0 and rejected.lines == []
+    asyncio.run(pipeline.process(FakeEvent(chat, 1, ad, sender_id=5), Tracer().start()))
+    assert metrics["speech_act_rejected"] == 1
+    assert ai.calls == 0 and sink.leads == 0
+    assert "explanation:speech_act:offer_with_contacts" in rejected.lines[0]
+    # Кросспост того же объявления отсекается уже на near-dup
+    asyncio.run(pipeline.process(FakeEvent(FakeChat(-1002, "Анталия 2"), 1, ad, sender_id=6), Tracer().start()))
+    assert metrics["near_dup_dropped"] == 1
@@ -0,0 +1,31 @@
+import snowballstemmer
+
+from stemmer import Stemmer
+
+_snowball = snowballstemmer.stemmer("russian")
+
+
+def test_same_stems_as_snowball():
+    stemmer = Stemmer()
+    words = ["трансфер", "трансфера", "аэропорта", "Анталии", "ёлки", "yachts"]
+    assert [stemmer.stem(w) for w in words] == [_snowball.stemWord(w.lower()) for w in words]
+    assert stemmer.stem_many(words) == [_snowball.stemWord(w.lower()) for w in words]
+
+
+def test_hits_and_misses_are_counted():
+    stemmer = Stemmer()
+    stemmer.stem_many(["нужен", "трансфер", "нужен"])
+    stemmer.stem("трансфер")
+    assert stemmer.calls == 4 and stemmer.misses == 2
+    assert stemmer.stats()["hit_rate"] == 0.5
+
+
+def test_overflow_keeps_seeded_stems():
+    stemmer = Stemmer(max_size=3)
+    assert stemmer.seed_phrases(["Аренда авто", "аренда"]) == 2
+    assert stemmer.misses == 0                        # предзаполнение – не промахи
+    stemmer.stem_many(["раз", "два", "три"])
+    assert stemmer.resets >= 1 and len(stemmer) <= 3
+    misses = stemmer.misses
+    stemmer.stem_many(["аренда", "авто"])
+    assert stemmer.misses == misses
@@ -0,0 +1,37 @@
+import json
+
+from subscription_store import SubscriptionStore
+
+
+def test_migration_row_updates_and_export(tmp_path):
+    legacy = {"1": {"categories": ["трансфер"], "locations": ["Анталия"]}, "2": {"categories": []}}
+    json_path = tmp_path / "subscriptions.json"
+    json_path.write_text(json.dumps(legacy, ensure_ascii=False), encoding="utf-8")
+    db = str(tmp_path / "subs.sqlite3")
+
+    store = SubscriptionStore(db, json_path=str(json_path), flush_interval=0)
+    assert dict(store) == legacy
+    store["1"]["locations"].append("Кемер")
+    store.save("1")
+    store["3"] = {"categories": ["аренда"]}
+    del store["2"]
+    store.close()
+
+    reopened = SubscriptionStore(db, json_path=str(json_path))
+    assert reopened["1"]["locations"] == ["Анталия", "Кемер"]
+    assert set(reopened) == {"1", "3"}              # миграция не повторяется
+    out = tmp_path / "export.json"
+    reopened.export_json(str(out))
+    assert json.loads(out.read_text(encoding="utf-8"))["3"] == {"categories": ["аренда"]}
+    reopened.close()
+
+
+def test_repeated_edits_coalesce_into_one_write(tmp_path):
+    store = SubscriptionStore(str(tmp_path / "subs.sqlite3"), json_path=None, flush_interval=60)
+    prefs = store.setdefault("42", {"categories": []})
+    for cat in ("трансфер", "аренда", "экскурсии"):
+        prefs["categories"].append(cat)
+        store.save("42")
+    store.flush()
+    assert store.writes == 1
+    store.close()
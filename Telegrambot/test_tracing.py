@@ -0,0 +1,56 @@
+import time
+from collections import Counter
+
+from tracing import Tracer, StageWindow
+
+
+class _Log:
+    def __init__(self):
+        self.lines = []
+
+    def warning(self, msg):
+        self.lines.append(msg)
+
+
+def test_laps_feed_stage_windows():
+    tracer = Tracer()
+    trace = tracer.start("1/1", origin=time.time() - 2)
+    trace.lap("region")
+    trace.lap("ai")
+    tracer.finish(trace)
+    assert [s for s, _ in trace.spans] == ["region", "ai"]
+    assert set(tracer.stages) == {"region", "ai", "total", "arrival_lag"}
+    assert 1.9 < tracer.stages["arrival_lag"].values[0] < 3
+    assert tracer.summary()["ai"]["count"] == 1
+
+
+def test_quantiles_over_rolling_window():
+    win = StageWindow(window=100)
+    for i in range(1, 201):
+        win.add(i / 1000)
+    q = win.quantiles()
+    # only the last 100 values (101..200 ms) are kept
+    assert q[0.5] == 0.151 and q[0.95] == 0.196 and q[0.99] == 0.2
+    assert win.count == 200
+
+
+def test_slow_messages_are_sampled_and_rate_limited():
+    log, metrics = _Log(), Counter()
+    tracer = Tracer(slow_threshold=0.0, slow_log_interval=60, logger=log, metrics=metrics)
+    for i in range(3):
+        trace = tracer.start(f"1/{i}")
+        trace.lap("ai")
+        tracer.finish(trace)
+    assert metrics["slow_messages"] == 3
+    assert len(tracer.slow_samples) == 3
+    assert tracer.slow_samples[0]["last_stage"] == "ai"
+    assert len(log.lines) == 1 and "ai=" in log.lines[0]
+
+
+def test_prometheus_summary_lines():
+    tracer = Tracer()
+    tracer.record("ai", 0.5)
+    lines = tracer.prometheus_lines()
+    assert "# TYPE leadbot_stage_seconds summary" in lines
+    assert 'leadbot_stage_seconds{stage="ai",quantile="0.95"} 0.5' in lines
+    assert 'leadbot_stage_seconds_count{stage="ai"} 1' in lines
@@ -0,0 +1,141 @@
+r"""
+tracing.py
+Лёгкая трассировка этапов parser handler и send_lead_to_users.
+
+• Trace.lap(stage) – время с предыдущей отметки (perf_counter + append),
+  этапы идут подряд, поэтому код handler не нужно заворачивать в with;
+• Tracer.finish(trace) складывает этапы в скользящие окна (последние window
+  значений на этап) – p50/p95/p99 считаются только при запросе (/metrics,
+  metrics.json);
+• медленные сообщения (total >= slow_threshold) логируются с разбивкой по
+  этапам, не чаще раза в slow_log_interval секунд; последние образцы
+  хранятся в slow_samples;
+• свежесть лида (event.date → последняя отправка) пишет delivery по
+  Fanout.origin, см. lead_freshness_seconds.
+"""
+
+from __future__ import annotations
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Trace:
+    """Отметки этапов одного сообщения."""
+
+    __slots__ = ("name", "origin", "started", "spans", "_last", "lag")
+
+    def __init__(self, name: str = "", origin: Optional[float] = None):
+        self.name = name
+        # время события в источнике (event.date, epoch) – для свежести
+        self.origin = origin
+        self.started = self._last = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        # задержка от event.date до входа в handler
+        self.lag = max(0.0, time.time() - origin) if origin else None
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.spans.append((stage, now - self._last))
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        return self._last - self.started
+
+    @property
+    def last_stage(self) -> Optional[str]:
+        return self.spans[-1][0] if self.spans else None
+
+    def breakdown(self) -> str:
+        return " ".join(f"{stage}={sec * 1000:.0f}ms" for stage, sec in self.spans)
+
+
+class StageWindow:
+    """Последние window длительностей этапа."""
+
+    __slots__ = ("values", "count", "sum")
+
+    def __init__(self, window: int):
+        self.values: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value: float) -> None:
+        self.values.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self) -> Dict[float, float]:
+        data = sorted(self.values)
+        if not data:
+            return {}
+        last = len(data) - 1
+        return {q: data[min(last, int(q * len(data)))] for q in QUANTILES}
+
+
+class Tracer:
+    def __init__(self, window: int = 2048, slow_threshold: float = 5.0, slow_log_interval: float = 10.0,
+                 max_samples: int = 20, logger=None, metrics: Optional[Counter] = None):
+        self.window = window
+        self.slow_threshold = slow_threshold
+        self.slow_log_interval = slow_log_interval
+        self.logger = logger
+        self.metrics = metrics if metrics is not None else Counter()
+        self.stages: Dict[str, StageWindow] = {}
+        self.slow_samples: Deque[dict] = deque(maxlen=max_samples)
+        self._last_slow_log = 0.0
+
+    def start(self, name: str = "", origin: Optional[float] = None) -> Trace:
+        return Trace(name, origin)
+
+    def record(self, stage: str, seconds: float) -> None:
+        win = self.stages.get(stage)
+        if win is None:
+            win = self.stages[stage] = StageWindow(self.window)
+        win.add(seconds)
+
+    def finish(self, trace: Trace) -> None:
+        for stage, seconds in trace.spans:
+            self.record(stage, seconds)
+        total = trace.total
+        self.record("total", total)
+        if trace.lag is not None:
+            self.record("arrival_lag", trace.lag)
+        if total < self.slow_threshold:
+            return
+        self.metrics['slow_messages'] += 1
+        sample = {
+            "name": trace.name,
+            "total_ms": int(total * 1000),
+            "last_stage": trace.last_stage,
+            "stages": {stage: int(sec * 1000) for stage, sec in trace.spans},
+        }
+        self.slow_samples.append(sample)
+        now = time.monotonic()
+        if self.logger and now - self._last_slow_log >= self.slow_log_interval:
+            self._last_slow_log = now
+            self.logger.warning(f"🐢 Slow message {trace.name}: {total * 1000:.0f}ms "
+                                f"(stopped at {trace.last_stage}) | {trace.breakdown()}")
+
+    # --- экспорт ---------------------------------------------------------------
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """stage → {count, p50_ms, p95_ms, p99_ms} (для metrics.json и логов)."""
+        out = {}
+        for stage, win in sorted(self.stages.items()):
+            q = win.quantiles()
+            out[stage] = {"count": win.count, **{f"p{int(k * 100)}_ms": round(v * 1000, 1) for k, v in q.items()}}
+        return out
+
+    def prometheus_lines(self, name: str = "leadbot_stage_seconds") -> List[str]:
+        """Prometheus summary: квантили по скользящему окну, sum/count – за всё время."""
+        lines = [f"# HELP {name} Per-stage handler/delivery latency (rolling window quantiles)",
+                 f"# TYPE {name} summary"]
+        for stage, win in sorted(list(self.stages.items())):
+            for q, v in win.quantiles().items():
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {v!r}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {win.sum!r}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {win.count}')
+        return lines
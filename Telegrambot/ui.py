@@ -4,7 +4,10 @@ bot_client = main.bot_client
 subscriptions = main.subscriptions
 ADMIN_ID = main.ADMIN_ID
 save_subscriptions = main.save_subscriptions
+routing_index = main.routing_index
+expiry_scheduler = main.expiry_scheduler
 categories = main.categories
+category_reloader = main.category_reloader
 
 CANONICAL_LOCATIONS = main.CANONICAL_LOCATIONS
 def has_subcats(cat: str) -> bool:
@@ -149,7 +152,8 @@ async def callback(event):
                 prefs['categories'].remove(cat)
 
             subscriptions[uid] = prefs
-            save_subscriptions()
+            save_subscriptions(uid)
+            routing_index.update_user(uid, prefs)
             # Refresh subcategory menu (stay on page 0)
             subcats = list(categories[cat]['subcategories'].keys())
             title, buttons = build_toggle_menu(
@@ -207,7 +211,9 @@ async def callback(event):
             if 'trial_start' not in prefs:
                 prefs['trial_start'] = datetime.now(timezone.utc).isoformat()
                 subscriptions[uid] = prefs
-                save_subscriptions()
+                save_subscriptions(uid)
+                expiry_scheduler.update_user(uid, prefs)
+                routing_index.update_user(uid, prefs)
                 await event.answer('🎁 Вы активировали 2-дневный пробный период!', alert=True)
 
         # Categories submenu
@@ -249,7 +255,8 @@ async def callback(event):
             else:
                 prefs['categories'].append(cat)
             subscriptions[uid] = prefs
-            save_subscriptions()
+            save_subscriptions(uid)
+            routing_index.update_user(uid, prefs)
             # Refresh categories submenu (stay on page 0)
             selected_cats = [
                 c for c in categories.keys()
@@ -287,7 +294,8 @@ async def callback(event):
             else:
                 prefs['locations'].append(loc)
             subscriptions[uid] = prefs
-            save_subscriptions()
+            save_subscriptions(uid)
+            routing_index.update_user(uid, prefs)
             # Refresh locations submenu, default to page 0
             title, buttons = build_toggle_menu(
                 'Локации (✅ = выбрано)',
@@ -322,7 +330,8 @@ async def callback(event):
             prefs['locations'] = []
             prefs['subcats'] = {}
             subscriptions[uid] = prefs
-            save_subscriptions()
+            save_subscriptions(uid)
+            routing_index.update_user(uid, prefs)
             # Acknowledge reset
             await event.answer('🔄 Все фильтры сброшены', alert=True)
             # Redisplay settings submenu
@@ -429,7 +438,7 @@ async def callback(event):
             prefs = subscriptions.get(uid, {})
             prefs['awaiting_screenshot'] = True
             subscriptions[uid] = prefs
-            save_subscriptions()
+            save_subscriptions(uid)
 
         # Admin approval callbacks
         elif data.startswith('approve:'):
@@ -449,7 +458,10 @@ async def callback(event):
             prefs.pop('trial_expired_notified', None)
             prefs.pop('paid_expired_notified', None)
             # Save updated subscriptions
-            save_subscriptions()
+            save_subscriptions(uid)
+            # Reschedule expiry and put the user back into routing
+            expiry_scheduler.update_user(uid, prefs)
+            routing_index.update_user(uid, prefs)
             # Notify admin and user with local time
             end_str = end_local.strftime('%Y-%m-%d %H:%M (UTC+3)')
             await safe_edit(event, f"✅ Подписка пользователя {uid} активирована до {end_str}")
@@ -477,6 +489,24 @@ async def callback(event):
         # Ignore if content is the same
         pass
     
+@bot_client.on(events.NewMessage(pattern='/reload_categories'))
+async def reload_categories(event):
+    """Админ: перечитать categories.json без рестарта."""
+    if event.sender_id != ADMIN_ID:
+        return
+    summary = await category_reloader.reload(force=True)
+    if summary.get("error"):
+        await event.reply(f"❌ categories.json не загружен: {summary['error']}")
+        return
+    await event.reply(
+        f"✅ Категории перезагружены за {summary['seconds']} с\n"
+        f"Добавлены: {', '.join(summary['added']) or '—'}\n"
+        f"Удалены: {', '.join(summary['removed']) or '—'}\n"
+        f"Изменены: {', '.join(summary['changed']) or '—'}\n"
+        f"Ключевых слов: {summary['keywords']}, подписчиков в индексе: {summary['subscribers']}"
+    )
+
+
 @bot_client.on(events.NewMessage(func=lambda e: e.is_private and (e.photo or e.document)))
 async def handle_payment_screenshot(event):
     user_id = str(event.sender_id)
@@ -487,7 +517,7 @@ async def handle_payment_screenshot(event):
     # Clear the flag so future photos won't trigger
     prefs.pop('awaiting_screenshot', None)
     subscriptions[user_id] = prefs
-    save_subscriptions()
+    save_subscriptions(user_id)
     # Notify admin via Telethon
     await bot_client.send_message(
         ADMIN_ID,